@@ -0,0 +1,442 @@
+# IMPORTS
+##############################################################################
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+import requests
+from colppy_api import PayloadBuilder, ResponseParser, \
+    StreamingResponseParser
+from fake_colppy_server import FakeColppyDataset, FakeColppyService
+from inventory_updater import DepositInventoryUpdater
+from rate_limiter import RequestThrottle
+import logging
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="benchmark.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# FAKE BACKENDS
+##############################################################################
+
+class InMemoryColppyResponse():
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("HTTP status %d" % self.status_code)
+
+    def json(self):
+        return json.loads(self.body)
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class InMemoryColppySession():
+    # Answers like FakeColppyServer but without sockets, so benchmarks
+    # measure this code and not the loopback interface.
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, url, json=None, stream=False, timeout=None):
+        return self.answer(json)
+
+    def post(self, url, json=None, stream=False, timeout=None):
+        return self.answer(json)
+
+    def answer(self, payload):
+        content = {"service": payload.get("service"),
+                   "result": {"estado": 0},
+                   "response": self.service.answer(payload)}
+        return InMemoryColppyResponse(200, json.dumps(content)
+                                      .encode("utf-8"))
+
+    def close(self):
+        pass
+
+
+class InMemoryGoogleSpread():
+    # Same interface as GoogleSpread. Only keeps what the updater sends.
+    def __init__(self, spread_name="benchmark"):
+        self.spread_url = "memory://%s" % spread_name
+        self.sheets = {}
+        self.sheet = None
+        self.update_cells_count = 0
+        self.updated_values_count = 0
+
+    def find_sheet(self, sheet):
+        if sheet in self.sheets:
+            return sheet
+        return None
+
+    def open_sheet(self, sheet, create=False):
+        if create:
+            self.sheets.setdefault(sheet, None)
+        self.sheet = sheet
+
+    def df_to_sheet(self, df, index=True, headers=True, start_cell=(1, 1),
+                    sheet=None, replace=False):
+        self.sheets[sheet or self.sheet] = df
+
+    def sheet_to_df(self, index=1, header_rows=1, start_row=1, sheet=None):
+        return self.sheets[sheet or self.sheet].copy()
+
+    def update_cells(self, start, end, vals, sheet=None):
+        self.update_cells_count += 1
+        self.updated_values_count += len(vals)
+
+    def delete_sheet(self, sheet):
+        self.sheets.pop(sheet, None)
+
+
+# BENCHMARKS
+##############################################################################
+
+class BenchmarkSuite():
+    default_sizes = (1000, 10000, 100000)
+    benchmark_names = ("payload_build", "response_parsing",
+                       "streaming_response_parsing",
+                       "dataframe_construction", "update_loop",
+                       "batch_upload_preparation", "end_to_end")
+
+    def __init__(self, sizes=None, benchmarks=None, repeat=3,
+                 deposit_name="Local", batch_size=100, max_in_flight=8,
+                 trace_memory=True, silence_logs=True,
+                 results_path="cache/benchmark_results.jsonl",
+                 app_configuraton=None):
+        if not benchmarks:
+            benchmarks = self.benchmark_names
+        self.check_benchmarks(benchmarks)
+        self.sizes = tuple(sizes or self.default_sizes)
+        self.benchmarks = tuple(benchmarks)
+        self.repeat = repeat
+        self.deposit_name = deposit_name
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.trace_memory = trace_memory
+        self.silence_logs = silence_logs
+        self.results_path = results_path
+        self.app_configuraton = app_configuraton
+
+    def check_benchmarks(self, benchmarks):
+        unknown_benchmarks = set(benchmarks) - set(self.benchmark_names)
+        if unknown_benchmarks:
+            logger.error("Unknown benchmarks %s. Available benchmarks: %s"
+                         % (sorted(unknown_benchmarks),
+                            self.benchmark_names))
+            raise ValueError("Wrong benchmark name.")
+
+    def run(self):
+        logger.info("Running benchmarks %s for sizes %s..."
+                    % (self.benchmarks, self.sizes))
+        results = []
+        for size in self.sizes:
+            dataset = FakeColppyDataset(total_items=size)
+            for name in self.benchmarks:
+                logger.info("Running %s for %d items..." % (name, size))
+                get_run = getattr(self, "get_%s_run_for" % name)
+                result = self.measure(get_run, dataset)
+                result.update({"benchmark": name, "size": size})
+                logger.info("%s for %d items: %.3f secs, %.0f items/sec."
+                            % (name, size, result["best_secs"],
+                               result["items_per_sec"]))
+                results.append(result)
+        return {"started_at": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "repeat": self.repeat,
+                "results": results}
+
+    def measure(self, get_run, dataset):
+        # Logs are silenced while measuring, or big runs mostly measure
+        # the terminal.
+        with self.get_silenced_logs():
+            timings = []
+            for attempt in range(self.repeat):
+                run = get_run(dataset)
+                start_time = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start_time)
+            peak_memory_in_mb = None
+            if self.trace_memory:
+                peak_memory_in_mb = self.get_peak_memory_for(get_run(dataset))
+        best_secs = min(timings)
+        return {"best_secs": best_secs,
+                "median_secs": statistics.median(timings),
+                "items_per_sec": dataset.total_items / best_secs
+                if best_secs else None,
+                "peak_memory_in_mb": peak_memory_in_mb}
+
+    def get_peak_memory_for(self, run):
+        # Traced apart from the timings, tracemalloc slows everything down.
+        tracemalloc.start()
+        try:
+            run()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak / 2 ** 20
+
+    def get_silenced_logs(self):
+        return SilencedLogs(self.silence_logs)
+
+    def get_item_ids_for(self, dataset):
+        return [dataset.first_item_id + index
+                for index in range(dataset.total_items)]
+
+    def get_company_id_for(self, dataset):
+        return dataset.company_ids[0]
+
+    def get_payload_build_run_for(self, dataset):
+        payload_builder = PayloadBuilder(app_configuraton=self
+                                         .app_configuraton)
+        company_id = self.get_company_id_for(dataset)
+        item_ids = self.get_item_ids_for(dataset)
+
+        def run():
+            for item_id in item_ids:
+                payload_builder.get_list_deposits_stock_for_item_payload(
+                    item_id, company_id, "benchmark")
+        return run
+
+    def get_inventory_body_for(self, dataset):
+        service = FakeColppyService(dataset)
+        company_id = self.get_company_id_for(dataset)
+        items = dataset.get_items(company_id, 0, dataset.total_items)
+        content = {"service": {"operacion": "listar_itemsinventario"},
+                   "result": {"estado": 0},
+                   "response": service.succeed(items, len(items))}
+        return json.dumps(content).encode("utf-8")
+
+    def get_response_parsing_run_for(self, dataset):
+        body = self.get_inventory_body_for(dataset)
+
+        def run():
+            response = InMemoryColppyResponse(200, body)
+            ResponseParser(response).get_response_content()["data"]
+        return run
+
+    def get_streaming_response_parsing_run_for(self, dataset):
+        body = self.get_inventory_body_for(dataset)
+
+        def run():
+            response = InMemoryColppyResponse(200, body)
+            parser = StreamingResponseParser(response, "data")
+            for item in parser.iter_records():
+                pass
+        return run
+
+    def get_dataframe_construction_run_for(self, dataset):
+        company_id = self.get_company_id_for(dataset)
+        items = dataset.get_items(company_id, 0, dataset.total_items)
+        updater = DepositInventoryUpdater()
+
+        def run():
+            updater.updated_inventory = updater \
+                .get_columns_from_items(iter(items))
+            updater.convert_inventory_data_to_df_with_header()
+        return run
+
+    def get_updater_with_df_for(self, dataset):
+        updater = DepositInventoryUpdater()
+        company_id = self.get_company_id_for(dataset)
+        items = dataset.get_items(company_id, 0, dataset.total_items)
+        updater.updated_inventory = updater.get_columns_from_items(items)
+        updater.convert_inventory_data_to_df_with_header()
+        updater.deposit_name = self.deposit_name
+        updater.spread = InMemoryGoogleSpread()
+        updater.is_new_worksheet = True
+        updater.start_cell = (3, 1)
+        updater.total_rows = len(updater.df.index)
+        updater.last_row = updater.start_cell[0] + updater.total_rows
+        return updater
+
+    def get_update_loop_run_for(self, dataset):
+        updater = self.get_updater_with_df_for(dataset)
+        updater.set_cols_to_update()
+        updater.reset_pending_values()
+        fetched_deposits = [(item_id, dataset.get_deposits_for(item_id))
+                            for item_id in updater.df.index]
+
+        def run():
+            for item_id, deposits in fetched_deposits:
+                updater.try_to_update_cells_for(item_id, deposits)
+            updater.merge_pending_values_into_df()
+        return run
+
+    def get_batch_upload_preparation_run_for(self, dataset):
+        updater = self.get_updater_with_df_for(dataset)
+        total_batches = -(-dataset.total_items // self.batch_size)
+
+        def run():
+            updater.pre_update_setup(self.batch_size)
+            for batch in range(total_batches):
+                updater.upload_batch_to_sheet()
+        return run
+
+    def get_end_to_end_run_for(self, dataset):
+        updater = DepositInventoryUpdater(max_in_flight=self.max_in_flight)
+
+        def run():
+            updater.setup_caller(None,
+                                 app_configuraton=self.app_configuraton)
+            self.connect_caller_to_dataset(updater.caller, dataset)
+            try:
+                updater.spread = InMemoryGoogleSpread()
+                updater.set_inventory_df()
+                updater.check_and_set_deposit_name(self.deposit_name)
+                updater.start_or_resume_inventory_updating(self.batch_size)
+            finally:
+                updater.caller.close()
+            return updater
+        return run
+
+    def connect_caller_to_dataset(self, caller, dataset):
+        requester = caller.requester
+        requester.http_session = InMemoryColppySession(
+            FakeColppyService(dataset))
+        requester.throttle = RequestThrottle(
+            rate_per_sec=None, initial_concurrency=self.max_in_flight)
+
+    def save(self, run_results):
+        folder = os.path.dirname(self.results_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(self.results_path, "a") as f:
+            f.write(json.dumps(run_results) + "\n")
+        logger.info("Benchmark results saved to %s." % self.results_path)
+
+    def get_previous_run_results(self):
+        try:
+            with open(self.results_path) as f:
+                lines = [line for line in f if line.strip()]
+        except FileNotFoundError:
+            return None
+        if not lines:
+            return None
+        return json.loads(lines[-1])
+
+    def compare_with(self, previous_run_results, run_results):
+        previous_secs = {(result["benchmark"], result["size"]):
+                         result["best_secs"]
+                         for result in previous_run_results["results"]}
+        comparison = []
+        for result in run_results["results"]:
+            key = (result["benchmark"], result["size"])
+            if key not in previous_secs:
+                continue
+            change = result["best_secs"] / previous_secs[key] - 1 \
+                if previous_secs[key] else None
+            comparison.append({"benchmark": key[0], "size": key[1],
+                               "previous_secs": previous_secs[key],
+                               "best_secs": result["best_secs"],
+                               "change": change})
+        return comparison
+
+    def run_compare_and_save(self):
+        previous_run_results = self.get_previous_run_results()
+        run_results = self.run()
+        comparison = []
+        if previous_run_results:
+            comparison = self.compare_with(previous_run_results,
+                                           run_results)
+        self.save(run_results)
+        return run_results, comparison
+
+
+class SilencedLogs():
+    def __init__(self, silence=True):
+        self.silence = silence
+
+    def __enter__(self):
+        if self.silence:
+            logging.disable(logging.INFO)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.silence:
+            logging.disable(logging.NOTSET)
+
+
+# MAIN
+##############################################################################
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Colppy to Google Sheets hot paths.")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=BenchmarkSuite.default_sizes)
+    parser.add_argument("--benchmarks", nargs="+",
+                        choices=BenchmarkSuite.benchmark_names)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--results",
+                        default="cache/benchmark_results.jsonl")
+    return parser.parse_args()
+
+
+def print_results(run_results, comparison):
+    print("%-28s %8s %10s %10s %12s %10s"
+          % ("benchmark", "items", "best s", "median s", "items/s",
+             "peak MB"))
+    for result in run_results["results"]:
+        peak_memory_in_mb = result["peak_memory_in_mb"]
+        print("%-28s %8d %10.3f %10.3f %12.0f %10s"
+              % (result["benchmark"], result["size"], result["best_secs"],
+                 result["median_secs"], result["items_per_sec"] or 0,
+                 "-" if peak_memory_in_mb is None
+                 else "%.1f" % peak_memory_in_mb))
+    if comparison:
+        print("\nChange against previous run:")
+    for compared in comparison:
+        change = compared["change"]
+        print("%-28s %8d %10.3f -> %8.3f %+8.1f%%"
+              % (compared["benchmark"], compared["size"],
+                 compared["previous_secs"], compared["best_secs"],
+                 0 if change is None else change * 100))
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    suite = BenchmarkSuite(arguments.sizes, arguments.benchmarks,
+                           arguments.repeat,
+                           batch_size=arguments.batch_size,
+                           max_in_flight=arguments.max_in_flight,
+                           trace_memory=not arguments.no_memory,
+                           silence_logs=not arguments.verbose,
+                           results_path=arguments.results)
+    print_results(*suite.run_compare_and_save())
@@ -2,9 +2,22 @@
 ##############################################################################
 
 import requests
+import requests.adapters
 import datetime
-import copy
+import threading
+import functools
+import itertools
+import json
+import codecs
+import time
 from app_configurator import ParseConfiguration, PayloadBuilderConfigurator
+from concurrent_fetcher import ConcurrentFetcher
+from rate_limiter import RequestThrottle
+from metrics import MetricsRegistry
+from tracing import Tracer
+from retry_policy import RetryPolicy, CircuitBreaker
+from colppy_records import Invoice, DiaryMovement, InventoryItem, \
+    DepositStock, RecordColumns
 import logging
 
 
@@ -37,54 +50,315 @@ logger.addHandler(stream_handler)
 ################
 
 class Caller():
+    session_duration_in_mins = 25
+    refresh_margin_in_mins = 5
+
     def __init__(self, payload_templates=None,
-                 app_configuraton=None, state="testing"):
+                 app_configuraton=None, state="testing",
+                 pool_connections=10, pool_maxsize=10, pool_block=False,
+                 cache=None, bypass_cache=False, session_store=None,
+                 refresh_session_in_background=False, throttle=None,
+                 retry_policies=None, circuit_breaker=None, base_url=None,
+                 metrics=None, tracer=None):
         self.state = state
+        self.base_url = base_url
+        self.metrics = metrics
+        if not tracer:
+            tracer = Tracer.get_shared()
+        self.tracer = tracer
+        self.cache = cache
+        self.bypass_cache = bypass_cache
+        self.session_store = session_store
+        self.refresh_session_in_background = refresh_session_in_background
+        self.session_refresher = None
         self.payload_builder = PayloadBuilder(payload_templates,
-                                              app_configuraton)
+                                              app_configuraton, tracer)
+        # Built once so logging in never touches the shared payloads.
+        self.login_payload = self.payload_builder.get_login_payload()
         self.available_companies = ParseConfiguration(app_configuraton) \
             .try_to_get_default_available_companies()
+        # Login, company checks and payload building share mutable state.
+        # Only the HTTP call itself runs outside the lock.
+        self.lock = threading.RLock()
+        if not throttle:
+            throttle = RequestThrottle.get_shared()
+        self.throttle = throttle
+        self.retry_policies = retry_policies
+        if not circuit_breaker:
+            circuit_breaker = CircuitBreaker()
+        self.circuit_breaker = circuit_breaker
+        self.open_http_session(pool_connections, pool_maxsize, pool_block)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open_http_session(self, pool_connections, pool_maxsize, pool_block):
+        logger.info("Opening HTTP session with %d connections per host...",
+                    pool_maxsize)
+        self.http_session = requests.Session()
+        adapter = requests.adapters \
+            .HTTPAdapter(pool_connections=pool_connections,
+                         pool_maxsize=pool_maxsize,
+                         pool_block=pool_block)
+        self.http_session.mount("https://", adapter)
+        self.http_session.mount("http://", adapter)
+        self.requester = RequestMaker(self.state,
+                                      http_session=self.http_session,
+                                      throttle=self.throttle,
+                                      retry_policies=self.retry_policies,
+                                      circuit_breaker=self.circuit_breaker,
+                                      base_url=self.base_url,
+                                      metrics=self.metrics,
+                                      tracer=self.tracer)
+
+    def close(self):
+        if self.session_refresher:
+            self.stop_session_refresher()
+        logger.info("Closing HTTP session...")
+        self.http_session.close()
+        logger.info("Done.")
 
-    def get_invoices_for(self, dates_range=None, company_id=None):
-        self.get_session_key()
-        self.assert_company_is_available(company_id)
-        invoices_payload_parameters = (dates_range, company_id,
-                                       self.session_key)
-        logger.info("Preparing invoices payload...")
-        invoices_payload = self.payload_builder. \
-            get_list_invoices_payload(*invoices_payload_parameters)
-        logger.info("Payload ok.")
+    def get_invoices_for(self, dates_range=None, company_id=None,
+                         stream=False, page_size=None, prefetch_pages=0,
+                         shard_by=None, max_in_flight=4, record_format=None):
+        if shard_by:
+            records = self.get_sharded_records_for(self.get_invoices_for,
+                                                   "idFactura", dates_range,
+                                                   company_id, stream,
+                                                   page_size, shard_by,
+                                                   max_in_flight)
+            return self.format_records(records, stream, Invoice,
+                                       record_format)
+        with self.lock:
+            self.get_session_key()
+            self.assert_company_is_available(company_id)
+            invoices_payload_parameters = (dates_range, company_id,
+                                           self.session_key)
+            logger.info("Preparing invoices payload...")
+            invoices_payload = self.payload_builder. \
+                get_list_invoices_payload(*invoices_payload_parameters)
+            logger.info("Payload ok.")
         logger.info("Getting invoices...")
-        invoices_content = self.get_content_for_payload(invoices_payload)
-        invoices_data = invoices_content["data"]
-        logger.info("Got %d invoices." % len(invoices_data))
+        invoices_data = self.get_records_for_payload(invoices_payload, "data",
+                                                     stream, page_size,
+                                                     prefetch_pages, Invoice,
+                                                     record_format)
+        if not stream:
+            logger.info("Got %d invoices.", len(invoices_data))
         return invoices_data
 
+    def get_sharded_records_for(self, get_records, id_field, dates_range,
+                                company_id, stream, page_size, shard_by,
+                                max_in_flight):
+        shards = DatesSharder(dates_range).get_shards(shard_by)
+        logger.info("Split dates range in %d shards.", len(shards))
+        records = self.stream_sharded_records(get_records, id_field, shards,
+                                              company_id, page_size,
+                                              max_in_flight)
+        if stream:
+            return records
+        return list(records)
+
+    def stream_sharded_records(self, get_records, id_field, shards,
+                               company_id, page_size, max_in_flight):
+        get_shard_records = functools.partial(self.get_records_for_shard,
+                                              get_records, company_id,
+                                              page_size)
+        get_shard_records = self.tracer \
+            .bind_to_current_span(get_shard_records)
+        fetcher = ConcurrentFetcher(max_in_flight)
+        seen_ids = set()
+        for shard, shard_records in fetcher.fetch_in_order(get_shard_records,
+                                                           shards):
+            if isinstance(shard_records, Exception):
+                raise shard_records
+            for record in shard_records:
+                record_id = record.get(id_field)
+                if record_id is not None:
+                    if record_id in seen_ids:
+                        continue
+                    seen_ids.add(record_id)
+                yield record
+
+    def get_records_for_shard(self, get_records, company_id, page_size,
+                              shard):
+        with self.tracer.span("colppy.get_shard", start_date=shard[0],
+                              end_date=shard[1]):
+            return get_records(shard, company_id, page_size=page_size)
+
+    def get_invoices_for_companies(self, dates_range, company_ids=None,
+                                   max_in_flight=4, **kwargs):
+        return self.get_for_companies(self.get_invoices_for, company_ids,
+                                      max_in_flight, dates_range, **kwargs)
+
+    def get_diary_for_companies(self, dates_range, company_ids=None,
+                                max_in_flight=4, **kwargs):
+        return self.get_for_companies(self.get_diary_for, company_ids,
+                                      max_in_flight, dates_range, **kwargs)
+
+    def get_inventory_for_companies(self, company_ids=None, max_in_flight=4,
+                                    **kwargs):
+        return self.get_for_companies(self.get_inventory_for, company_ids,
+                                      max_in_flight, **kwargs)
+
+    def get_for_companies(self, get_records, company_ids, max_in_flight,
+                          *args, **kwargs):
+        # Each company is fetched with its own ID and never streamed, so
+        # these are rejected before any request instead of once per company.
+        fixed_keys = sorted({"company_id", "stream"} & set(kwargs))
+        if fixed_keys:
+            logger.error("%s cannot be set when getting data for companies.",
+                         ", ".join(fixed_keys))
+            raise ValueError("Fixed arguments for companies: %s."
+                             % ", ".join(fixed_keys))
+        return self.iter_for_companies(get_records, company_ids,
+                                       max_in_flight, args, kwargs)
+
+    def iter_for_companies(self, get_records, company_ids, max_in_flight,
+                           args, kwargs):
+        # Every company shares this caller's login, HTTP pool and throttle.
+        # A failing company yields its error instead of stopping the rest.
+        company_ids = self.get_company_ids_for(company_ids)
+        self.get_session_key()
+        logger.info("Getting data for %d companies...", len(company_ids))
+        get_company_records = functools.partial(self.get_records_for_company,
+                                                get_records, args, kwargs)
+        get_company_records = self.tracer \
+            .bind_to_current_span(get_company_records)
+        fetcher = ConcurrentFetcher(max_in_flight)
+        for company_id, records in fetcher \
+                .fetch_as_completed(get_company_records, company_ids):
+            if isinstance(records, Exception):
+                logger.error("Could not get data for company %s: %r",
+                             company_id, records)
+            yield company_id, records
+        logger.info("Got data for all companies.")
+
+    def get_company_ids_for(self, company_ids):
+        if company_ids:
+            return list(company_ids)
+        with self.lock:
+            if not self.available_companies:
+                self.update_available_companies()
+            return [company_id for company_id
+                    in self.available_companies.values() if company_id]
+
+    def get_records_for_company(self, get_records, args, kwargs, company_id):
+        # Records are read in the worker thread, so they are never streamed.
+        with self.tracer.span("colppy.get_company_records",
+                              company_id=company_id):
+            return get_records(*args, company_id=company_id, stream=False,
+                               **kwargs)
+
     def get_session_key(self):
-        seconds_per_min = 60
-        session_duration_in_mins = 25
-        now = datetime.datetime.now()
+        with self.lock:
+            if not self.is_session_valid(self.session_duration_in_mins):
+                self.renew_session_key()
+            if self.refresh_session_in_background \
+                    and not self.session_refresher:
+                self.start_session_refresher()
+        return self.session_key
+
+    def is_session_valid(self, max_age_in_mins):
         try:
-            delta_mins = ((now - self.login_time).total_seconds()
-                          / seconds_per_min)
-            if delta_mins > session_duration_in_mins:
-                self.login_and_set_session_key()
+            session_age = self.get_session_age_in_mins(self.login_time)
         except AttributeError:
+            return False
+        return session_age <= max_age_in_mins
+
+    def get_session_age_in_mins(self, login_time):
+        seconds_per_min = 60
+        now = datetime.datetime.now()
+        return (now - login_time).total_seconds() / seconds_per_min
+
+    def get_reusable_session_age_in_mins(self):
+        return self.session_duration_in_mins - self.refresh_margin_in_mins
+
+    def renew_session_key(self):
+        if self.session_store:
+            self.renew_session_key_from_store()
+        else:
             self.login_and_set_session_key()
-        return self.session_key
+
+    def renew_session_key_from_store(self):
+        account = self.get_session_account()
+        # Holding the store lock while logging in keeps other processes
+        # from logging in at the same time. They reuse this key instead.
+        with self.session_store.locked():
+            stored_session = self.session_store.get_session_for(account)
+            if self.is_stored_session_reusable(stored_session):
+                logger.info("Reusing stored session key.")
+                self.session_key, self.login_time = stored_session
+            else:
+                self.login_and_set_session_key()
+                self.session_store.save_session_for(account,
+                                                    self.session_key,
+                                                    self.login_time)
+
+    def is_stored_session_reusable(self, stored_session):
+        if not stored_session:
+            return False
+        stored_key, stored_login_time = stored_session
+        session_age = self.get_session_age_in_mins(stored_login_time)
+        return session_age < self.get_reusable_session_age_in_mins()
+
+    def get_session_account(self):
+        user = self.login_payload["parameters"]["usuario"]
+        return "%s:%s" % (self.base_url or self.state, user)
 
     def login_and_set_session_key(self):
+        # Never takes self.lock: the background refresher calls this while
+        # holding the session store lock.
         open_session = self.login()
         self.session_key = open_session["data"]["claveSesion"]
         self.login_time = datetime.datetime.now()
 
+    def start_session_refresher(self):
+        logger.info("Starting background session refresher...")
+        self.stop_refreshing = threading.Event()
+        self.session_refresher = threading.Thread(
+                                            target=self.keep_session_fresh,
+                                            daemon=True)
+        self.session_refresher.start()
+
+    def stop_session_refresher(self):
+        logger.info("Stopping background session refresher...")
+        self.stop_refreshing.set()
+        self.session_refresher.join(timeout=5)
+        self.session_refresher = None
+
+    def keep_session_fresh(self):
+        retry_in_secs = 30
+        while not self.stop_refreshing.wait(self.get_secs_until_refresh()):
+            try:
+                self.refresh_session_key()
+            except Exception:
+                logger.exception("Could not refresh session key.")
+                if self.stop_refreshing.wait(retry_in_secs):
+                    break
+
+    def get_secs_until_refresh(self):
+        seconds_per_min = 60
+        session_age = self.get_session_age_in_mins(self.login_time)
+        mins_until_refresh = (self.get_reusable_session_age_in_mins()
+                              - session_age)
+        return max(0, mins_until_refresh * seconds_per_min)
+
+    def refresh_session_key(self):
+        # Runs without holding self.lock so payloads can still be built
+        # with the current key while the new login is in flight.
+        if not self.is_session_valid(self.get_reusable_session_age_in_mins()):
+            logger.info("Refreshing session key before it expires...")
+            self.renew_session_key()
+
     def login(self):
-        login_payload = self.payload_builder.get_login_payload()
-        logger.info("Trying to log into Colppy as %s..." % self.state)
-        login_requester = RequestMaker(self.state)
-        login_response = login_requester.get_response(login_payload,
-                                                      request_type="post")
-        login_content = ResponseParser(login_response).get_response_content()
+        logger.info("Trying to log into Colppy as %s...", self.state)
+        with self.tracer.span("colppy.login", state=self.state):
+            login_content = self.requester.get_content(self.login_payload,
+                                                       request_type="post")
         logger.info("Login OK.")
         return login_content
 
@@ -124,75 +398,288 @@ class Caller():
             logger.error("Check keys for company id and name")
 
     def get_companies(self):
-        self.get_session_key()
-        logger.info("Preparing companies payload...")
-        companies_payload = self.payload_builder \
-            .get_list_companies_payload(self.session_key)
-        logger.info("Payload ok.")
+        with self.lock:
+            self.get_session_key()
+            logger.info("Preparing companies payload...")
+            companies_payload = self.payload_builder \
+                .get_list_companies_payload(self.session_key)
+            logger.info("Payload ok.")
         logger.info("Getting companies...")
         companies_content = self.get_content_for_payload(companies_payload)
         companies_data = companies_content["data"]
-        logger.info("Got %d companies." % len(companies_data))
+        logger.info("Got %d companies.", len(companies_data))
         return companies_data
 
     def get_content_for_payload(self, payload):
-        requester = RequestMaker(self.state)
-        response = requester.get_response(payload)
-        content = ResponseParser(response).get_response_content()
+        # Staging, production and other servers answer the same payload
+        # differently, so they never share cached answers.
+        cache_scope = self.get_session_account()
+        if self.cache and not self.bypass_cache:
+            cached_content = self.cache.get_content_for(payload,
+                                                        cache_scope)
+            if cached_content is not None:
+                logger.debug("Got content from cache.")
+                return cached_content
+        content = self.requester.get_content(payload)
+        if self.cache:
+            self.cache.set_content_for(payload, content, cache_scope)
         return content
 
-    def get_diary_for(self, dates_range=None, company_id=None):
-        self.get_session_key()
-        self.assert_company_is_available(company_id)
-        diary_payload_parameters = (dates_range, company_id, self.session_key)
-        logger.info("Preparing diary payload...")
-        diary_payload = self.payload_builder \
-            .get_list_diary_payload(*diary_payload_parameters)
-        logger.info("Payload ok.")
+    def get_records_for_payload(self, payload, records_key, stream=False,
+                                page_size=None, prefetch_pages=0,
+                                record_class=None, record_format=None):
+        # Streamed records are also decoded incrementally from the response.
+        records = self.stream_records_for_payload(payload, records_key,
+                                                  page_size, prefetch_pages,
+                                                  decode_incrementally=stream)
+        return self.format_records(records, stream, record_class,
+                                   record_format)
+
+    def format_records(self, records, stream, record_class, record_format):
+        # Records are converted once, as they are parsed. Columns are always
+        # built in full, even when the records were streamed.
+        if record_format == "columns":
+            return RecordColumns(record_class, records)
+        if record_format == "typed":
+            records = map(record_class.from_dict, records)
+        elif record_format:
+            logger.error("Record format must be typed or columns.")
+            raise ValueError("Wrong record format.")
+        if stream:
+            return records
+        return list(records)
+
+    def stream_records_for_payload(self, payload, records_key,
+                                   page_size=None, prefetch_pages=0,
+                                   decode_incrementally=False):
+        if not page_size:
+            page_size = self.get_page_size_from_template(payload)
+        first_records, first_content = self \
+            .get_page_records(payload, records_key, page_size, 0,
+                              decode_incrementally)
+        first_count = yield from self.yield_and_count(first_records)
+        # Colppy may answer short pages. Only without a total does a short
+        # page mean there are no more records.
+        total = self.get_total_from_content(first_content)
+        if total is None and first_count < page_size:
+            return
+        if total is not None and prefetch_pages and first_count == page_size:
+            yield from self.stream_prefetched_pages(payload, records_key,
+                                                    page_size, total,
+                                                    prefetch_pages)
+        else:
+            yield from self.stream_next_pages(payload, records_key,
+                                              page_size, total,
+                                              decode_incrementally,
+                                              first_count)
+
+    def yield_and_count(self, records):
+        count = 0
+        for record in records:
+            count += 1
+            yield record
+        return count
+
+    def get_page_size_from_template(self, payload):
+        try:
+            return payload["parameters"]["limit"]
+        except KeyError:
+            logger.exception("Could not find [parameters][limit] \
+                             in payload.")
+            raise KeyError("Could not get page size.")
+
+    def get_total_from_content(self, content):
+        try:
+            return int(content["total"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def stream_next_pages(self, payload, records_key, page_size, total,
+                          decode_incrementally=False, start=None):
+        if start is None:
+            start = page_size
+        while total is None or start < total:
+            limit = page_size
+            if total is not None:
+                limit = min(page_size, total - start)
+            page_records, page_content = self \
+                .get_page_records(payload, records_key, limit, start,
+                                  decode_incrementally)
+            page_count = yield from self.yield_and_count(page_records)
+            if total is None and page_count < page_size:
+                break
+            if not page_count:
+                logger.warning("No records from %d on, though total is %d.",
+                               start, total)
+                break
+            start += page_count
+
+    def stream_prefetched_pages(self, payload, records_key, page_size, total,
+                                prefetch_pages):
+        logger.info("Prefetching %d pages of %d records...",
+                    prefetch_pages, page_size)
+        page_starts = range(page_size, total, page_size)
+        get_page_content = functools.partial(self.get_content_for_page,
+                                             payload, page_size)
+        get_page_content = self.tracer.bind_to_current_span(get_page_content)
+        fetcher = ConcurrentFetcher(prefetch_pages)
+        for start, page_content in fetcher.fetch_in_order(get_page_content,
+                                                          page_starts):
+            if isinstance(page_content, Exception):
+                raise page_content
+            page_count = yield from self.yield_and_count(
+                page_content[records_key])
+            page_end = min(start + page_size, total)
+            if start + page_count < page_end:
+                # Short page. The rest of its range is read one by one.
+                yield from self.stream_next_pages(payload, records_key,
+                                                  page_size, page_end,
+                                                  start=start + page_count)
+
+    def get_page_records(self, payload, records_key, page_size, start,
+                         decode_incrementally=False):
+        # Incrementally decoded content is complete once records are consumed.
+        # Its span ends when the answer starts, not when it is parsed.
+        # Cached pages are read and saved whole.
+        if decode_incrementally and not self.cache:
+            logger.info("Streaming page from record %d...", start)
+            with self.tracer.span("colppy.get_page", start=start,
+                                  streamed=True):
+                page_payload = PageSetter(start, page_size) \
+                    .copy_payload_with_page(payload)
+                return self.requester.get_streaming_records(page_payload,
+                                                            records_key)
+        page_content = self.get_content_for_page(payload, page_size, start)
+        return page_content[records_key], page_content
+
+    def get_content_for_page(self, payload, page_size, start):
+        logger.info("Getting page from record %d...", start)
+        with self.tracer.span("colppy.get_page", start=start):
+            page_payload = PageSetter(start, page_size) \
+                .copy_payload_with_page(payload)
+            return self.get_content_for_payload(page_payload)
+
+    def get_diary_for(self, dates_range=None, company_id=None,
+                      stream=False, page_size=None, prefetch_pages=0,
+                      shard_by=None, max_in_flight=4, record_format=None):
+        if shard_by:
+            records = self.get_sharded_records_for(self.get_diary_for,
+                                                   "idMovimiento",
+                                                   dates_range, company_id,
+                                                   stream, page_size,
+                                                   shard_by, max_in_flight)
+            return self.format_records(records, stream, DiaryMovement,
+                                       record_format)
+        with self.lock:
+            self.get_session_key()
+            self.assert_company_is_available(company_id)
+            diary_payload_parameters = (dates_range, company_id,
+                                        self.session_key)
+            logger.info("Preparing diary payload...")
+            diary_payload = self.payload_builder \
+                .get_list_diary_payload(*diary_payload_parameters)
+            logger.info("Payload ok.")
         logger.info("Getting diary...")
-        diary_content = self.get_content_for_payload(diary_payload)
-        diary_data = diary_content["movimientos"]
-        logger.info("Got %d diary movements." % len(diary_data))
+        diary_data = self.get_records_for_payload(diary_payload, "movimientos",
+                                                  stream, page_size,
+                                                  prefetch_pages,
+                                                  DiaryMovement,
+                                                  record_format)
+        if not stream:
+            logger.info("Got %d diary movements.", len(diary_data))
         return diary_data
 
-    def get_inventory_for(self, company_id=None):
-        self.get_session_key()
-        self.assert_company_is_available(company_id)
-        inventory_payload_parameters = (company_id, self.session_key)
-        logger.info("Preparing inventory payload...")
-        inventory_payload = self.payload_builder \
-            .get_list_inventory_payload(*inventory_payload_parameters)
-        logger.info("Payload ok.")
+    def get_inventory_for(self, company_id=None, stream=False, page_size=None,
+                          prefetch_pages=0, record_format=None):
+        with self.lock:
+            self.get_session_key()
+            self.assert_company_is_available(company_id)
+            inventory_payload_parameters = (company_id, self.session_key)
+            logger.info("Preparing inventory payload...")
+            inventory_payload = self.payload_builder \
+                .get_list_inventory_payload(*inventory_payload_parameters)
+            logger.info("Payload ok.")
         logger.info("Getting inventory...")
-        inventory_content = self.get_content_for_payload(inventory_payload)
-        inventory_data = inventory_content["data"]
-        logger.info("Got %d items." % len(inventory_data))
+        inventory_data = self.get_records_for_payload(inventory_payload,
+                                                      "data", stream,
+                                                      page_size,
+                                                      prefetch_pages,
+                                                      InventoryItem,
+                                                      record_format)
+        if not stream:
+            logger.info("Got %d items.", len(inventory_data))
         return inventory_data
 
-    def get_deposits_stock_for(self, item_id, company_id=None):
-        self.get_session_key()
-        self.assert_company_is_available(company_id)
-        deposit_payload_parameters = (item_id, company_id, self.session_key)
-        logger.info("Preparing deposit payload...")
-        deposit_payload = self.payload_builder \
-            .get_list_deposits_stock_for_item_payload(*deposit_payload_parameters)
-        logger.info("Payload ok.")
-        logger.info("Getting deposits for %s..." % item_id)
-        deposit_content = self.get_content_for_payload(deposit_payload)
-        deposit_data = deposit_content["data"]
-        logger.info("Got deposits.")
+    def get_deposits_stock_for(self, item_id, company_id=None,
+                               record_format=None):
+        with self.lock:
+            self.get_session_key()
+            self.assert_company_is_available(company_id)
+            deposit_payload_parameters = (item_id, company_id,
+                                          self.session_key)
+            logger.debug("Preparing deposit payload...")
+            deposit_payload = self.payload_builder \
+                .get_list_deposits_stock_for_item_payload(
+                                                *deposit_payload_parameters)
+            logger.debug("Payload ok.")
+        logger.debug("Getting deposits for %s...", item_id)
+        with self.tracer.span("colppy.get_deposits", item_id=item_id):
+            deposit_content = self.get_content_for_payload(deposit_payload)
+        deposit_data = self.format_records(deposit_content["data"], False,
+                                           DepositStock, record_format)
+        logger.debug("Got deposits.")
         return deposit_data
 
+    def get_deposits_stock_for_many(self, item_ids, company_id=None,
+                                    max_in_flight=8, record_format=None):
+        with self.lock:
+            self.assert_company_is_available(company_id)
+        logger.info("Getting deposits for many items...")
+        deposit_payloads = self.iter_deposit_payloads_for(item_ids, company_id)
+        get_deposits_data = self.tracer \
+            .bind_to_current_span(self.get_deposits_data_for_payload)
+        fetcher = ConcurrentFetcher(max_in_flight)
+        fetched_deposits = fetcher \
+            .fetch_as_completed(get_deposits_data, deposit_payloads)
+        for (item_id, deposit_payload), deposit_data in fetched_deposits:
+            if record_format and not isinstance(deposit_data, Exception):
+                deposit_data = self.format_records(deposit_data, False,
+                                                   DepositStock,
+                                                   record_format)
+            yield item_id, deposit_data
+        logger.info("Got deposits for all items.")
+
+    def iter_deposit_payloads_for(self, item_ids, company_id):
+        for item_id in item_ids:
+            session_key = self.get_session_key()
+            try:
+                deposit_payload = self.payload_builder \
+                    .get_list_deposits_stock_for_item_payload(item_id,
+                                                              company_id,
+                                                              session_key)
+            except ValueError as error:
+                deposit_payload = error
+            yield item_id, deposit_payload
+
+    def get_deposits_data_for_payload(self, item_id_and_payload):
+        item_id, deposit_payload = item_id_and_payload
+        if isinstance(deposit_payload, Exception):  # Wrong item ID.
+            raise deposit_payload
+        with self.tracer.span("colppy.get_deposits", item_id=item_id):
+            deposit_content = self.get_content_for_payload(deposit_payload)
+        return deposit_content["data"]
+
     def get_ccosts_for_type(self, ccost_type_1_or_2, company_id=None):
-        self.get_session_key()
-        self.assert_company_is_available(company_id)
-        ccost_payload_parameters = (ccost_type_1_or_2, company_id,
-                                    self.session_key)
-        logger.info("Preparing ccost payload...")
-        ccost_payload = self.payload_builder \
-            .get_list_ccost_payload(*ccost_payload_parameters)
-        logger.info("Payload ok.")
-        logger.info("Getting dccost for type number %d..." % ccost_type_1_or_2)
+        with self.lock:
+            self.get_session_key()
+            self.assert_company_is_available(company_id)
+            ccost_payload_parameters = (ccost_type_1_or_2, company_id,
+                                        self.session_key)
+            logger.info("Preparing ccost payload...")
+            ccost_payload = self.payload_builder \
+                .get_list_ccost_payload(*ccost_payload_parameters)
+            logger.info("Payload ok.")
+        logger.info("Getting dccost for type number %d...", ccost_type_1_or_2)
         ccost_content = self.get_content_for_payload(ccost_payload)
         ccost_data = ccost_content["data"]
         logger.info("Got ccosts.")
@@ -203,108 +690,215 @@ class Caller():
 ##########
 
 class PayloadBuilder():
-    def __init__(self, payload_templates=None, app_configuraton=None):
+    session_slot = ("parameters", "sesion")
+    company_id_slot = ("parameters", "idEmpresa")
+
+    slot_paths_per_payload = {
+        "login": {},
+        "list_companies": {"session": session_slot},
+        "list_ccosts": {"session": session_slot,
+                        "company_id": company_id_slot,
+                        "ccost_type": ("parameters", "ccosto")},
+        "list_diary": {"session": session_slot,
+                       "company_id": company_id_slot,
+                       "start_date": ("parameters", "fromDate"),
+                       "end_date": ("parameters", "toDate")},
+        "list_invoices": {"session": session_slot,
+                          "company_id": company_id_slot,
+                          "start_date": ("parameters", "filter", 0, "value"),
+                          "end_date": ("parameters", "filter", 1, "value")},
+        "list_inventory": {"session": session_slot,
+                           "company_id": company_id_slot},
+        "list_deposits_for_item": {"session": session_slot,
+                                   "company_id": company_id_slot,
+                                   "item_id": ("parameters", "idItem")}
+        }
+
+    def __init__(self, payload_templates=None, app_configuraton=None,
+                 tracer=None):
+        if not tracer:
+            tracer = Tracer.get_shared()
+        self.tracer = tracer
         self.configurator = ParseConfiguration(app_configuraton)
         self.default_company_id = self.configurator \
             .try_to_get_default_company_id()
         colppy_credentials = self.configurator \
             .get_colppy_credentials()
-        self.payloads = PayloadBuilderConfigurator(payload_templates) \
+        templates = PayloadBuilderConfigurator(payload_templates) \
             .get_configured_templates(colppy_credentials)
-        self.session_key = None
+        self.user = self.get_user_from_templates(templates)
+        self.compiled_payloads = self.compile_templates(templates)
+        # Last values used. Payloads built without them fall back to these.
+        self.session_key_and_session = None
+        self.company_id = None
+        self.dates_range = None
+
+    def get_user_from_templates(self, templates):
+        try:
+            return templates["login"]["parameters"]["usuario"]
+        except (KeyError, TypeError):
+            logger.exception("Could not find [parameters][usuario] \
+                             in login payload.")
+            raise KeyError("Could not set session key.")
+
+    def compile_templates(self, templates):
+        logger.info("Compiling payload templates...")
+        default_slot_paths = {"session": self.session_slot,
+                              "company_id": self.company_id_slot}
+        compiled_payloads = {}
+        for name, template in templates.items():
+            slot_paths = self.slot_paths_per_payload \
+                .get(name, default_slot_paths)
+            compiled_payloads[name] = CompiledPayload(name, template,
+                                                      slot_paths)
+        logger.info("Templates compiled.")
+        return compiled_payloads
 
     def get_login_payload(self):
-        return copy.deepcopy(self.payloads["login"])
+        return self.build_payload("login")
+
+    def build_payload(self, name, **slot_values):
+        with self.tracer.span("payload.build", payload=name):
+            return self.compiled_payloads[name].build(**slot_values)
 
     def get_list_companies_payload(self, session_key=None):
-        self.if_session_key_then_set_it_to_payloads(session_key)
-        return copy.deepcopy(self.payloads["list_companies"])
+        session = self.get_session_for(session_key)
+        return self.build_payload("list_companies", session=session)
 
-    def if_session_key_then_set_it_to_payloads(self, session_key):
-        if session_key:
-            self.session_key = session_key
-            self.payloads = SessionKeySetter(session_key) \
-                .set_key_to_payloads(self.payloads)
-        else:
-            if not self.session_key:
+    def get_session_for(self, session_key):
+        # Values are read once so concurrent builds never mix their inputs.
+        session_key_and_session = self.session_key_and_session
+        if not session_key:
+            if not session_key_and_session:
                 logger.error("Please provide a Session Key.")
                 raise ValueError("No session key.")
-            else:
-                logger.info("Session key already set to %s."
-                            % self.session_key)
+            return session_key_and_session[1]
+        if session_key_and_session \
+                and session_key_and_session[0] == session_key:
+            return session_key_and_session[1]
+        session = SessionKeySetter(session_key) \
+            .create_session_dict(self.user)
+        self.session_key_and_session = (session_key, session)
+        return session
+
+    @property
+    def session_key(self):
+        if self.session_key_and_session:
+            return self.session_key_and_session[0]
 
     def get_list_n_ccost_payload(self, ccost_type_1_or_2, company_id=None,
                                  session_key=None):
-        self.payloads = CCostTypeSetter(ccost_type_1_or_2) \
-            .set_ccost_type_to_payload(self.payloads)
-        self.if_session_key_then_set_it_to_payloads(session_key)
-        self.if_not_company_id_use_last_one_or_default(company_id)
-        return copy.deepcopy(self.payloads["list_ccosts"])
-
-    def if_not_company_id_use_last_one_or_default(self, company_id):
-        if company_id:
-            self.set_company_id_to_payloads(company_id)
-        else:
-            try:
-                logger.info("Company ID already set to %s." % self.company_id)
-            except AttributeError:
-                self.use_default_company_id_for_first_build()
-
-    def use_default_company_id_for_first_build(self):
-        company_id = self.default_company_id
-        if company_id != "":
-            self.set_company_id_to_payloads(company_id)
-        else:
+        ccost_type = CCostTypeSetter(ccost_type_1_or_2).ccost_type
+        session = self.get_session_for(session_key)
+        company_id = self.get_company_id_for(company_id)
+        return self.build_payload("list_ccosts", session=session,
+                                  company_id=company_id,
+                                  ccost_type=ccost_type)
+
+    def get_company_id_for(self, company_id):
+        if not company_id:
+            company_id = self.company_id or self.default_company_id
+        if not company_id:
             logger.error("Please provide a Company ID.")
             raise ValueError("No company ID.")
-
-    def set_company_id_to_payloads(self, company_id):
-        self.payloads = CompanyIdSetter(company_id) \
-            .set_company_id_from_input(self.payloads)
-        self.company_id = company_id
+        if company_id != self.company_id:
+            company_id = CompanyIdSetter(company_id).company_id
+            self.company_id = company_id
+            logger.info("Company set to %s.", company_id)
+        return company_id
 
     def get_list_invoices_payload(self, dates_range=None, company_id=None,
                                   session_key=None):
-        self.if_session_key_then_set_it_to_payloads(session_key)
-        self.if_not_company_id_use_last_one_or_default(company_id)
-        self.if_dates_then_set_them_to_payloads(dates_range)
-        return copy.deepcopy(self.payloads["list_invoices"])
-
-    def if_dates_then_set_them_to_payloads(self, dates_range):
+        session = self.get_session_for(session_key)
+        company_id = self.get_company_id_for(company_id)
+        start_date, end_date = self.get_dates_range_for(dates_range)
+        return self.build_payload("list_invoices", session=session,
+                                  company_id=company_id,
+                                  start_date=start_date, end_date=end_date)
+
+    def get_dates_range_for(self, dates_range):
         if dates_range:
-            self.payloads = DatesSetter(dates_range) \
-                .set_dates_to_payloads(self.payloads)
+            dates_range = DatesSetter(dates_range).dates_range
             self.dates_range = dates_range
-        else:
-            try:
-                logger.info("Dates range already set from %s to %s."
-                            % self.dates_range)
-            except AttributeError:
-                logger.exception("Please provide a dates range.")
-                raise ValueError("No dates provided.")
+            return dates_range
+        dates_range = self.dates_range
+        if not dates_range:
+            logger.error("Please provide a dates range.")
+            raise ValueError("No dates provided.")
+        return dates_range
 
     def get_list_diary_payload(self, dates_range=None, company_id=None,
                                session_key=None):
-        self.if_session_key_then_set_it_to_payloads(session_key)
-        self.if_not_company_id_use_last_one_or_default(company_id)
-        self.if_dates_then_set_them_to_payloads(dates_range)
-        return copy.deepcopy(self.payloads["list_diary"])
+        session = self.get_session_for(session_key)
+        company_id = self.get_company_id_for(company_id)
+        start_date, end_date = self.get_dates_range_for(dates_range)
+        return self.build_payload("list_diary", session=session,
+                                  company_id=company_id,
+                                  start_date=start_date, end_date=end_date)
 
     def get_list_inventory_payload(self, company_id=None, session_key=None):
-        self.if_session_key_then_set_it_to_payloads(session_key)
-        self.if_not_company_id_use_last_one_or_default(company_id)
-        return copy.deepcopy(self.payloads["list_inventory"])
+        session = self.get_session_for(session_key)
+        company_id = self.get_company_id_for(company_id)
+        return self.build_payload("list_inventory", session=session,
+                                  company_id=company_id)
 
     def get_list_deposits_stock_for_item_payload(
                                                  self, item_id,
                                                  company_id=None,
                                                  session_key=None
                                                  ):
-        self.payloads = ItemIdSetter(item_id) \
-            .set_item_id_to_payload(self.payloads)
-        self.if_session_key_then_set_it_to_payloads(session_key)
-        self.if_not_company_id_use_last_one_or_default(company_id)
-        return copy.deepcopy(self.payloads["list_deposits_for_item"])
+        item_id = ItemIdSetter(item_id).item_id
+        session = self.get_session_for(session_key)
+        company_id = self.get_company_id_for(company_id)
+        return self.build_payload("list_deposits_for_item", session=session,
+                                  company_id=company_id, item_id=item_id)
+
+
+class CompiledPayload():
+    # Built payloads share every part without slots with the template.
+    # Copy them before changing anything in place.
+    def __init__(self, name, template, slot_paths):
+        self.name = name
+        self.template = template
+        self.slot_tree = self.compile_slot_tree(slot_paths)
+
+    def compile_slot_tree(self, slot_paths):
+        slot_tree = {}
+        for slot, path in slot_paths.items():
+            self.check_path(path)
+            node = slot_tree
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = slot
+        return slot_tree
+
+    def check_path(self, path):
+        try:
+            node = self.template
+            for key in path[:-1]:
+                node = node[key]
+            assert isinstance(node, (dict, list))
+            if isinstance(node, list):
+                node[path[-1]]
+        except (KeyError, IndexError, TypeError, AssertionError):
+            logger.exception("Could not find %s in %s payload.", path,
+                             self.name)
+            raise KeyError("Could not compile %s payload." % self.name)
+
+    def build(self, **slot_values):
+        return self.fill(self.template, self.slot_tree, slot_values)
+
+    def fill(self, node, slot_tree, slot_values):
+        if isinstance(node, list):
+            filled_node = list(node)
+        else:
+            filled_node = dict(node)
+        for key, slot in slot_tree.items():
+            if isinstance(slot, dict):
+                filled_node[key] = self.fill(node[key], slot, slot_values)
+            elif slot in slot_values:
+                filled_node[key] = slot_values[slot]
+        return filled_node
 
 
 class SessionKeySetter():
@@ -315,29 +909,11 @@ class SessionKeySetter():
         else:
             self.session_key = session_key
 
-    def set_key_to_payloads(self, payloads):
+    def create_session_dict(self, user):
         logger.info("Setting key for session...")
-        session_dict = self.create_session_dict(payloads)
-        for key, payload in payloads.items():
-            try:
-                payload["parameters"]["sesion"] = copy.deepcopy(session_dict)
-            except KeyError:
-                logger.exception("Could not find [parameters][session] \
-                                 in payloads.")
-                raise KeyError("Could not set session key.")
-        logger.info("Key set on payloads.")
-        return payloads
-
-    def create_session_dict(self, payloads):
         session_dict = {}
         session_dict["claveSesion"] = self.session_key
-        try:
-            session_dict["usuario"] = (payloads["login"]
-                                       ["parameters"]["usuario"])
-        except KeyError:
-            logger.exception("Could not find [parameters][session] \
-                             in payloads.")
-            raise KeyError("Could not set session key.")
+        session_dict["usuario"] = user
         return session_dict
 
 
@@ -361,20 +937,6 @@ class CompanyIdSetter():
             logger.exception("Company ID must be a str of an int.")
             raise ValueError("Company ID str does not contain an int.")
 
-    def set_company_id_from_input(self, payloads):
-        avoid_payloads = ("login", "list_companies")
-        try:
-            logger.info("Setting company to %s..." % self.company_id)
-            for key, payload in payloads.items():
-                if key not in avoid_payloads:
-                    payload["parameters"]["idEmpresa"] = self.company_id
-            logger.info("Company set on payloads.")
-        except KeyError:
-            logger.exception("Could not find [parameters][idEmpresa] \
-                             in payloads.")
-            raise KeyError("Could not set company.")
-        return payloads
-
 
 class CCostTypeSetter():
     def __init__(self, ccost_type_1_or_2):
@@ -393,17 +955,6 @@ class CCostTypeSetter():
             logger.exception("CCost type must be integer 1 or 2.")
             raise ValueError
 
-    def set_ccost_type_to_payload(self, payloads):
-        try:
-            logger.info("Setting Ccost type to %s..." % self.ccost_type)
-            payloads["list_ccosts"]["parameters"]["ccosto"] = self.ccost_type
-            logger.info("Done.")
-        except KeyError:
-            logger.exception("Could not find [parameters][ccosto] \
-                             in payloads.")
-            raise KeyError("Could not set ccost type.")
-        return payloads
-
 
 class DatesSetter():
     def __init__(self, dates_range):
@@ -412,7 +963,8 @@ class DatesSetter():
             raise ValueError("No dates to set.")
         else:
             self.check_dates_range(dates_range)
-            self.dates_range = dates_range
+            self.dates_range = tuple(dates_range)
+            self.reorder_dates()
 
     def check_dates_range(self, dates_range):
         try:
@@ -427,30 +979,13 @@ class DatesSetter():
         try:
             self.iso_str_to_date(date)
         except ValueError:
-            logger.exception("Date %s non existent or wrong format" % date)
+            logger.exception("Date %s non existent or wrong format", date)
             logger.error("Date format should be 'YYYY-MM-DD'.")
             raise ValueError("Wrong date format.")
 
     def iso_str_to_date(self, iso_str):
         return datetime.date.fromisoformat(iso_str)
 
-    def set_dates_to_payloads(self, payloads):
-        self.reorder_dates()
-        logger.info("Setting dates for data from  %s to %s...\n" %
-                    self.dates_range)
-        start_date, end_date = self.dates_range
-        try:
-            payloads["list_diary"]["parameters"]["fromDate"] = start_date
-            payloads["list_diary"]["parameters"]["toDate"] = end_date
-            (payloads["list_invoices"]["parameters"]
-                ["filter"][0]["value"]) = start_date
-            (payloads["list_invoices"]["parameters"]
-                ["filter"][1]["value"]) = end_date
-        except KeyError:
-            logger.exception("Could not find dates keys in payloads.")
-            raise KeyError("Could not set dates.")
-        return payloads
-
     def reorder_dates(self):
         logger.info("Checking dates order...")
         start_date, end_date = self.dates_range
@@ -461,6 +996,47 @@ class DatesSetter():
         logger.info("Done.")
 
 
+class DatesSharder(DatesSetter):
+    shard_periods = ("week", "month", "year")
+
+    def get_shards(self, shard_by):
+        self.check_shard_by(shard_by)
+        start_date, end_date = [self.iso_str_to_date(date)
+                                for date in self.dates_range]
+        shards = []
+        while start_date <= end_date:
+            shard_end_date = min(end_date,
+                                 self.get_shard_end_date(start_date,
+                                                         shard_by))
+            shards.append((start_date.isoformat(),
+                           shard_end_date.isoformat()))
+            start_date = shard_end_date + datetime.timedelta(days=1)
+        return shards
+
+    def check_shard_by(self, shard_by):
+        if shard_by in self.shard_periods:
+            return
+        try:
+            assert isinstance(shard_by, int)
+            assert shard_by > 0
+        except AssertionError:
+            logger.exception("Shard by must be a positive number of days "
+                             "or one of %s.", self.shard_periods)
+            raise ValueError("Wrong shard size.")
+
+    def get_shard_end_date(self, start_date, shard_by):
+        if shard_by == "week":
+            return start_date + datetime.timedelta(days=6 -
+                                                   start_date.weekday())
+        if shard_by == "month":
+            next_month = (start_date.replace(day=1) +
+                          datetime.timedelta(days=32)).replace(day=1)
+            return next_month - datetime.timedelta(days=1)
+        if shard_by == "year":
+            return datetime.date(start_date.year, 12, 31)
+        return start_date + datetime.timedelta(days=shard_by - 1)
+
+
 class ItemIdSetter():
     def __init__(self, item_id):
         if not item_id:
@@ -484,17 +1060,34 @@ class ItemIdSetter():
             logger.exception("Item ID must be a str of an int.")
             raise ValueError("Item ID str does not contain an int.")
 
-    def set_item_id_to_payload(self, payloads):
+
+class PageSetter():
+    def __init__(self, start, limit):
+        self.check_page(start, limit)
+        self.start = start
+        self.limit = limit
+
+    def check_page(self, start, limit):
+        try:
+            assert isinstance(start, int)
+            assert isinstance(limit, int)
+            assert start >= 0
+            assert limit > 0
+        except AssertionError:
+            logger.exception("Page start and limit must be positive int.")
+            raise ValueError("Wrong page.")
+
+    def copy_payload_with_page(self, payload):
         try:
-            logger.info("Setting item ID to %s..." % self.item_id)
-            (payloads["list_deposits_for_item"]
-                ["parameters"]["idItem"]) = self.item_id
-            logger.info("Done.")
+            page_parameters = dict(payload["parameters"])
+            page_parameters["start"] = self.start
+            page_parameters["limit"] = self.limit
         except KeyError:
-            logger.exception("Could not find [parameters][idItem] \
-                             in payloads.")
-            raise KeyError("Could not set item id.")
-        return payloads
+            logger.exception("Could not find [parameters] in payload.")
+            raise KeyError("Could not set page.")
+        page_payload = dict(payload)
+        page_payload["parameters"] = page_parameters
+        return page_payload
 
 
 # REQUEST AND RESPONSE
@@ -508,54 +1101,280 @@ class RequestMaker():
 
     request_types = ("get", "post")
 
-    def __init__(self, state=None):
+    default_retry_policies = {
+                              "default": RetryPolicy(),
+                              "listar_dispDeposito": RetryPolicy(
+                                  max_attempts=4)
+                              }
+
+    retryable_status_codes = (429, 500, 502, 503, 504)
+
+    def __init__(self, state=None, http_session=None, throttle=None,
+                 retry_policies=None, circuit_breaker=None,
+                 timeout_in_secs=(10, 120), base_url=None, metrics=None,
+                 tracer=None):
         if not state:
             state = "testing"
         if self.is_valid_state(state):
             self.state = state
-            self.call_url = self.urls[self.state]
+            self.call_url = base_url or self.urls[self.state]
         else:
-            logger.error("%s is not a valid state. Valid states:" % state)
-            logger.error(self.urls.keys(), "\n")
+            logger.error("%s is not a valid state. Valid states:", state)
+            logger.error(self.urls.keys())
             raise ValueError
+        if not http_session:
+            http_session = requests
+        self.http_session = http_session
+        self.throttle = throttle
+        self.retry_policies = dict(self.default_retry_policies)
+        if retry_policies:
+            self.retry_policies.update(retry_policies)
+        self.circuit_breaker = circuit_breaker
+        self.timeout_in_secs = timeout_in_secs
+        if not metrics:
+            metrics = MetricsRegistry.get_shared()
+        self.set_metrics(metrics)
+        if not tracer:
+            tracer = Tracer.get_shared()
+        self.tracer = tracer
+
+    def set_metrics(self, metrics):
+        self.requests_counter = metrics \
+            .counter("colppy_requests_total",
+                     "Colppy API calls by operation and HTTP status.",
+                     ("provision", "operation", "status"))
+        self.latency_histogram = metrics \
+            .histogram("colppy_request_duration_seconds",
+                       "Time until Colppy API answered, in seconds.",
+                       ("provision", "operation"),
+                       metrics.latency_buckets_in_secs)
+        self.response_size_histogram = metrics \
+            .histogram("colppy_response_size_bytes",
+                       "Size of Colppy API answers, in bytes.",
+                       ("operation",), metrics.size_buckets_in_bytes)
+        self.retries_counter = metrics \
+            .counter("colppy_retries_total",
+                     "Colppy API calls retried, by error.",
+                     ("operation", "error"))
+        self.errors_counter = metrics \
+            .counter("colppy_errors_total",
+                     "Failed Colppy API calls, by error.",
+                     ("operation", "error"))
 
     def is_valid_state(self, state):
         return state in self.urls.keys()
 
-    def get_response(self, payload, request_type="get"):
+    def get_response(self, payload, request_type="get", stream=False):
         if self.is_valid_request_type(request_type):
-            self.request_type = request_type
-            self.payload = payload
-            logger.info("Calling API...   ")
-            if request_type == "get":
-                return requests.get(self.call_url, json=payload)
-            elif request_type == "post":
-                return requests.post(self.call_url, json=payload)
+            logger.debug("Calling API...   ")
+            if not self.throttle:
+                return self.send_request(payload, request_type, stream)
+            return self.send_throttled_request(payload, request_type, stream)
         else:
             logger.error("Request type not valid.")
-            logger.error("Valid requests:", self.request_types)
+            logger.error("Valid requests: %s", self.request_types)
             raise ValueError
 
     def is_valid_request_type(self, request_type):
         return request_type in self.request_types
 
+    def send_request(self, payload, request_type, stream):
+        # Streamed answers are timed until headers arrive.
+        provision, operation = self.get_operation_for(payload)
+        response = None
+        start_time = time.monotonic()
+        span = self.tracer.span("colppy.request", operation=operation)
+        try:
+            with span:
+                response = self.send_http_request(payload, request_type,
+                                                  stream)
+                span.set_attribute("status", self.get_status_for(response))
+            return response
+        finally:
+            self.latency_histogram.observe(time.monotonic() - start_time,
+                                           provision=provision,
+                                           operation=operation)
+            self.requests_counter.inc(provision=provision,
+                                      operation=operation,
+                                      status=self.get_status_for(response))
+            response_size = self.get_response_size_for(response)
+            if response_size is not None:
+                self.response_size_histogram.observe(response_size,
+                                                     operation=operation)
+
+    def get_operation_for(self, payload):
+        try:
+            service = payload["service"]
+            return service.get("provision", ""), service["operacion"]
+        except (KeyError, TypeError, AttributeError):
+            return "", "unknown"
+
+    def get_status_for(self, response):
+        if response is None:
+            return "error"
+        status_code = getattr(response, "status_code", None)
+        if not isinstance(status_code, int):
+            return "unknown"
+        return status_code
+
+    def get_response_size_for(self, response):
+        try:
+            return int(response.headers["Content-Length"])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+
+    def send_http_request(self, payload, request_type, stream):
+        if request_type == "get":
+            return self.http_session.get(self.call_url, json=payload,
+                                         stream=stream,
+                                         timeout=self.timeout_in_secs)
+        elif request_type == "post":
+            return self.http_session.post(self.call_url, json=payload,
+                                          stream=stream,
+                                          timeout=self.timeout_in_secs)
+
+    def send_throttled_request(self, payload, request_type, stream):
+        start_time = self.throttle.acquire()
+        overloaded = True  # Also when the connection fails.
+        try:
+            response = self.send_request(payload, request_type, stream)
+            overloaded = self.is_overload_response(response)
+            return response
+        finally:
+            self.throttle.release(start_time, overloaded)
+
+    def is_overload_response(self, response):
+        status_code = getattr(response, "status_code", None)
+        if not isinstance(status_code, int):
+            return False
+        return status_code == 429 or status_code >= 500
+
+    def get_content(self, payload, request_type="get"):
+        return self.call_with_retries(self.get_content_once, payload,
+                                      request_type)
+
+    def get_streaming_records(self, payload, records_key,
+                              request_type="get"):
+        # Retried until the first record is read. Records already handed
+        # out cannot be taken back, so later errors are not.
+        return self.call_with_retries(self.get_streaming_records_once,
+                                      payload, records_key, request_type)
+
+    def call_with_retries(self, call_once, payload, *args):
+        retry_policy = self.get_retry_policy_for(payload)
+        attempt = 1
+        while True:
+            if self.circuit_breaker:
+                self.circuit_breaker.check()
+            try:
+                content = call_once(payload, *args)
+            except (requests.RequestException, ValueError) as error:
+                self.record_failure_for(error, payload)
+                if not self.should_retry(error, retry_policy, attempt):
+                    raise
+                self.wait_before_retry(error, retry_policy, attempt, payload)
+                attempt += 1
+            else:
+                if self.circuit_breaker:
+                    self.circuit_breaker.record_success()
+                return content
+
+    def get_content_once(self, payload, request_type):
+        response = self.get_response(payload, request_type)
+        try:
+            return ResponseParser(response).get_response_content()
+        except UnsuccessfulResponseError:
+            # Bad HTTP status codes were already reported on release.
+            if self.throttle:
+                self.throttle.report_overload()
+            raise
+
+    def get_streaming_records_once(self, payload, records_key,
+                                   request_type):
+        response = self.get_response(payload, request_type, stream=True)
+        parser = StreamingResponseParser(response, records_key)
+        records = parser.iter_records()
+        try:
+            first_records = [next(records)]
+        except StopIteration:
+            first_records = []
+        except UnsuccessfulResponseError:
+            if self.throttle:
+                self.throttle.report_overload()
+            raise
+        return itertools.chain(first_records, records), \
+            parser.get_response_content()
+
+    def get_retry_policy_for(self, payload):
+        provision, operation = self.get_operation_for(payload)
+        return self.retry_policies.get(operation,
+                                       self.retry_policies["default"])
+
+    def is_transient_error(self, error):
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+        if isinstance(error, ResponseStatusError):
+            return error.status_code in self.retryable_status_codes
+        return False
+
+    def record_failure_for(self, error, payload):
+        provision, operation = self.get_operation_for(payload)
+        self.errors_counter.inc(operation=operation,
+                                error=type(error).__name__)
+        # Only a failing server opens the circuit. A rejected query does not,
+        # and any answer closes a half open circuit.
+        if not self.circuit_breaker:
+            return
+        if self.is_transient_error(error):
+            self.circuit_breaker.record_failure()
+        elif isinstance(error, ValueError):
+            self.circuit_breaker.record_success()
+
+    def should_retry(self, error, retry_policy, attempt):
+        if not retry_policy.has_attempts_left(attempt):
+            return False
+        if isinstance(error, UnsuccessfulResponseError):
+            return retry_policy.retry_on_unsuccessful
+        return self.is_transient_error(error)
+
+    def wait_before_retry(self, error, retry_policy, attempt, payload):
+        provision, operation = self.get_operation_for(payload)
+        self.retries_counter.inc(operation=operation,
+                                 error=type(error).__name__)
+        delay_in_secs = retry_policy.get_delay_for(attempt)
+        logger.warning("Attempt %d failed with %r. Retrying in %.1f secs...",
+                       attempt, error, delay_in_secs)
+        with self.tracer.span("colppy.retry_wait", operation=operation,
+                              attempt=attempt):
+            time.sleep(delay_in_secs)
+
+
+class ResponseStatusError(ValueError):
+    def __init__(self, status_code):
+        super().__init__("HTTP status %s" % status_code)
+        self.status_code = status_code
+
+
+class UnsuccessfulResponseError(ValueError):
+    pass
+
 
 class ResponseParser():
     def __init__(self, response_json):
-        if self.request_was_successful(response_json):
-            logger.info("Query successful.")
+        if not self.check_not_raise_status(response_json):
+            logger.error("Query not successful.")
+            raise ResponseStatusError(getattr(response_json, "status_code",
+                                              None))
+        self.parse_response_json(response_json)
+        if self.is_response_success():
+            logger.debug("Query successful.")
         else:
             logger.error("Query not successful.")
-            raise ValueError
+            raise UnsuccessfulResponseError("Colppy answered success false.")
 
     def get_response_content(self):
         return self.parsed_response["response"]
 
-    def request_was_successful(self, response_json):
-        if self.check_not_raise_status(response_json):
-            self.parse_response_json(response_json)
-            return self.is_response_success()
-
     def check_not_raise_status(self, response_json):
         try:
             response_json.raise_for_status()
@@ -598,3 +1417,155 @@ class ResponseParser():
                              Check response.")
             logger.error(self.parsed_response)
             return False
+
+
+class StreamingResponseParser(ResponseParser):
+    chunk_size = 64 * 1024
+
+    def __init__(self, response_json, records_key):
+        self.response = response_json
+        self.records_key = records_key
+        self.parsed_response = {}
+        self.response_content = {}
+        if not self.check_not_raise_status(response_json):
+            logger.error("Query not successful.")
+            raise ResponseStatusError(getattr(response_json, "status_code",
+                                              None))
+
+    def get_response_content(self):
+        # Everything in [response] but the records. Complete only after
+        # iter_records is exhausted.
+        return self.response_content
+
+    def iter_records(self):
+        chunks = self.response.iter_content(chunk_size=self.chunk_size)
+        self.reader = JSONStreamReader(chunks)
+        try:
+            yield from self.iter_top_level_object()
+        finally:
+            self.response.close()
+        # If [success] comes after the records they were already yielded.
+        if not self.is_response_success():
+            logger.error("Query not successful.")
+            raise UnsuccessfulResponseError("Colppy answered success false.")
+        logger.debug("Query successful.")
+
+    def iter_top_level_object(self):
+        for key in self.reader.iter_object_keys():
+            if key == "response":
+                self.parsed_response["response"] = self.response_content
+                yield from self.iter_response_object()
+            else:
+                self.parsed_response[key] = self.reader.read_value()
+
+    def iter_response_object(self):
+        if self.reader.peek() != "{":
+            self.response_content = self.reader.read_value()
+            self.parsed_response["response"] = self.response_content
+            return
+        for key in self.reader.iter_object_keys():
+            if key == self.records_key and self.reader.peek() == "[":
+                self.response_content[key] = []
+                yield from self.reader.iter_array_values()
+            else:
+                self.response_content[key] = self.reader.read_value()
+                self.if_not_success_then_stop(key)
+
+    def if_not_success_then_stop(self, key):
+        if key == "success" and not self.response_content[key]:
+            logger.error("Query not successful.")
+            logger.error(self.response_content)
+            raise UnsuccessfulResponseError("Colppy answered success false.")
+
+
+class JSONStreamReader():
+    whitespace = " \t\n\r"
+    delimiters = ",:]}" + whitespace
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.exhausted = False
+
+    def read_more(self):
+        if self.exhausted:
+            return False
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        try:
+            chunk = next(self.chunks)
+            self.buffer += self.text_decoder.decode(chunk)
+        except StopIteration:
+            self.buffer += self.text_decoder.decode(b"", final=True)
+            self.exhausted = True
+        return True
+
+    def peek(self):
+        while True:
+            while (self.position < len(self.buffer)
+                   and self.buffer[self.position] in self.whitespace):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                logger.error("Response ended before JSON was complete.")
+                raise ValueError("Incomplete JSON.")
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            logger.error("Expected %s but found %s in JSON.", char, found)
+            raise ValueError("Wrong JSON format.")
+        self.position += 1
+
+    def skip_if_next(self, char):
+        if self.peek() == char:
+            self.position += 1
+            return True
+        return False
+
+    def read_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer,
+                                                     self.position)
+            except json.JSONDecodeError:
+                if self.read_more():
+                    continue
+                logger.exception("Could not decode JSON value.")
+                raise ValueError("Wrong JSON format.")
+            # A number or literal may continue in the next chunk, as in
+            # "1." and "5". Only a delimiter or the end of the response
+            # closes it.
+            if (end == len(self.buffer)
+                    or self.buffer[end] not in self.delimiters) \
+                    and self.read_more():
+                continue
+            self.position = end
+            return value
+
+    def iter_object_keys(self):
+        self.expect("{")
+        if self.skip_if_next("}"):
+            return
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            yield key  # Caller must consume the value before next key.
+            if not self.skip_if_next(","):
+                self.expect("}")
+                return
+
+    def iter_array_values(self):
+        self.expect("[")
+        if self.skip_if_next("]"):
+            return
+        while True:
+            yield self.read_value()
+            if not self.skip_if_next(","):
+                self.expect("]")
+                return
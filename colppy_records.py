@@ -0,0 +1,256 @@
+# IMPORTS
+##############################################################################
+
+import array
+import datetime
+import math
+import sys
+
+
+# CONVERTERS
+##############################################################################
+
+def to_int(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, str) and "." in value:
+        return int(float(value))
+    return int(value)
+
+
+def to_float(value):
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def to_date(value):
+    if not value or value.startswith("0000"):
+        return None
+    return datetime.date.fromisoformat(value[:10])
+
+
+def to_datetime(value):
+    if not value or value.startswith("0000"):
+        return None
+    return datetime.datetime.fromisoformat(value)
+
+
+def to_str(value):
+    if value is None:
+        return None
+    return sys.intern(str(value))
+
+
+converters = {
+              "int": to_int,
+              "float": to_float,
+              "date": to_date,
+              "datetime": to_datetime,
+              "str": to_str
+              }
+
+
+# CLASSES
+##############################################################################
+
+class ColppyRecord():
+    # Subclasses list their fields as (name, kind) pairs. Keys Colppy sends
+    # that are not listed, or that could not be converted, go to [extra].
+    fields = ()
+    field_names = frozenset()
+    __slots__ = ("extra",)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.field_names = frozenset(name for name, kind in cls.fields)
+
+    def __init__(self, **values):
+        for name, kind in self.fields:
+            setattr(self, name, values.get(name))
+        self.extra = values.get("extra")
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        extra = None
+        for name, kind in cls.fields:
+            value = data.get(name)
+            try:
+                setattr(record, name, converters[kind](value))
+            except (TypeError, ValueError, AttributeError):
+                setattr(record, name, None)
+                extra = extra or {}
+                extra[name] = value
+        for key in data.keys() - cls.field_names:
+            extra = extra or {}
+            extra[key] = data[key]
+        record.extra = extra
+        return record
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name, kind in self.fields}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        values = ", ".join("%s=%r" % (name, getattr(self, name))
+                           for name, kind in self.fields[:3])
+        return "%s(%s, ...)" % (type(self).__name__, values)
+
+
+def make_slots(fields):
+    return tuple(name for name, kind in fields)
+
+
+class Invoice(ColppyRecord):
+    fields = (("idFactura", "int"), ("idTipoFactura", "int"),
+              ("idTipoComprobante", "int"), ("idCliente", "int"),
+              ("idOrden", "int"), ("nroFactura", "str"),
+              ("idMoneda", "int"), ("fechaFactura", "date"),
+              ("fechaPago", "date"), ("idCondicionPago", "int"),
+              ("descripcion", "str"), ("idEstadoFactura", "int"),
+              ("totalFactura", "float"), ("netoGravado", "float"),
+              ("netoNoGravado", "float"), ("totalIVA", "float"),
+              ("IVA105", "float"), ("IVA21", "float"), ("IVA27", "float"),
+              ("percepcionIVA", "float"), ("percepcionIIBB", "float"),
+              ("IIBBLocal", "float"), ("valorCambio", "float"),
+              ("totalaplicado", "float"), ("cae", "str"),
+              ("fechaFe", "date"), ("RazonSocial", "str"),
+              ("NombreFantasia", "str"), ("record_insert_ts", "datetime"),
+              ("record_update_ts", "datetime"))
+    __slots__ = make_slots(fields)
+
+
+class DiaryMovement(ColppyRecord):
+    fields = (("idAsiento", "int"), ("idMovimiento", "int"),
+              ("idTabla", "int"), ("idElemento", "int"),
+              ("fechaContable", "date"), ("idPlanCuenta", "str"),
+              ("descripcion", "str"), ("debito", "float"),
+              ("credito", "float"), ("ccosto1", "str"), ("ccosto2", "str"),
+              ("record_insert_ts", "datetime"),
+              ("record_update_ts", "datetime"))
+    __slots__ = make_slots(fields)
+
+
+class InventoryItem(ColppyRecord):
+    fields = (("idItem", "int"), ("idEmpresa", "int"), ("codigo", "str"),
+              ("descripcion", "str"), ("detalle", "str"),
+              ("ctaCostoVentas", "str"), ("ctaIngresoVentas", "str"),
+              ("ctaInventario", "str"), ("minimo", "float"),
+              ("costoCalculado", "float"), ("ultimoPrecioCompra", "float"),
+              ("precioVenta", "float"), ("iva", "float"),
+              ("fechaAlta", "date"), ("tipoItem", "str"),
+              ("fechaBaja", "date"), ("unidadMedida", "str"),
+              ("comentarioFactura", "str"), ("esKit", "str"),
+              ("record_insert_ts", "datetime"),
+              ("record_update_ts", "datetime"), ("id", "int"),
+              ("disponibilidad", "float"), ("descCtaInventario", "str"),
+              ("descCtaCostoVentas", "str"),
+              ("descCtaIngresoVentas", "str"))
+    __slots__ = make_slots(fields)
+
+
+class DepositStock(ColppyRecord):
+    fields = (("nombre", "str"), ("disponibilidad", "float"))
+    __slots__ = make_slots(fields)
+
+
+class RecordColumns():
+    # Numbers and dates live in typed arrays, one per field. Missing values
+    # are stored as a sentinel that is read back as None.
+    missing_int = -2 ** 63
+    missing_date = 0
+    epoch = datetime.datetime(1970, 1, 1)
+
+    typecodes = {
+                 "int": "q",
+                 "float": "d",
+                 "date": "l",
+                 "datetime": "d"
+                 }
+
+    def __init__(self, record_class, records=()):
+        self.record_class = record_class
+        self.columns = {name: self.create_column(kind)
+                        for name, kind in record_class.fields}
+        self.extras = {}
+        self.length = 0
+        self.extend(records)
+
+    def create_column(self, kind):
+        if kind in self.typecodes:
+            return array.array(self.typecodes[kind])
+        return []
+
+    def __len__(self):
+        return self.length
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def append(self, record):
+        if isinstance(record, dict):
+            record = self.record_class.from_dict(record)
+        for name, kind in self.record_class.fields:
+            self.columns[name].append(self.encode(getattr(record, name),
+                                                  kind))
+        if record.extra:
+            self.extras[self.length] = record.extra
+        self.length += 1
+
+    def encode(self, value, kind):
+        if kind == "int":
+            return self.missing_int if value is None else value
+        if kind == "float":
+            return math.nan if value is None else value
+        if kind == "date":
+            return self.missing_date if value is None else value.toordinal()
+        if kind == "datetime":
+            if value is None:
+                return math.nan
+            return (value - self.epoch).total_seconds()
+        return value
+
+    def decode(self, value, kind):
+        if kind == "int":
+            return None if value == self.missing_int else value
+        if kind == "float":
+            return None if math.isnan(value) else value
+        if kind == "date":
+            if value == self.missing_date:
+                return None
+            return datetime.date.fromordinal(value)
+        if kind == "datetime":
+            if math.isnan(value):
+                return None
+            return self.epoch + datetime.timedelta(seconds=value)
+        return value
+
+    def column(self, name):
+        return self.columns[name]
+
+    def values(self, name):
+        kind = dict(self.record_class.fields)[name]
+        return [self.decode(value, kind) for value in self.columns[name]]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("Record index out of range.")
+        values = {name: self.decode(self.columns[name][index], kind)
+                  for name, kind in self.record_class.fields}
+        values["extra"] = self.extras.get(index)
+        return self.record_class(**values)
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
@@ -0,0 +1,118 @@
+# IMPORTS
+##############################################################################
+
+import collections
+import concurrent.futures
+import logging
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="concurrent_fetcher.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# CLASSES
+##############################################################################
+
+class ConcurrentFetcher():
+    # Results that are done but still waiting for an earlier item are kept
+    # in the window too, so it is larger than the number of workers.
+    window_per_worker = 2
+
+    def __init__(self, max_in_flight=8):
+        self.check_max_in_flight(max_in_flight)
+        self.max_in_flight = max_in_flight
+        self.window_size = max_in_flight * self.window_per_worker
+
+    def check_max_in_flight(self, max_in_flight):
+        try:
+            assert isinstance(max_in_flight, int)
+            assert max_in_flight > 0
+        except AssertionError:
+            logger.exception("Max in flight must be a positive integer.")
+            raise ValueError("Wrong max in flight.")
+
+    def fetch_in_order(self, function, items):
+        logger.info("Fetching with %d requests in flight..."
+                    % self.max_in_flight)
+        with concurrent.futures \
+                .ThreadPoolExecutor(max_workers=self.max_in_flight) \
+                as executor:
+            pending = collections.deque()
+            try:
+                for item in items:
+                    future = executor.submit(self.call_and_catch,
+                                             function, item)
+                    pending.append((item, future))
+                    if len(pending) >= self.window_size:
+                        yield self.pop_first_result(pending)
+                while pending:
+                    yield self.pop_first_result(pending)
+            finally:
+                self.cancel_futures(future for item, future in pending)
+
+    def fetch_as_completed(self, function, items):
+        logger.info("Fetching with %d requests in flight..."
+                    % self.max_in_flight)
+        items = iter(items)
+        with concurrent.futures \
+                .ThreadPoolExecutor(max_workers=self.max_in_flight) \
+                as executor:
+            pending = {}
+            try:
+                self.submit_until_window_is_full(executor, function, items,
+                                                 pending)
+                while pending:
+                    done = self.wait_for_first_completed(pending)
+                    for future in done:
+                        item = pending.pop(future)
+                        yield item, future.result()
+                    self.submit_until_window_is_full(executor, function,
+                                                     items, pending)
+            finally:
+                self.cancel_futures(pending)
+
+    def wait_for_first_completed(self, futures):
+        done, not_done = concurrent.futures \
+            .wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+        return done
+
+    def submit_until_window_is_full(self, executor, function, items, pending):
+        while len(pending) < self.window_size:
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            future = executor.submit(self.call_and_catch, function, item)
+            pending[future] = item
+
+    def pop_first_result(self, pending):
+        item, future = pending.popleft()
+        return item, future.result()
+
+    def cancel_futures(self, futures):
+        for future in futures:
+            future.cancel()
+
+    def call_and_catch(self, function, item):
+        try:
+            return function(item)
+        except Exception as error:
+            return error
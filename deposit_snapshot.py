@@ -0,0 +1,114 @@
+# IMPORTS
+##############################################################################
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="deposit_snapshot.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# CLASSES
+##############################################################################
+
+class DepositSnapshotStore():
+    # Moving stock between deposits keeps the item and its total as they
+    # were, so snapshots are trusted for a limited time only.
+    def __init__(self, path="cache/deposit_snapshot.sqlite3",
+                 max_age_in_secs=24 * 60 * 60):
+        self.path = path
+        self.max_age_in_secs = max_age_in_secs
+        self.lock = threading.Lock()
+        self.open_database()
+
+    def open_database(self):
+        logger.info("Opening deposit snapshot at %s...", self.path)
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS deposits (
+                    company_id TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    record_update_ts TEXT NOT NULL,
+                    total_stock TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    saved_at REAL NOT NULL,
+                    PRIMARY KEY (company_id, item_id)
+                )""")
+        logger.info("Deposit snapshot opened.")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get_unchanged_deposits_for(self, company_id, item_versions):
+        # item_versions maps item IDs to (record_update_ts, total_stock).
+        oldest_saved_at = time.time() - self.max_age_in_secs
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT item_id, record_update_ts, total_stock, content "
+                "FROM deposits WHERE company_id = ? AND saved_at >= ?",
+                (str(company_id), oldest_saved_at)).fetchall()
+        unchanged_deposits = {}
+        for item_id, record_update_ts, total_stock, content in rows:
+            if item_versions.get(item_id) == (record_update_ts, total_stock):
+                unchanged_deposits[item_id] = json.loads(content)
+        return unchanged_deposits
+
+    def save_deposits_for(self, company_id, versioned_deposits):
+        # versioned_deposits holds (item_id, item_version, deposits) tuples.
+        now = time.time()
+        rows = [(str(company_id), item_id, record_update_ts, total_stock,
+                 json.dumps(deposits), now)
+                for item_id, (record_update_ts, total_stock), deposits
+                in versioned_deposits]
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO deposits "
+                    "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def count_deposits_for(self, company_id):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM deposits WHERE company_id = ?",
+                (str(company_id),)).fetchone()[0]
+
+    def clear(self, company_id=None):
+        logger.info("Clearing deposit snapshot...")
+        with self.lock:
+            with self.connection:
+                if company_id:
+                    self.connection.execute(
+                        "DELETE FROM deposits WHERE company_id = ?",
+                        (str(company_id),))
+                else:
+                    self.connection.execute("DELETE FROM deposits")
+        logger.info("Deposit snapshot cleared.")
@@ -0,0 +1,500 @@
+# IMPORTS
+##############################################################################
+
+import argparse
+import collections
+import datetime
+import http.server
+import json
+import random
+import threading
+import time
+import uuid
+from rate_limiter import TokenBucket
+import logging
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="fake_colppy_server.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# CLASSES
+##############################################################################
+
+class FakeColppyDataset():
+    # Records are generated from their index, so big datasets cost no memory
+    # and every run sees the same data.
+    default_deposit_names = ("Ikitoi General ", "Deposito Barloqui", "Local",
+                             "Ecommerce ")
+
+    def __init__(self, total_items=1000, company_ids=("19459",),
+                 deposit_names=None, invoices_per_day=20,
+                 movements_per_day=50, service_items_ratio=0.1,
+                 zero_stock_ratio=0.3, seed=0):
+        self.total_items = total_items
+        self.company_ids = tuple(company_ids)
+        self.deposit_names = tuple(deposit_names
+                                   or self.default_deposit_names)
+        self.invoices_per_day = invoices_per_day
+        self.movements_per_day = movements_per_day
+        self.service_items_ratio = service_items_ratio
+        self.zero_stock_ratio = zero_stock_ratio
+        self.seed = seed
+        self.first_item_id = 10000000
+
+    def get_random_for(self, *keys):
+        return random.Random("%s:%s" % (self.seed, ":".join(map(str, keys))))
+
+    def get_companies(self):
+        return [{"IdEmpresa": company_id,
+                 "razonSocial": "Company %s SA" % company_id,
+                 "Nombre": "Company %s" % company_id,
+                 "activa": "1"}
+                for company_id in self.company_ids]
+
+    def get_ccosts(self, ccost_type):
+        return [{"Id": str(30000 + ccost_type * 100 + number),
+                 "Descripcion": "Cost center %d.%d" % (ccost_type, number)}
+                for number in range(3)]
+
+    def get_items(self, company_id, start, limit):
+        end = min(start + limit, self.total_items)
+        return [self.get_item(company_id, index)
+                for index in range(start, end)]
+
+    def get_item(self, company_id, index):
+        item_id = self.first_item_id + index
+        rand = self.get_random_for("item", item_id)
+        cost = round(rand.uniform(50, 2000), 1)
+        insert_ts = datetime.datetime(2019, 1, 1) + \
+            datetime.timedelta(minutes=rand.randrange(500000))
+        update_ts = insert_ts + \
+            datetime.timedelta(minutes=rand.randrange(100000))
+        return {"idItem": item_id,
+                "idEmpresa": int(company_id),
+                "codigo": str(9789870000000 + index),
+                "descripcion": "Item %d" % index,
+                "detalle": "Brand %d" % (index % 17),
+                "ctaCostoVentas": "5121",
+                "ctaIngresoVentas": "4100",
+                "ctaInventario": "1131",
+                "minimo": 0,
+                "costoCalculado": cost,
+                "ultimoPrecioCompra": cost,
+                "precioVenta": round(cost * 2, 0),
+                "iva": "0",
+                "fechaAlta": insert_ts.date().isoformat(),
+                "tipoItem": self.get_item_type(item_id),
+                "fechaBaja": None,
+                "unidadMedida": "Un",
+                "comentarioFactura": None,
+                "esKit": None,
+                "record_insert_ts": insert_ts.isoformat(" "),
+                "record_update_ts": update_ts.isoformat(" "),
+                "id": item_id,
+                "disponibilidad": sum(self.get_stock_for(item_id)),
+                "descCtaInventario": "Productos Terminados",
+                "descCtaCostoVentas": "Costo de venta",
+                "descCtaIngresoVentas": "Ventas Gravadas"}
+
+    def get_item_type(self, item_id):
+        rand = self.get_random_for("type", item_id)
+        if rand.random() < self.service_items_ratio:
+            return "S"
+        return "P"
+
+    def get_stock_for(self, item_id):
+        if self.get_item_type(item_id) == "S":
+            return [0] * len(self.deposit_names)
+        rand = self.get_random_for("stock", item_id)
+        if rand.random() < self.zero_stock_ratio:
+            return [0] * len(self.deposit_names)
+        return [rand.randrange(0, 10) for name in self.deposit_names]
+
+    def is_item(self, item_id):
+        try:
+            index = int(item_id) - self.first_item_id
+        except (TypeError, ValueError):
+            return False
+        return 0 <= index < self.total_items
+
+    def get_deposits_for(self, item_id):
+        stock = self.get_stock_for(int(item_id))
+        return [{"nombre": name, "disponibilidad": "%.5f" % units}
+                for name, units in zip(self.deposit_names, stock)]
+
+    def iter_days(self, start_date, end_date):
+        day = datetime.date.fromisoformat(start_date)
+        last_day = datetime.date.fromisoformat(end_date)
+        while day <= last_day:
+            yield day
+            day += datetime.timedelta(days=1)
+
+    def count_for_dates(self, per_day, start_date, end_date):
+        return per_day * len(list(self.iter_days(start_date, end_date)))
+
+    def get_invoices(self, start_date, end_date, start, limit):
+        return self.get_page_for_dates(self.get_invoice,
+                                       self.invoices_per_day, start_date,
+                                       end_date, start, limit)
+
+    def get_movements(self, start_date, end_date, start, limit):
+        return self.get_page_for_dates(self.get_movement,
+                                       self.movements_per_day, start_date,
+                                       end_date, start, limit)
+
+    def get_page_for_dates(self, get_record, per_day, start_date, end_date,
+                           start, limit):
+        if not per_day:
+            return []
+        first_day = datetime.date.fromisoformat(start_date)
+        total = self.count_for_dates(per_day, start_date, end_date)
+        records = []
+        for position in range(start, min(start + limit, total)):
+            day = first_day + datetime.timedelta(days=position // per_day)
+            records.append(get_record(day, position % per_day))
+        return records
+
+    def get_invoice(self, day, number):
+        invoice_id = day.toordinal() * 1000 + number
+        rand = self.get_random_for("invoice", invoice_id)
+        net = round(rand.uniform(100, 5000), 2)
+        update_ts = datetime.datetime.combine(day, datetime.time(12)) + \
+            datetime.timedelta(minutes=rand.randrange(10000))
+        return {"idFactura": str(invoice_id),
+                "idTipoFactura": "1",
+                "idTipoComprobante": "8",
+                "idCliente": str(rand.randrange(1000000, 3000000)),
+                "nroFactura": "0005-%08d" % invoice_id,
+                "idMoneda": "1",
+                "fechaFactura": day.isoformat(),
+                "fechaPago": day.isoformat(),
+                "descripcion": "Order %d" % number,
+                "idEstadoFactura": "5",
+                "totalFactura": "%.2f" % (net * 1.21),
+                "netoGravado": "%.2f" % net,
+                "netoNoGravado": "0.00",
+                "totalIVA": "%.2f" % (net * 0.21),
+                "valorCambio": "1.0000",
+                "record_insert_ts": "%s 12:00:00" % day.isoformat(),
+                "record_update_ts": update_ts.isoformat(" "),
+                "RazonSocial": "Customer %d" % rand.randrange(500)}
+
+    def get_movement(self, day, number):
+        movement_id = day.toordinal() * 10000 + number
+        rand = self.get_random_for("movement", movement_id)
+        amount = "%.2f" % rand.uniform(10, 10000)
+        is_debit = number % 2 == 0
+        return {"idAsiento": str(movement_id // 2),
+                "idMovimiento": str(movement_id),
+                "fechaContable": day.isoformat(),
+                "idPlanCuenta": rand.choice(("1131", "4100", "5121")),
+                "descripcion": "Movement %d" % number,
+                "debito": amount if is_debit else "0.00",
+                "credito": "0.00" if is_debit else amount}
+
+
+class FakeColppyService():
+    # Answers Colppy operations the way frontera2/service.php does.
+    def __init__(self, dataset=None, max_page_size=None):
+        if not dataset:
+            dataset = FakeColppyDataset()
+        self.dataset = dataset
+        # Like Colppy, pages may hold fewer records than asked for.
+        self.max_page_size = max_page_size
+        self.session_keys = set()
+        self.lock = threading.Lock()
+        self.operations = {
+                           "iniciar_sesion": self.login,
+                           "listar_empresa": self.list_companies,
+                           "listar_ccostos": self.list_ccosts,
+                           "listar_itemsinventario": self.list_inventory,
+                           "listar_dispDeposito": self.list_deposits,
+                           "listar_facturasventa": self.list_invoices,
+                           "listar_movimientosdiario": self.list_diary
+                           }
+
+    def answer(self, payload):
+        try:
+            operation = payload["service"]["operacion"]
+            parameters = payload["parameters"]
+        except (KeyError, TypeError):
+            return self.fail("Wrong payload.")
+        if operation not in self.operations:
+            return self.fail("Unknown operation %s." % operation)
+        if operation != "iniciar_sesion" \
+                and not self.is_valid_session(parameters):
+            return self.fail("Invalid session.")
+        try:
+            return self.operations[operation](parameters)
+        except (KeyError, IndexError, TypeError, ValueError) as error:
+            return self.fail("Wrong parameters: %r" % error)
+
+    def succeed(self, data, total=None):
+        response = {"success": True,
+                    "message": "Operacion realizada con exito",
+                    "data": data}
+        if total is not None:
+            response["total"] = str(total)
+        return response
+
+    def fail(self, message):
+        return {"success": False, "message": message}
+
+    def is_valid_session(self, parameters):
+        try:
+            session_key = parameters["sesion"]["claveSesion"]
+        except (KeyError, TypeError):
+            return False
+        with self.lock:
+            return session_key in self.session_keys
+
+    def login(self, parameters):
+        if not parameters.get("usuario") or not parameters.get("password"):
+            return self.fail("Wrong user or password.")
+        session_key = uuid.uuid4().hex
+        with self.lock:
+            self.session_keys.add(session_key)
+        return self.succeed({"claveSesion": session_key})
+
+    def get_page_parameters(self, parameters, default_limit=10000):
+        limit = int(parameters.get("limit", default_limit))
+        if self.max_page_size:
+            limit = min(limit, self.max_page_size)
+        return int(parameters.get("start", 0)), limit
+
+    def check_company(self, parameters):
+        company_id = str(parameters["idEmpresa"])
+        if company_id not in self.dataset.company_ids:
+            raise ValueError("Unknown company %s." % company_id)
+        return company_id
+
+    def list_companies(self, parameters):
+        companies = self.dataset.get_companies()
+        return self.succeed(companies, len(companies))
+
+    def list_ccosts(self, parameters):
+        self.check_company(parameters)
+        return self.succeed(self.dataset.get_ccosts(int(
+                                                    parameters["ccosto"])))
+
+    def list_inventory(self, parameters):
+        company_id = self.check_company(parameters)
+        start, limit = self.get_page_parameters(parameters)
+        items = self.dataset.get_items(company_id, start, limit)
+        return self.succeed(items, self.dataset.total_items)
+
+    def list_deposits(self, parameters):
+        self.check_company(parameters)
+        item_id = parameters["idItem"]
+        if not self.dataset.is_item(item_id):
+            return self.fail("Item %s not found." % item_id)
+        return self.succeed(self.dataset.get_deposits_for(item_id))
+
+    def list_invoices(self, parameters):
+        self.check_company(parameters)
+        start_date = parameters["filter"][0]["value"]
+        end_date = parameters["filter"][1]["value"]
+        start, limit = self.get_page_parameters(parameters)
+        invoices = self.dataset.get_invoices(start_date, end_date, start,
+                                             limit)
+        total = self.dataset.count_for_dates(self.dataset.invoices_per_day,
+                                             start_date, end_date)
+        return self.succeed(invoices, total)
+
+    def list_diary(self, parameters):
+        self.check_company(parameters)
+        start_date = parameters["fromDate"]
+        end_date = parameters["toDate"]
+        start, limit = self.get_page_parameters(parameters)
+        movements = self.dataset.get_movements(start_date, end_date, start,
+                                               limit)
+        total = self.dataset.count_for_dates(self.dataset.movements_per_day,
+                                             start_date, end_date)
+        response = self.succeed([], total)
+        del response["data"]
+        response["movimientos"] = movements
+        return response
+
+
+class FakeColppyRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.answer_request()
+
+    def do_POST(self):
+        self.answer_request()
+
+    def answer_request(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            payload = {}
+        operation = server.get_operation_for(payload)
+        server.count_request_for(operation)
+        if not server.is_request_allowed():
+            self.send_json(429, {"error": "Too many requests."})
+            return
+        server.wait_latency()
+        if server.should_inject(server.error_rate):
+            self.send_json(500, {"error": "Injected error."})
+            return
+        response = server.service.answer(payload)
+        if server.should_inject(server.unsuccessful_rate):
+            response = server.service.fail("Injected unsuccessful answer.")
+        self.send_json(200, {"service": payload.get("service"),
+                             "result": {"estado": 0},
+                             "response": response})
+
+    def send_json(self, status_code, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class FakeColppyServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    path = "/lib/frontera2/service.php"
+
+    def __init__(self, dataset=None, host="127.0.0.1", port=0,
+                 latency_in_secs=0, latency_jitter_in_secs=0, error_rate=0,
+                 unsuccessful_rate=0, rate_limit_per_sec=None, seed=None,
+                 max_page_size=None):
+        super().__init__((host, port), FakeColppyRequestHandler)
+        self.service = FakeColppyService(dataset, max_page_size)
+        self.latency_in_secs = latency_in_secs
+        self.latency_jitter_in_secs = latency_jitter_in_secs
+        self.error_rate = error_rate
+        self.unsuccessful_rate = unsuccessful_rate
+        self.bucket = None
+        if rate_limit_per_sec:
+            self.bucket = TokenBucket(rate_limit_per_sec)
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.request_counts = collections.Counter()
+        self.counts_lock = threading.Lock()
+        self.serving_thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d%s" % (host, port, self.path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        logger.info("Starting fake Colppy server at %s..." % self.url)
+        self.serving_thread = threading.Thread(target=self.serve_forever,
+                                               name="fake-colppy-server",
+                                               daemon=True)
+        self.serving_thread.start()
+
+    def stop(self):
+        logger.info("Stopping fake Colppy server...")
+        if self.serving_thread:
+            self.shutdown()
+            self.serving_thread.join()
+        self.server_close()
+        logger.info("Stopped.")
+
+    def get_operation_for(self, payload):
+        try:
+            return payload["service"]["operacion"]
+        except (KeyError, TypeError):
+            return None
+
+    def count_request_for(self, operation):
+        with self.counts_lock:
+            self.request_counts[operation] += 1
+
+    def get_request_counts(self):
+        with self.counts_lock:
+            return dict(self.request_counts)
+
+    def is_request_allowed(self):
+        if not self.bucket:
+            return True
+        return self.bucket.try_acquire()
+
+    def wait_latency(self):
+        if not self.latency_in_secs and not self.latency_jitter_in_secs:
+            return
+        with self.random_lock:
+            jitter_in_secs = self.random.uniform(0,
+                                                 self.latency_jitter_in_secs)
+        time.sleep(self.latency_in_secs + jitter_in_secs)
+
+    def should_inject(self, rate):
+        if not rate:
+            return False
+        with self.random_lock:
+            return self.random.random() < rate
+
+
+# MAIN
+##############################################################################
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Serve a fake Colppy API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--companies", nargs="+", default=["19459"])
+    parser.add_argument("--invoices-per-day", type=int, default=20)
+    parser.add_argument("--movements-per-day", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--latency-jitter", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--unsuccessful-rate", type=float, default=0)
+    parser.add_argument("--rate-limit", type=float, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    dataset = FakeColppyDataset(arguments.items, arguments.companies,
+                                invoices_per_day=arguments.invoices_per_day,
+                                movements_per_day=arguments
+                                .movements_per_day)
+    server = FakeColppyServer(dataset, arguments.host, arguments.port,
+                              arguments.latency, arguments.latency_jitter,
+                              arguments.error_rate,
+                              arguments.unsuccessful_rate,
+                              arguments.rate_limit)
+    logger.info("Serving fake Colppy API at %s" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
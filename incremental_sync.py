@@ -0,0 +1,273 @@
+# IMPORTS
+##############################################################################
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="incremental_sync.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# CLASSES
+##############################################################################
+
+class SyncStore():
+    def __init__(self, path="cache/colppy_sync.sqlite3"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.open_database()
+
+    def open_database(self):
+        logger.info("Opening sync store at %s..." % self.path)
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    company_id TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    first_date TEXT NOT NULL,
+                    last_date TEXT NOT NULL,
+                    PRIMARY KEY (company_id, operation)
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS records (
+                    company_id TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    record_id TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    PRIMARY KEY (company_id, operation, record_id)
+                )""")
+        logger.info("Sync store opened.")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get_checkpoint_for(self, company_id, operation):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT first_date, last_date FROM checkpoints "
+                "WHERE company_id = ? AND operation = ?",
+                (company_id, operation)).fetchone()
+        if row is None:
+            return None
+        return tuple(datetime.date.fromisoformat(date) for date in row)
+
+    def save_checkpoint_for(self, company_id, operation, first_date,
+                            last_date):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                    (company_id, operation, first_date.isoformat(),
+                     last_date.isoformat()))
+        logger.info("Checkpoint for %s of company %s set to %s."
+                    % (operation, company_id, last_date))
+
+    def upsert_records_for(self, company_id, operation, records_by_id):
+        rows = [(company_id, operation, record_id, json.dumps(record))
+                for record_id, record in records_by_id]
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                    rows)
+        return len(rows)
+
+    def get_records_for(self, company_id, operation):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT content FROM records "
+                "WHERE company_id = ? AND operation = ? ORDER BY rowid",
+                (company_id, operation)).fetchall()
+        return [json.loads(content) for content, in rows]
+
+    def count_records_for(self, company_id, operation):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM records "
+                "WHERE company_id = ? AND operation = ?",
+                (company_id, operation)).fetchone()[0]
+
+    def clear(self, company_id=None, operation=None):
+        logger.info("Clearing sync store...")
+        conditions, parameters = [], []
+        if company_id:
+            conditions.append("company_id = ?")
+            parameters.append(company_id)
+        if operation:
+            conditions.append("operation = ?")
+            parameters.append(operation)
+        where = ""
+        if conditions:
+            where = " WHERE " + " AND ".join(conditions)
+        with self.lock:
+            with self.connection:
+                for table in ("checkpoints", "records"):
+                    self.connection.execute("DELETE FROM " + table + where,
+                                            parameters)
+        logger.info("Sync store cleared.")
+
+
+class IncrementalSync():
+    invoices_operation = "listar_facturasventa"
+    diary_operation = "listar_movimientosdiario"
+
+    default_record_id_fields = {
+                                invoices_operation: ("idFactura",),
+                                diary_operation: ("idMovimiento",)
+                                }
+
+    upsert_batch_size = 500
+
+    def __init__(self, caller, store=None, overlap_in_days=7,
+                 record_id_fields=None):
+        if not store:
+            store = SyncStore()
+        self.caller = caller
+        self.store = store
+        # Colppy lets users edit records some days after their date.
+        self.overlap = datetime.timedelta(days=overlap_in_days)
+        self.record_id_fields = dict(self.default_record_id_fields)
+        if record_id_fields:
+            self.record_id_fields.update(record_id_fields)
+        self.operations_without_id = set()
+
+    def sync_invoices_for(self, start_date, end_date=None, company_id=None):
+        return self.sync_operation_for(self.invoices_operation,
+                                       self.caller.get_invoices_for,
+                                       start_date, end_date, company_id)
+
+    def sync_diary_for(self, start_date, end_date=None, company_id=None):
+        return self.sync_operation_for(self.diary_operation,
+                                       self.caller.get_diary_for,
+                                       start_date, end_date, company_id)
+
+    def get_invoices_for(self, company_id=None):
+        company_id = self.get_company_id_for(company_id)
+        return self.store.get_records_for(company_id,
+                                          self.invoices_operation)
+
+    def get_diary_for(self, company_id=None):
+        company_id = self.get_company_id_for(company_id)
+        return self.store.get_records_for(company_id, self.diary_operation)
+
+    def sync_operation_for(self, operation, get_records, start_date,
+                           end_date, company_id):
+        company_id = self.get_company_id_for(company_id)
+        start_date, end_date = self.get_requested_dates(start_date, end_date)
+        checkpoint = self.store.get_checkpoint_for(company_id, operation)
+        fetch_start_date, first_date, last_date = self \
+            .get_range_to_fetch(start_date, end_date, checkpoint)
+        if fetch_start_date > end_date:
+            logger.info("%s already synced up to %s."
+                        % (operation, end_date))
+            return 0
+        logger.info("Syncing %s from %s to %s..."
+                    % (operation, fetch_start_date, end_date))
+        dates_range = (fetch_start_date.isoformat(), end_date.isoformat())
+        records = get_records(dates_range, company_id, stream=True)
+        total_synced = self.upsert_records(company_id, operation, records)
+        self.store.save_checkpoint_for(company_id, operation, first_date,
+                                       last_date)
+        logger.info("Synced %d records of %s." % (total_synced, operation))
+        return total_synced
+
+    def get_company_id_for(self, company_id):
+        if not company_id:
+            company_id = self.caller.payload_builder.default_company_id
+        if not company_id:
+            logger.error("Please provide a Company ID.")
+            raise ValueError("No company ID.")
+        return company_id
+
+    def get_requested_dates(self, start_date, end_date):
+        if not end_date:
+            end_date = datetime.date.today()
+        start_date, end_date = [self.to_date(date)
+                                for date in (start_date, end_date)]
+        if start_date > end_date:
+            start_date, end_date = end_date, start_date
+        return start_date, end_date
+
+    def to_date(self, date):
+        if isinstance(date, str):
+            return datetime.date.fromisoformat(date)
+        return date
+
+    def get_range_to_fetch(self, start_date, end_date, checkpoint):
+        # Returns the date to fetch from and the checkpoint to save after.
+        # A checkpoint must never cover dates that were not fetched.
+        if not checkpoint:
+            return start_date, start_date, end_date
+        first_date, last_date = checkpoint
+        if end_date < first_date - datetime.timedelta(days=1):
+            logger.info("Asked for dates apart from previous syncs. "
+                        "Starting a new checkpoint.")
+            return start_date, start_date, end_date
+        if start_date < first_date:
+            logger.info("Asked for dates before first sync. Syncing all.")
+            return start_date, start_date, max(end_date, last_date)
+        fetch_start_date = max(start_date, last_date - self.overlap)
+        if start_date > last_date:
+            logger.info("Asked for dates after last sync. Syncing the gap "
+                        "since %s too." % last_date)
+            fetch_start_date = last_date - self.overlap
+        return fetch_start_date, first_date, max(end_date, last_date)
+
+    def upsert_records(self, company_id, operation, records):
+        total_upserted = 0
+        batch = []
+        for record in records:
+            batch.append((self.get_record_id_for(operation, record), record))
+            if len(batch) >= self.upsert_batch_size:
+                total_upserted += self.store \
+                    .upsert_records_for(company_id, operation, batch)
+                batch = []
+        if batch:
+            total_upserted += self.store \
+                .upsert_records_for(company_id, operation, batch)
+        return total_upserted
+
+    def get_record_id_for(self, operation, record):
+        id_fields = self.record_id_fields.get(operation, ())
+        try:
+            return "|".join(str(record[field]) for field in id_fields) \
+                or self.get_content_id_for(record)
+        except KeyError:
+            if operation not in self.operations_without_id:
+                logger.warning("No %s in %s records. Using their content "
+                               "as ID." % (id_fields, operation))
+                self.operations_without_id.add(operation)
+            return self.get_content_id_for(record)
+
+    def get_content_id_for(self, record):
+        content = json.dumps(record, sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
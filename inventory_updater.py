@@ -2,8 +2,12 @@
 ##############################################################################
 
 from colppy_api import Caller
+from retry_policy import CircuitOpenError
 from manipule_gsheets import GoogleSpread
+from tracing import Tracer
+from progress_reporter import ProgressReporter
 import datetime
+import itertools
 import pandas as pd
 import logging
 import sys
@@ -39,6 +43,11 @@ logger.addHandler(stream_handler)
 class DepositInventoryUpdater():
     item_id_col = "idItem"
     deposit_name_col = "nombre"
+    availability_col = "disponibilidad"
+    update_ts_col = "record_update_ts"
+    item_type_col = "tipoItem"
+    service_item_type = "S"
+    zero_availability = "0.00000"
     col_name_dict = {
                      "idItem": "IdItem",
                      "nombre": "Nombre",
@@ -51,30 +60,77 @@ class DepositInventoryUpdater():
                      "disponibilidad": "Disponible"
                      }
     duplicate_cols = ["disponibilidad"]
-
-    def __init__(self, state=None):
+    # Columns filled with deposit data are not listed and stay as object.
+    col_dtype_dict = {
+                      "idItem": "int64",
+                      "codigo": "object",
+                      "descripcion": "object",
+                      "tipoItem": "category",
+                      "unidadMedida": "category",
+                      "precioVenta": "float64",
+                      "costoCalculado": "float64"
+                      }
+
+    def __init__(self, state=None, max_in_flight=8, cache=None,
+                 bypass_cache=False, session_store=None, trace_path=None,
+                 skip_items_without_stock=False, deposit_snapshot=None,
+                 journal=None, base_url=None):
         if not state:
             state = "testing"
         self.state = state
+        self.max_in_flight = max_in_flight
+        self.cache = cache
+        self.bypass_cache = bypass_cache
+        self.session_store = session_store
+        # Points the updater at another Colppy, like a local fake server.
+        self.base_url = base_url
+        self.skip_items_without_stock = skip_items_without_stock
+        self.deposit_snapshot = deposit_snapshot
+        # With a journal, updates resume from it instead of the temp sheet.
+        self.journal = journal
+        self.tracer = Tracer.get_shared()
+        # Spans are only kept when a trace file is asked for.
+        self.trace_path = trace_path
+        if trace_path:
+            self.tracer.enable()
 
     def paste_deposit_inventory_to_gsheet(self, deposit_name, spread_name,
                                           batch_size=100, colppy_conf=None):
         self.setup_caller(colppy_conf)
-        self.open_spread(spread_name)
-        self.set_inventory_df()
-        self.check_and_set_deposit_name(deposit_name)
-        self.start_or_resume_inventory_updating(batch_size)
+        try:
+            with self.tracer.span("updater.run", deposit=deposit_name,
+                                  spread=spread_name):
+                self.open_spread(spread_name)
+                self.set_inventory_df()
+                self.check_and_set_deposit_name(deposit_name)
+                self.start_or_resume_inventory_updating(batch_size)
+        finally:
+            self.caller.close()
+            self.export_trace()
         self.end_program()
 
-    def setup_caller(self, colppy_conf):
+    def export_trace(self):
+        if self.trace_path:
+            self.tracer.export_chrome_trace(self.trace_path)
+
+    def setup_caller(self, colppy_conf, app_configuraton=None):
         logger.info("Setting up Colppy Caller...")
-        self.caller = Caller(colppy_conf, state=self.state)
+        self.caller = Caller(colppy_conf, app_configuraton=app_configuraton,
+                             state=self.state,
+                             pool_maxsize=self.max_in_flight,
+                             cache=self.cache,
+                             bypass_cache=self.bypass_cache,
+                             session_store=self.session_store,
+                             refresh_session_in_background=True,
+                             base_url=self.base_url,
+                             tracer=self.tracer)
         logger.info("Done.")
 
     def open_spread(self, spread_name):
         try:
-            logger.info("Opening Google spreadsheet %s..." % spread_name)
-            self.spread = GoogleSpread(spread_name)
+            logger.info("Opening Google spreadsheet %s...", spread_name)
+            self.spread_name = spread_name
+            self.spread = GoogleSpread(spread_name, tracer=self.tracer)
             logger.info("Spreadsheet opened.")
         except:  # Test error
             logger.exception("There was a problem opening the Google \
@@ -82,27 +138,67 @@ class DepositInventoryUpdater():
             raise ValueError
 
     def set_inventory_df(self):
-        self.set_updated_inventory()
-        self.convert_inventory_data_to_df_with_header()
+        with self.tracer.span("updater.get_inventory"):
+            self.set_updated_inventory()
+        with self.tracer.span("updater.build_df"):
+            self.convert_inventory_data_to_df_with_header()
+            if self.deposit_snapshot:
+                self.set_item_versions()
 
     def set_updated_inventory(self):
         logger.info("Setting updated inventory...")
-        self.updated_inventory = self.caller.get_inventory_for()
+        # Only the wanted fields are kept while items are parsed.
+        inventory = self.caller.get_inventory_for(stream=True)
+        self.updated_inventory = self.get_columns_from_items(inventory)
         logger.info("Inventory set.")
 
+    def get_columns_from_items(self, items):
+        header = list(self.col_name_dict.keys()) + [self.update_ts_col]
+        columns = {col: [] for col in header}
+        for item in items:
+            for col, values in columns.items():
+                values.append(item.get(col))
+        return columns
+
     def convert_inventory_data_to_df_with_header(self):
-        header = self.col_name_dict.keys()
-        logger.info("Setting dataframe with headers: %s" % header)
-        df = pd.DataFrame(self.updated_inventory)
-        self.df = df.reindex(columns=header)
+        header = list(self.col_name_dict.keys())
+        logger.info("Setting dataframe with headers: %s", header)
+        data = {col: self.convert_column(col, self.updated_inventory[col])
+                for col in header}
+        self.df = pd.DataFrame(data, columns=header)
         self.df.set_index(self.item_id_col, inplace=True)
         logger.info("Dataframe OK.")
 
+    def set_item_versions(self):
+        # Deposits of an item only change along with the item record or its
+        # total stock.
+        update_timestamps = self.updated_inventory[self.update_ts_col]
+        total_stocks = self.updated_inventory[self.availability_col]
+        self.item_versions = {
+            str(item_id): (str(update_ts), self.to_stock_text(total_stock))
+            for item_id, update_ts, total_stock
+            in zip(self.df.index, update_timestamps, total_stocks)}
+
+    def to_stock_text(self, stock):
+        try:
+            return repr(float(stock))
+        except (TypeError, ValueError):
+            return str(stock)
+
+    def convert_column(self, col, values):
+        dtype = self.col_dtype_dict.get(col, "object")
+        if dtype in ("int64", "float64"):
+            return pd.to_numeric(pd.Series(values, dtype="object"),
+                                 errors="coerce").astype(dtype)
+        if dtype == "category":
+            return pd.Categorical(values)
+        return pd.Series(values, dtype="object")
+
     def check_and_set_deposit_name(self, deposit_name):
-        logger.info("Checking deposit name %s..." % deposit_name)
+        logger.info("Checking deposit name %s...", deposit_name)
         if self.check_deposit_name(deposit_name):
             self.deposit_name = deposit_name
-            logger.info("Deposit name set to %s." % deposit_name)
+            logger.info("Deposit name set to %s.", deposit_name)
         else:
             raise ValueError("Wrong deposit name")
 
@@ -112,8 +208,8 @@ class DepositInventoryUpdater():
         except AttributeError:
             self.update_available_deposits()
         if deposit_name not in self.available_deposits:
-            logger.warning("Deposit %s not in available deposits."
-                           % deposit_name, " Available deposits:")
+            logger.warning("Deposit %s not in available deposits. "
+                           "Available deposits:", deposit_name)
             logger.warning(self.available_deposits)
             return False
         else:
@@ -139,11 +235,19 @@ class DepositInventoryUpdater():
 
     def start_or_resume_inventory_updating(self, batch_size):
         self.setup_temp_worksheet()
+        self.open_journal()
         if self.is_new_worksheet:
             self.spread.update_cells("A1", "B1", ["Updating sheet...", ""])
         self.update_empty_cells_with_deposit_data(batch_size)
         self.post_final_df()
         self.erease_temp_worksheet()
+        if self.journal:
+            self.journal.remove()
+
+    def open_journal(self):
+        if self.journal:
+            self.journal.open("_".join([self.spread_name,
+                                        self.temp_worksheet_name]))
 
     def setup_temp_worksheet(self):
         logger.info("Setting up worksheet...")
@@ -162,12 +266,12 @@ class DepositInventoryUpdater():
 
     def set_temp_worksheet_name(self):
         now_dt = datetime.datetime.now()
-        now_str = now_dt.strftime("%d-%m-%Y")
+        self.worksheet_date = now_dt.strftime("%d-%m-%Y")
         self.temp_worksheet_name = "_".join(["temp", self.deposit_name,
-                                            now_str])
+                                            self.worksheet_date])
 
     def find_temp_worksheet_or_create_new(self):
-        logger.info("Searching for worksheet %s" % self.temp_worksheet_name)
+        logger.info("Searching for worksheet %s", self.temp_worksheet_name)
         temp_worksheet = self.spread.find_sheet(self.temp_worksheet_name)
         if temp_worksheet:
             self.is_new_worksheet = False
@@ -189,25 +293,173 @@ class DepositInventoryUpdater():
         logger.info("Done.")
 
     def update_empty_cells_with_deposit_data(self, batch_size):
-        logger.info("Updating cells with %s deposit data..."
-                    % self.deposit_name)
+        logger.info("Updating cells with %s deposit data...",
+                    self.deposit_name)
         self.pre_update_setup(batch_size)
         items_to_update = self.get_items_to_update()
+        self.set_pending_items_per_batch(items_to_update)
+        journaled_deposits, items_to_update_now = \
+            self.split_items_by_journal(items_to_update)
+        items_without_stock, items_to_fetch = \
+            self.split_items_by_stock(items_to_update_now)
+        unchanged_deposits, items_to_fetch = \
+            self.split_items_by_snapshot(items_to_fetch)
         total_items_to_update = len(items_to_update)
-        count_items = 0
-        for item_id in items_to_update:
-            count_items += 1
-            self.try_to_update_cells_for(item_id)
-            if ((count_items % self.batch_size == 0) or
-                    (count_items == total_items_to_update)):
-                self.upload_batch_to_sheet()
-            advance = (count_items / total_items_to_update) * 100
-            logger.info(f"{'{:.2f}'.format(advance)}% done.")
+        progress = ProgressReporter(total_items_to_update, logger)
+        with self.tracer.span("updater.update_deposit_cells",
+                              items=total_items_to_update,
+                              fetched_items=len(items_to_fetch)):
+            fetched_deposits = self.caller \
+                .get_deposits_stock_for_many(items_to_fetch,
+                                             max_in_flight=self.max_in_flight)
+            deposits_per_item = itertools.chain(
+                journaled_deposits,
+                self.iter_deposits_without_stock_for(items_without_stock),
+                unchanged_deposits,
+                self.keep_fetched_deposits(fetched_deposits))
+            try:
+                for item_id, deposits in deposits_per_item:
+                    with self.tracer.span("updater.update_cells",
+                                          item_id=item_id):
+                        self.try_to_update_cells_for(item_id, deposits)
+                    self.mark_item_as_done(item_id)
+                    self.upload_completed_batches()
+                    progress.update()
+            finally:
+                self.merge_pending_values_into_df()
+                self.save_fetched_deposits()
+                if self.journal:
+                    self.journal.sync()
         logger.info("All cells updated.")
 
+    def split_items_by_stock(self, item_ids):
+        # Items with no stock in total have none in any deposit, and services
+        # never have stock, so their deposits are filled without calling.
+        if not self.skip_items_without_stock:
+            return [], item_ids
+        items = self.df.loc[item_ids]
+        total_stock = pd.to_numeric(items[self.availability_col],
+                                    errors="coerce")
+        is_service = items[self.item_type_col].astype(str) \
+            == self.service_item_type
+        without_stock = (total_stock == 0) | is_service
+        items_without_stock = list(items.index[without_stock])
+        items_to_fetch = list(items.index[~without_stock])
+        logger.info("Skipping deposit calls for %d items without stock.",
+                    len(items_without_stock))
+        return items_without_stock, items_to_fetch
+
+    def iter_deposits_without_stock_for(self, item_ids):
+        deposits = self.get_deposits_without_stock()
+        for item_id in item_ids:
+            yield item_id, deposits
+
+    def get_deposits_without_stock(self):
+        return [{self.deposit_name_col: self.deposit_name,
+                 self.availability_col: self.zero_availability}]
+
+    def split_items_by_journal(self, item_ids):
+        if not self.journal:
+            return [], item_ids
+        journaled_deposits = []
+        items_to_update_now = []
+        for item_id in item_ids:
+            deposits = self.journal.get_deposits_for(item_id)
+            if deposits is None:
+                items_to_update_now.append(item_id)
+            else:
+                journaled_deposits.append((item_id, deposits))
+        logger.info("Replaying %d items from the journal.",
+                    len(journaled_deposits))
+        return journaled_deposits, items_to_update_now
+
+    def split_items_by_snapshot(self, item_ids):
+        self.fetched_deposits_to_save = []
+        if not self.deposit_snapshot:
+            return [], item_ids
+        saved_deposits = self.deposit_snapshot \
+            .get_unchanged_deposits_for(self.get_snapshot_company_id(),
+                                        self.item_versions)
+        unchanged_deposits = [(item_id, saved_deposits[str(item_id)])
+                              for item_id in item_ids
+                              if str(item_id) in saved_deposits]
+        items_to_fetch = [item_id for item_id in item_ids
+                          if str(item_id) not in saved_deposits]
+        logger.info("Reusing deposits of %d unchanged items.",
+                    len(unchanged_deposits))
+        return unchanged_deposits, items_to_fetch
+
+    def get_snapshot_company_id(self):
+        payload_builder = self.caller.payload_builder
+        return payload_builder.company_id \
+            or payload_builder.default_company_id or ""
+
+    def keep_fetched_deposits(self, fetched_deposits):
+        for item_id, deposits in fetched_deposits:
+            if self.journal and not isinstance(deposits, Exception):
+                self.journal.append(item_id, deposits)
+            item_version = None
+            if self.deposit_snapshot:
+                item_version = self.item_versions.get(str(item_id))
+            if item_version and not isinstance(deposits, Exception):
+                self.fetched_deposits_to_save.append((str(item_id),
+                                                      item_version,
+                                                      deposits))
+            yield item_id, deposits
+
+    def save_fetched_deposits(self):
+        if self.fetched_deposits_to_save:
+            total_saved = self.deposit_snapshot \
+                .save_deposits_for(self.get_snapshot_company_id(),
+                                   self.fetched_deposits_to_save)
+            logger.info("Saved deposits of %d items to the snapshot.",
+                        total_saved)
+            self.fetched_deposits_to_save = []
+
+    def set_pending_items_per_batch(self, items_to_update):
+        self.batch_number_for_item = {}
+        self.pending_items_per_batch = []
+        for position, item_id in enumerate(items_to_update):
+            batch_number = position // self.batch_size
+            if batch_number == len(self.pending_items_per_batch):
+                self.pending_items_per_batch.append(0)
+            self.pending_items_per_batch[batch_number] += 1
+            self.batch_number_for_item[item_id] = batch_number
+        self.next_batch_to_upload = 0
+
+    def mark_item_as_done(self, item_id):
+        batch_number = self.batch_number_for_item[item_id]
+        self.pending_items_per_batch[batch_number] -= 1
+
+    def upload_completed_batches(self):
+        # Results arrive in any order but batches must be uploaded in order.
+        while (self.next_batch_to_upload < len(self.pending_items_per_batch)
+               and self.pending_items_per_batch[self.next_batch_to_upload]
+               == 0):
+            self.merge_pending_values_into_df()
+            if self.journal:
+                self.journal.sync()
+            with self.tracer.span("updater.upload_batch",
+                                  batch=self.next_batch_to_upload):
+                self.upload_batch_to_sheet()
+            self.next_batch_to_upload += 1
+
     def pre_update_setup(self, batch_size):
         self.batch_size = batch_size
         self.set_initial_update_range()
+        self.reset_pending_values()
+
+    def reset_pending_values(self):
+        # Values fetched for each item wait here until their batch is
+        # uploaded. Writing them cell by cell with df.loc is too slow.
+        self.pending_values = {col: {} for col in self.cols_to_update}
+
+    def merge_pending_values_into_df(self):
+        for col, values_per_item in self.pending_values.items():
+            if values_per_item:
+                self.df.loc[list(values_per_item.keys()), col] = \
+                    list(values_per_item.values())
+        self.reset_pending_values()
 
     def set_initial_update_range(self):
         self.set_cols_to_update()
@@ -229,13 +481,13 @@ class DepositInventoryUpdater():
         return empty_cols
 
     def update_df_if_not_new(self):
-        if not self.is_new_worksheet:
+        if not self.is_new_worksheet and not self.journal:
             logger.info("Updating dataframe with spreadsheet data...")
             self.df = self.spread.sheet_to_df(start_row=self.start_cell[0])
             logger.info("Done.")
 
     def set_start_row(self):
-        if self.is_new_worksheet:
+        if self.is_new_worksheet or self.journal:
             self.start_row = self.start_cell[0] + 1
             self.start_index = 0
         else:
@@ -247,7 +499,7 @@ class DepositInventoryUpdater():
         first_incomplete_item_id = self.get_first_incomplete_item_id_from_previous_update()
         self.start_index = list(self.df.index).index(first_incomplete_item_id)
         self.start_row = self.start_cell[0] + 1 + self.start_index
-        logger.info("Updating from row %d..." % self.start_row)
+        logger.info("Updating from row %d...", self.start_row)
 
     def get_first_incomplete_item_id_from_previous_update(self):
         first_incomplete_item_id = None
@@ -271,25 +523,32 @@ class DepositInventoryUpdater():
     def get_items_to_update(self):
         items_to_update = list(self.df.index)[self.start_index:]
         total_items_to_update = len(items_to_update)
-        logger.info("Total items to update: %d." % total_items_to_update)
+        logger.info("Total items to update: %d.", total_items_to_update)
         return items_to_update
 
-    def try_to_update_cells_for(self, item_id):
+    def try_to_update_cells_for(self, item_id, deposits):
         try:
-            self.update_cells_with_data(item_id)
+            self.update_cells_with_data(item_id, deposits)
+        except CircuitOpenError:
+            # Colppy is down. Stop here so the rerun picks up these items
+            # instead of finding them marked as errors.
+            logger.error("Colppy API is down. Stopping the update.")
+            raise
         except:  # I don't know which error I could find.
-            logger.exception("Some exception occurred for item %d" % item_id)
+            logger.exception("Some exception occurred for item %s", item_id)
             self.update_cells_with_error(item_id)
 
-    def update_cells_with_data(self, item_id):
-        deposits = self.get_deposits_stock_for(item_id)
+    def update_cells_with_data(self, item_id, deposits):
+        if isinstance(deposits, Exception):  # Raised while fetching.
+            raise deposits
         deposit_name_row = self.get_row_for_deposit(deposits)
-        for col in self.cols_to_update:
-            self.df.loc[item_id, col] = deposit_name_row[col]
+        values = [deposit_name_row[col] for col in self.cols_to_update]
+        for col, value in zip(self.cols_to_update, values):
+            self.pending_values[col][item_id] = value
 
     def update_cells_with_error(self, item_id):
         for col in self.cols_to_update:
-            self.df.loc[item_id, col] = "Error"
+            self.pending_values[col][item_id] = "Error"
 
     def get_deposits_stock_for(self, item_id):
         if item_id != 0:
@@ -299,38 +558,40 @@ class DepositInventoryUpdater():
             raise ValueError
 
     def get_row_for_deposit(self, deposits):
-        deposit_df = pd.DataFrame(deposits)
-        deposit_df.set_index(self.deposit_name_col, drop=False, inplace=True)
-        return deposit_df.loc[self.deposit_name]
+        for deposit in deposits:
+            if deposit[self.deposit_name_col] == self.deposit_name:
+                return deposit
+        raise KeyError(self.deposit_name)
 
     def upload_batch_to_sheet(self):
-        logger.info("Uploading batch of new data to worksheet...")
+        logger.debug("Uploading batch of new data to worksheet...")
         self.batch_end_index = self.batch_start_index + self.batch_size
         for col in self.cols_to_update:
             batch_values = self.get_batch_values_for(col)
             self.update_column_with_values(col, batch_values)
             self.set_new_update_range_for(col)
-        logger.info("Updating index for next batch...")
+        logger.debug("Updating index for next batch...")
         self.batch_start_index += self.batch_size
-        logger.info("Done.")
-        logger.info("Upload ok.")
+        logger.debug("Done.")
+        logger.info("Uploaded rows up to %d.",
+                    min(self.batch_end_index, self.total_rows))
 
     def get_batch_values_for(self, col):
         batch_series = self.get_batch_series_for(col)
-        logger.info("Preparing batch values...")
+        logger.debug("Preparing batch values...")
         batch_values = batch_series.fillna("").tolist()
-        logger.info("Batch OK")
-        logger.info("Batch values: %d" % len(batch_values))
+        logger.debug("Batch OK")
+        logger.debug("Batch values: %d", len(batch_values))
         return batch_values
 
     def get_batch_series_for(self, col):
-        logger.info("Preparing batch for %s..." % col)
+        logger.debug("Preparing batch for %s...", col)
         if self.update_range_dict[col][1][0] > self.last_row:
             self.update_range_dict[col][1][0] = self.last_row
-            logger.info("Getting batch series...")
+            logger.debug("Getting batch series...")
             batch_series = self.df[col].iloc[self.batch_start_index:]
         else:
-            logger.info("Getting batch series...")
+            logger.debug("Getting batch series...")
             batch_series = self.df[col].iloc[self.batch_start_index:
                                              self.batch_end_index]
         return batch_series
@@ -338,31 +599,30 @@ class DepositInventoryUpdater():
     def update_column_with_values(self, col, batch_values):
         col_init = tuple(self.update_range_dict[col][0])
         col_end = tuple(self.update_range_dict[col][1])
-        logger.info("Starting cell: %s. Last cell: %s" % (col_init,
-                                                          col_end))
-        logger.info("Updating column...")
+        logger.debug("Starting cell: %s. Last cell: %s", col_init, col_end)
+        logger.debug("Updating column...")
         self.spread.update_cells(col_init, col_end, batch_values)
-        logger.info("Updated.")
+        logger.debug("Updated.")
 
     def set_new_update_range_for(self, col):
-        logger.info("Configuring %s range for next batch..." % col)
+        logger.debug("Configuring %s range for next batch...", col)
         self.update_range_dict[col][0][0] += self.batch_size
         self.update_range_dict[col][1][0] = (self.update_range_dict[col][0][0]
                                              + self.batch_size - 1)
-        logger.info("Done.")
+        logger.debug("Done.")
 
     def post_final_df(self):
         self.final_worksheet_name = self.temp_worksheet_name[5:]
-        logger.info("Uploading final data to %s..."
-                    % self.final_worksheet_name)
+        logger.info("Uploading final data to %s...", self.final_worksheet_name)
         self.change_header_names()
-        self.spread.df_to_sheet(self.df.copy(), index=False,
-                                start_cell=self.start_cell,
-                                sheet=self.final_worksheet_name)
+        with self.tracer.span("updater.post_final_df"):
+            self.spread.df_to_sheet(self.df.copy(), index=False,
+                                    start_cell=self.start_cell,
+                                    sheet=self.final_worksheet_name)
         now_dt = datetime.datetime.now()
         self.spread.update_cells("A1", "B1",
                                  ["Updated on:", str(now_dt)])
-        logger.info("Data set to %s" % self.spread.spread_url)
+        logger.info("Data set to %s", self.spread.spread_url)
 
     def change_header_names(self):
         self.df.rename(columns=self.col_name_dict, inplace=True)
@@ -375,3 +635,109 @@ class DepositInventoryUpdater():
     def end_program(self):
         input("Program finished. Press Enter to exit.")
         sys.exit()
+
+
+class MultiDepositInventoryUpdater(DepositInventoryUpdater):
+    # Colppy answers with every deposit of an item in a single call, so all
+    # deposits are filled in one pass, one column per deposit.
+    deposit_col_prefix = "disponibilidad_"
+    wide_sheet_name = "Depositos"
+
+    def paste_deposits_inventory_to_gsheet(self, deposit_names, spread_name,
+                                           batch_size=100, colppy_conf=None,
+                                           one_sheet_per_deposit=False):
+        self.one_sheet_per_deposit = one_sheet_per_deposit
+        self.setup_caller(colppy_conf)
+        try:
+            with self.tracer.span("updater.run", deposits=deposit_names,
+                                  spread=spread_name):
+                self.open_spread(spread_name)
+                self.set_inventory_df()
+                self.check_and_set_deposit_names(deposit_names)
+                self.start_or_resume_inventory_updating(batch_size)
+        finally:
+            self.caller.close()
+            self.export_trace()
+        self.end_program()
+
+    def check_and_set_deposit_names(self, deposit_names):
+        if deposit_names == "all":
+            try:
+                deposit_names = list(self.available_deposits)
+            except AttributeError:
+                self.update_available_deposits()
+                deposit_names = list(self.available_deposits)
+        logger.info("Checking deposit names %s...", deposit_names)
+        if not deposit_names:
+            raise ValueError("No deposit names")
+        for deposit_name in deposit_names:
+            if not self.check_deposit_name(deposit_name):
+                raise ValueError("Wrong deposit name")
+        self.deposit_names = list(deposit_names)
+        # Names the temp and final worksheets.
+        self.deposit_name = self.wide_sheet_name
+        self.add_deposit_cols_to_df()
+        logger.info("Deposit names set to %s.", self.deposit_names)
+
+    def add_deposit_cols_to_df(self):
+        self.deposit_cols = {}
+        self.col_name_dict = dict(self.col_name_dict)
+        for deposit_name in self.deposit_names:
+            col = self.deposit_col_prefix + deposit_name
+            self.deposit_cols[deposit_name] = col
+            self.col_name_dict[col] = "Disponible " + deposit_name
+            self.df[col] = None
+        if self.deposit_name_col in self.df.columns:
+            self.df.drop(columns=[self.deposit_name_col], inplace=True)
+
+    def set_cols_to_update(self):
+        self.cols_to_update = list(self.deposit_cols.values())
+        logger.info("Columns to update:")
+        logger.info(self.cols_to_update)
+
+    def update_cells_with_data(self, item_id, deposits):
+        if isinstance(deposits, Exception):  # Raised while fetching.
+            raise deposits
+        availability_per_deposit = \
+            {deposit[self.deposit_name_col]: deposit[self.availability_col]
+             for deposit in deposits}
+        values = [availability_per_deposit[deposit_name]
+                  for deposit_name in self.deposit_names]
+        for col, value in zip(self.cols_to_update, values):
+            self.pending_values[col][item_id] = value
+
+    def get_deposits_without_stock(self):
+        return [{self.deposit_name_col: deposit_name,
+                 self.availability_col: self.zero_availability}
+                for deposit_name in self.deposit_names]
+
+    def post_final_df(self):
+        if not self.one_sheet_per_deposit:
+            super().post_final_df()
+            return
+        with self.tracer.span("updater.post_final_df"):
+            for deposit_name in self.deposit_names:
+                self.post_df_for_deposit(deposit_name)
+        logger.info("Data set to %s", self.spread.spread_url)
+
+    def post_df_for_deposit(self, deposit_name):
+        # Same sheet as a single deposit run for that deposit.
+        self.final_worksheet_name = "_".join([deposit_name,
+                                              self.worksheet_date])
+        logger.info("Uploading %s data to %s...", deposit_name,
+                    self.final_worksheet_name)
+        self.spread.df_to_sheet(self.get_df_for_deposit(deposit_name),
+                                index=False, start_cell=self.start_cell,
+                                sheet=self.final_worksheet_name)
+        now_dt = datetime.datetime.now()
+        self.spread.update_cells("A1", "B1", ["Updated on:", str(now_dt)],
+                                 sheet=self.final_worksheet_name)
+
+    def get_df_for_deposit(self, deposit_name):
+        header = list(DepositInventoryUpdater.col_name_dict.keys())[1:]
+        deposit_df = self.df.drop(columns=list(self.deposit_cols.values()))
+        deposit_df[self.deposit_name_col] = deposit_name
+        deposit_df[self.availability_col] = \
+            self.df[self.deposit_cols[deposit_name]]
+        return deposit_df[header] \
+            .rename(columns=DepositInventoryUpdater.col_name_dict)
@@ -1,10 +1,49 @@
-from inventory_updater import DepositInventoryUpdater
+from inventory_updater import DepositInventoryUpdater, \
+    MultiDepositInventoryUpdater
+from response_cache import ResponseCache
+from session_store import SessionKeyStore
+from deposit_snapshot import DepositSnapshotStore
+from update_journal import UpdateJournal
+from metrics import MetricsRegistry
+from queue_logging import QueueLogging
 
 state = "testing"
 gsheet_name = "test_iki"
 deposit_name = "Local"
+# A list of deposit names, or "all", fills them all in one pass instead.
+deposit_names = None
+one_sheet_per_deposit = False
+# Fills zeros for services and items without stock instead of calling Colppy.
+skip_items_without_stock = False
+metrics_port = None  # Set to a port, like 9464, to serve metrics.
+metrics_path = "cache/metrics.prom"  # Used if the port is busy.
+base_url = None  # Set to a FakeColppyServer URL to run against it.
+trace_path = None  # Set to a .json path to load the run in Perfetto.
 
 if __name__ == "__main__":
-    deposit_updater = DepositInventoryUpdater(state)
-    deposit_updater.paste_deposit_inventory_to_gsheet(deposit_name,
-                                                      gsheet_name)
+    QueueLogging().start()
+    cache = ResponseCache()
+    session_store = SessionKeyStore()
+    deposit_snapshot = DepositSnapshotStore()
+    if metrics_port:
+        MetricsRegistry.get_shared().start_exporter(metrics_port,
+                                                    metrics_path)
+    if deposit_names:
+        deposits_updater = MultiDepositInventoryUpdater(
+            state, cache=cache, session_store=session_store,
+            trace_path=trace_path,
+            skip_items_without_stock=skip_items_without_stock,
+            deposit_snapshot=deposit_snapshot, journal=UpdateJournal(),
+            base_url=base_url)
+        deposits_updater.paste_deposits_inventory_to_gsheet(
+            deposit_names, gsheet_name,
+            one_sheet_per_deposit=one_sheet_per_deposit)
+    else:
+        deposit_updater = DepositInventoryUpdater(
+            state, cache=cache, session_store=session_store,
+            trace_path=trace_path,
+            skip_items_without_stock=skip_items_without_stock,
+            deposit_snapshot=deposit_snapshot, journal=UpdateJournal(),
+            base_url=base_url)
+        deposit_updater.paste_deposit_inventory_to_gsheet(deposit_name,
+                                                          gsheet_name)
@@ -1,19 +1,56 @@
 from gspread_pandas import Spread
 from gspread_pandas.conf import get_creds
 from app_configurator import ParseConfiguration
+from metrics import MetricsRegistry
+from tracing import Tracer
+import time
 
 
 class GoogleSpread(object):
 
     def __init__(self, spread, sheet=0, creds=None,
-                 create_sheet=False, conf_file=None):
+                 create_sheet=False, conf_file=None, metrics=None,
+                 tracer=None):
+        if not metrics:
+            metrics = MetricsRegistry.get_shared()
+        self.set_metrics(metrics)
+        if not tracer:
+            tracer = Tracer.get_shared()
+        self.tracer = tracer
         if creds:
             self.creds = creds
         else:
             credentials = ParseConfiguration(conf_file).get_google_creds()
             self.creds = get_creds(config=credentials)
-        self.spread = Spread(spread, sheet=sheet, creds=self.creds,
-                             create_sheet=create_sheet)
+        self.spread = self.call_spread("open", Spread, spread, sheet=sheet,
+                                       creds=self.creds,
+                                       create_sheet=create_sheet)
+
+    def set_metrics(self, metrics):
+        self.calls_counter = metrics \
+            .counter("sheets_calls_total",
+                     "Google Sheets calls by method and result.",
+                     ("method", "result"))
+        self.latency_histogram = metrics \
+            .histogram("sheets_call_duration_seconds",
+                       "Time spent in Google Sheets calls, in seconds.",
+                       ("method",), metrics.latency_buckets_in_secs)
+        self.values_counter = metrics \
+            .counter("sheets_values_sent_total",
+                     "Cell values sent to Google Sheets.", ("method",))
+
+    def call_spread(self, method_name, method, *args, **kwargs):
+        start_time = time.monotonic()
+        result = "error"
+        try:
+            with self.tracer.span("sheets." + method_name):
+                answer = method(*args, **kwargs)
+            result = "ok"
+            return answer
+        finally:
+            self.latency_histogram.observe(time.monotonic() - start_time,
+                                           method=method_name)
+            self.calls_counter.inc(method=method_name, result=result)
 
     @property
     def spread_url(self):
@@ -29,30 +66,39 @@ class GoogleSpread(object):
 
     def df_to_sheet(self, df, index=True, headers=True, start_cell=(1, 1),
                     sheet=None, replace=False):
-        self.spread.df_to_sheet(df, index=index, headers=headers,
-                                start=start_cell, sheet=sheet, replace=replace)
+        self.values_counter.inc(df.size, method="df_to_sheet")
+        self.call_spread("df_to_sheet", self.spread.df_to_sheet, df,
+                         index=index, headers=headers, start=start_cell,
+                         sheet=sheet, replace=replace)
 
     def sheet_to_df(self, index=1, header_rows=1, start_row=1, sheet=None):
-        return self.spread.sheet_to_df(index=index, header_rows=header_rows,
-                                       start_row=start_row, sheet=sheet)
+        return self.call_spread("sheet_to_df", self.spread.sheet_to_df,
+                                index=index, header_rows=header_rows,
+                                start_row=start_row, sheet=sheet)
 
     def find_sheet(self, sheet):
-        return self.spread.find_sheet(sheet)
+        return self.call_spread("find_sheet", self.spread.find_sheet, sheet)
 
     def open_sheet(self, sheet, create=False):
-        self.spread.open_sheet(sheet, create=create)
+        self.call_spread("open_sheet", self.spread.open_sheet, sheet,
+                         create=create)
 
     def update_cells(self, start, end, vals, sheet=None):
-        self.spread.update_cells(start, end, vals, sheet=sheet)
+        self.values_counter.inc(len(vals), method="update_cells")
+        self.call_spread("update_cells", self.spread.update_cells, start, end,
+                         vals, sheet=sheet)
 
     def get_sheet_dims(self, sheet=None):
-        return self.spread.get_sheet_dims(sheet=sheet)
+        return self.call_spread("get_sheet_dims", self.spread.get_sheet_dims,
+                                sheet=sheet)
 
     def clear_sheet(self, rows=1, cols=1, sheet=None):
-        self.spread.clear_sheet(rows=rows, cols=cols, sheet=sheet)
+        self.call_spread("clear_sheet", self.spread.clear_sheet, rows=rows,
+                         cols=cols, sheet=sheet)
 
     def create_sheet(self, name, rows=1, cols=1):
-        self.spread.create_sheet(name, rows=rows, cols=cols)
+        self.call_spread("create_sheet", self.spread.create_sheet, name,
+                         rows=rows, cols=cols)
 
     def delete_sheet(self, sheet):
-        self.spread.delete_sheet(sheet)
+        self.call_spread("delete_sheet", self.spread.delete_sheet, sheet)
@@ -0,0 +1,285 @@
+# IMPORTS
+##############################################################################
+
+import bisect
+import http.server
+import os
+import threading
+import logging
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="metrics.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# CLASSES
+##############################################################################
+
+class Metric():
+    metric_type = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get_label_values_for(self, labels):
+        try:
+            return tuple(str(labels[name]) for name in self.label_names)
+        except KeyError:
+            logger.exception("Metric %s needs labels %s."
+                             % (self.name, self.label_names))
+            raise ValueError("Missing metric label.")
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help_text),
+                 "# TYPE %s %s" % (self.name, self.metric_type)]
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            lines.extend(self.render_value(label_values, value))
+        return lines
+
+    def render_value(self, label_values, value):
+        raise NotImplementedError
+
+    def format_labels(self, label_values, extra_labels=()):
+        labels = list(zip(self.label_names, label_values)) \
+            + list(extra_labels)
+        if not labels:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (name, self.escape(value))
+                                 for name, value in labels)
+
+    def escape(self, value):
+        return value.replace("\\", "\\\\").replace("\n", "\\n") \
+            .replace('"', '\\"')
+
+    def format_number(self, number):
+        if number == float("inf"):
+            return "+Inf"
+        return repr(float(number))
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        label_values = self.get_label_values_for(labels)
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) \
+                + amount
+
+    def get_value(self, **labels):
+        label_values = self.get_label_values_for(labels)
+        with self.lock:
+            return self.values.get(label_values, 0)
+
+    def render_value(self, label_values, value):
+        return ["%s%s %s" % (self.name, self.format_labels(label_values),
+                             self.format_number(value))]
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=None):
+        super().__init__(name, help_text, label_names)
+        if not buckets:
+            logger.error("Histogram %s needs buckets." % name)
+            raise ValueError("No histogram buckets.")
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        label_values = self.get_label_values_for(labels)
+        with self.lock:
+            if label_values not in self.values:
+                self.values[label_values] = \
+                    [[0] * (len(self.buckets) + 1), 0, 0]
+            bucket_counts, total, count = self.values[label_values]
+            bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[label_values][1:] = [total + value, count + 1]
+
+    def get_count(self, **labels):
+        label_values = self.get_label_values_for(labels)
+        with self.lock:
+            if label_values not in self.values:
+                return 0
+            return self.values[label_values][2]
+
+    def render_value(self, label_values, value):
+        bucket_counts, total, count = value
+        lines = []
+        cumulative_count = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),),
+                                       bucket_counts):
+            cumulative_count += bucket_count
+            labels = self.format_labels(label_values,
+                                        [("le", self.format_number(bound))])
+            lines.append("%s_bucket%s %d" % (self.name, labels,
+                                             cumulative_count))
+        labels = self.format_labels(label_values)
+        lines.append("%s_sum%s %s" % (self.name, labels,
+                                      self.format_number(total)))
+        lines.append("%s_count%s %d" % (self.name, labels, count))
+        return lines
+
+
+class MetricsRegistry():
+    shared_registries = {}
+    shared_lock = threading.Lock()
+
+    latency_buckets_in_secs = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+                               120)
+    size_buckets_in_bytes = (1024, 10 * 1024, 100 * 1024, 1024 ** 2,
+                             10 * 1024 ** 2, 100 * 1024 ** 2)
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.http_server = None
+        self.file_writer = None
+        self.stop_writing = threading.Event()
+
+    @classmethod
+    def get_shared(cls, name="colppy_to_gsheets"):
+        with cls.shared_lock:
+            if name not in cls.shared_registries:
+                cls.shared_registries[name] = cls()
+            return cls.shared_registries[name]
+
+    def counter(self, name, help_text, label_names=()):
+        return self.get_or_create(Counter, name, help_text, label_names)
+
+    def histogram(self, name, help_text, label_names=(), buckets=None):
+        return self.get_or_create(Histogram, name, help_text, label_names,
+                                  buckets=buckets)
+
+    def get_or_create(self, metric_class, name, help_text, label_names,
+                      **settings):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, help_text, label_names,
+                                      **settings)
+                self.metrics[name] = metric
+        if not isinstance(metric, metric_class) \
+                or metric.label_names != tuple(label_names):
+            logger.error("Metric %s already registered with another type or \
+                         labels." % name)
+            raise ValueError("Metric registered twice.")
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_to(self, path):
+        # Written aside and moved, so a scraper never reads half a file.
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+        logger.info("Metrics written to %s." % path)
+
+    def start_file_writer(self, path, interval_in_secs=15):
+        # For the textfile collector of node exporter.
+        if self.file_writer:
+            return
+        self.stop_writing.clear()
+        self.file_writer = threading.Thread(target=self.keep_writing_to,
+                                            args=(path, interval_in_secs),
+                                            name="metrics-writer",
+                                            daemon=True)
+        self.file_writer.start()
+
+    def keep_writing_to(self, path, interval_in_secs):
+        while not self.stop_writing.wait(interval_in_secs):
+            self.try_to_write_to(path)
+        self.try_to_write_to(path)
+
+    def try_to_write_to(self, path):
+        try:
+            self.write_to(path)
+        except OSError:
+            logger.exception("Could not write metrics to %s." % path)
+
+    def stop_file_writer(self):
+        if self.file_writer:
+            self.stop_writing.set()
+            self.file_writer.join()
+            self.file_writer = None
+
+    def start_http_server(self, port=9464, host="127.0.0.1"):
+        if self.http_server:
+            return self.http_server
+        self.http_server = http.server.ThreadingHTTPServer(
+            (host, port), MetricsRequestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.registry = self
+        thread = threading.Thread(target=self.http_server.serve_forever,
+                                  name="metrics-server", daemon=True)
+        thread.start()
+        logger.info("Serving metrics on http://%s:%d/metrics"
+                    % self.http_server.server_address[:2])
+        return self.http_server
+
+    def start_exporter(self, port, path="cache/metrics.prom"):
+        # A busy port must not stop the run, so metrics go to a file then.
+        try:
+            return self.start_http_server(port)
+        except OSError:
+            logger.exception("Could not serve metrics on port %d. Writing "
+                             "them to %s instead." % (port, path))
+            self.start_file_writer(path)
+
+    def stop_http_server(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", self.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
@@ -0,0 +1,63 @@
+# IMPORTS
+##############################################################################
+
+import datetime
+import time
+
+
+# CLASSES
+##############################################################################
+
+class ProgressReporter():
+    # Logs one line every few seconds instead of one line per item.
+    def __init__(self, total, logger, unit="items", every_secs=10,
+                 clock=time.monotonic):
+        self.total = total
+        self.logger = logger
+        self.unit = unit
+        self.every_secs = every_secs
+        self.clock = clock
+        self.done = 0
+        self.start_time = clock()
+        self.last_report_time = self.start_time
+
+    def update(self, count=1):
+        self.done += count
+        now = self.clock()
+        if now - self.last_report_time >= self.every_secs \
+                or self.done >= self.total:
+            self.report(now)
+
+    def report(self, now=None):
+        if now is None:
+            now = self.clock()
+        self.last_report_time = now
+        self.logger.info("%d of %d %s done (%.1f%%). %.1f %s/sec. ETA %s.",
+                         self.done, self.total, self.unit,
+                         self.get_percent_done(), self.get_rate_for(now),
+                         self.unit, self.format_secs(self.get_eta_for(now)))
+
+    def get_percent_done(self):
+        if not self.total:
+            return 100.0
+        return self.done / self.total * 100
+
+    def get_rate_for(self, now):
+        elapsed_in_secs = now - self.start_time
+        if elapsed_in_secs <= 0:
+            return 0.0
+        return self.done / elapsed_in_secs
+
+    def get_eta_for(self, now):
+        remaining = max(0, self.total - self.done)
+        if not remaining:
+            return 0
+        rate = self.get_rate_for(now)
+        if not rate:
+            return None
+        return remaining / rate
+
+    def format_secs(self, secs):
+        if secs is None:
+            return "unknown"
+        return str(datetime.timedelta(seconds=round(secs)))
@@ -0,0 +1,93 @@
+# IMPORTS
+##############################################################################
+
+import atexit
+import logging
+import logging.handlers
+import queue
+
+
+# CLASSES
+##############################################################################
+
+class QueueLogging():
+    # Every module attaches its own file and console handlers at import.
+    # Started once by the application, this moves them behind one queue:
+    # logging calls only enqueue and a listener thread does the writing.
+    def __init__(self, logger_names=None):
+        self.logger_names = logger_names
+        self.queue = queue.SimpleQueue()
+        self.listener = None
+        self.handlers_per_logger = {}
+        self.previous_levels = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        if self.listener:
+            return
+        logger_names = self.logger_names \
+            or self.get_logger_names_with_handlers()
+        for name in logger_names:
+            self.move_handlers_behind_queue(logging.getLogger(name))
+        self.listener = logging.handlers.QueueListener(
+            self.queue, LoggerRoutingHandler(self.handlers_per_logger))
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def get_logger_names_with_handlers(self):
+        return [name for name, logger
+                in list(logging.root.manager.loggerDict.items())
+                if isinstance(logger, logging.Logger) and logger.handlers]
+
+    def move_handlers_behind_queue(self, logger):
+        handlers = [handler for handler in logger.handlers
+                    if not isinstance(handler,
+                                      logging.handlers.QueueHandler)]
+        if not handlers:
+            return
+        for handler in handlers:
+            logger.removeHandler(handler)
+        self.handlers_per_logger[logger.name] = handlers
+        # Records no handler would write are not even created.
+        level = min(handler.level for handler in handlers)
+        queue_handler = logging.handlers.QueueHandler(self.queue)
+        queue_handler.setLevel(level)
+        logger.addHandler(queue_handler)
+        self.previous_levels[logger.name] = logger.level
+        logger.setLevel(max(logger.level, level))
+
+    def stop(self):
+        if not self.listener:
+            return
+        self.listener.stop()
+        self.listener = None
+        atexit.unregister(self.stop)
+        for name, handlers in self.handlers_per_logger.items():
+            logger = logging.getLogger(name)
+            for handler in list(logger.handlers):
+                if isinstance(handler, logging.handlers.QueueHandler):
+                    logger.removeHandler(handler)
+            for handler in handlers:
+                logger.addHandler(handler)
+            logger.setLevel(self.previous_levels[name])
+        self.handlers_per_logger = {}
+        self.previous_levels = {}
+
+
+class LoggerRoutingHandler(logging.Handler):
+    # Sends each record to the handlers its own logger had.
+    def __init__(self, handlers_per_logger):
+        super().__init__()
+        self.handlers_per_logger = handlers_per_logger
+
+    def handle(self, record):
+        for handler in self.handlers_per_logger.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
@@ -0,0 +1,182 @@
+# IMPORTS
+##############################################################################
+
+import logging
+import threading
+import time
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="rate_limiter.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# CLASSES
+##############################################################################
+
+class TokenBucket():
+    def __init__(self, rate_per_sec, capacity=None):
+        if not capacity:
+            capacity = rate_per_sec
+        self.check_positive(rate_per_sec)
+        self.check_positive(capacity)
+        self.rate_per_sec = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def check_positive(self, number):
+        try:
+            assert number > 0
+        except (AssertionError, TypeError):
+            logger.exception("Rate and capacity must be positive numbers.")
+            raise ValueError("Wrong token bucket setting.")
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_in_secs = (1 - self.tokens) / self.rate_per_sec
+            time.sleep(wait_in_secs)
+
+    def try_acquire(self):
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed_in_secs = now - self.last_refill
+        self.tokens = min(self.capacity,
+                          self.tokens + elapsed_in_secs * self.rate_per_sec)
+        self.last_refill = now
+
+
+class AdaptiveConcurrencyLimiter():
+    # AIMD: the limit grows by about one for every limit's worth of healthy
+    # responses and is cut by decrease_factor on overload.
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=32,
+                 decrease_factor=0.5, healthy_latency_factor=2.0):
+        try:
+            assert 0 < min_limit <= initial_limit <= max_limit
+            assert 0 < decrease_factor < 1
+        except AssertionError:
+            logger.exception("Concurrency limits must be 0 < min <= initial \
+                             <= max and decrease factor in (0, 1).")
+            raise ValueError("Wrong concurrency settings.")
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.healthy_latency_factor = healthy_latency_factor
+        self.in_flight = 0
+        self.best_latency = None
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.current_limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency_in_secs, overloaded=False):
+        with self.condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.decrease_limit()
+            else:
+                self.update_limit_for_latency(latency_in_secs)
+            self.condition.notify_all()
+
+    def report_overload(self):
+        with self.condition:
+            self.decrease_limit()
+            self.condition.notify_all()
+
+    def decrease_limit(self):
+        # Requests that were already in flight fail together. Only the
+        # first one of them should cut the limit.
+        now = time.monotonic()
+        cooldown_in_secs = self.best_latency or 0
+        if now - self.last_decrease < cooldown_in_secs:
+            return
+        self.last_decrease = now
+        new_limit = max(self.min_limit, self.limit * self.decrease_factor)
+        if int(new_limit) < self.current_limit:
+            logger.warning("Backing off. Concurrency limit set to %d."
+                           % int(new_limit))
+        self.limit = new_limit
+
+    def update_limit_for_latency(self, latency_in_secs):
+        if self.best_latency is None or latency_in_secs < self.best_latency:
+            self.best_latency = latency_in_secs
+        else:
+            # Let the baseline follow slow, lasting latency changes.
+            self.best_latency *= 1.001
+        healthy_latency = self.best_latency * self.healthy_latency_factor
+        if latency_in_secs <= healthy_latency:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class RequestThrottle():
+    shared_throttles = {}
+    shared_lock = threading.Lock()
+
+    def __init__(self, rate_per_sec=20, burst=None, initial_concurrency=4,
+                 min_concurrency=1, max_concurrency=32):
+        self.bucket = None
+        if rate_per_sec:
+            self.bucket = TokenBucket(rate_per_sec, burst)
+        self.concurrency = AdaptiveConcurrencyLimiter(initial_concurrency,
+                                                      min_concurrency,
+                                                      max_concurrency)
+
+    @classmethod
+    def get_shared(cls, name="colppy", **settings):
+        with cls.shared_lock:
+            if name not in cls.shared_throttles:
+                logger.info("Creating shared request throttle %s..." % name)
+                cls.shared_throttles[name] = cls(**settings)
+            return cls.shared_throttles[name]
+
+    def acquire(self):
+        self.concurrency.acquire()
+        if self.bucket:
+            self.bucket.acquire()
+        return time.monotonic()
+
+    def release(self, start_time, overloaded=False):
+        latency_in_secs = time.monotonic() - start_time
+        self.concurrency.release(latency_in_secs, overloaded)
+
+    def report_overload(self):
+        self.concurrency.report_overload()
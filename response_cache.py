@@ -0,0 +1,177 @@
+# IMPORTS
+##############################################################################
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="response_cache.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# CLASSES
+##############################################################################
+
+class ResponseCache():
+    # Operations not listed here are never cached. Login must never be.
+    default_ttls_in_secs = {
+                            "listar_empresa": 24 * 60 * 60,
+                            "listar_ccostos": 24 * 60 * 60,
+                            "listar_itemsinventario": 15 * 60,
+                            "listar_dispDeposito": 15 * 60,
+                            "listar_facturasventa": 60 * 60,
+                            "listar_movimientosdiario": 60 * 60
+                            }
+
+    def __init__(self, path="cache/colppy_cache.sqlite3", ttls_in_secs=None,
+                 max_size_in_mb=200):
+        self.path = path
+        self.ttls_in_secs = dict(self.default_ttls_in_secs)
+        if ttls_in_secs:
+            self.ttls_in_secs.update(ttls_in_secs)
+        self.max_size_in_bytes = int(max_size_in_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.open_database()
+
+    def open_database(self):
+        logger.info("Opening response cache at %s..." % self.path)
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    operation TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )""")
+        logger.info("Cache opened.")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get_operation_for_payload(self, payload):
+        try:
+            return payload["service"]["operacion"]
+        except (KeyError, TypeError):
+            return None
+
+    def get_ttl_for_payload(self, payload):
+        operation = self.get_operation_for_payload(payload)
+        return self.ttls_in_secs.get(operation)
+
+    def get_key_for_payload(self, payload, scope=None):
+        # Session keys change on every login but do not change the answer.
+        # The scope keeps answers from different servers or users apart.
+        cacheable_payload = dict(payload)
+        try:
+            parameters = dict(payload["parameters"])
+            parameters.pop("sesion", None)
+            cacheable_payload["parameters"] = parameters
+        except (KeyError, TypeError, ValueError):
+            pass
+        canonical_payload = json.dumps([scope, cacheable_payload],
+                                       sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical_payload.encode("utf-8")).hexdigest()
+
+    def get_content_for(self, payload, scope=None):
+        ttl = self.get_ttl_for_payload(payload)
+        if not ttl:
+            return None
+        key = self.get_key_for_payload(payload, scope)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT content, created_at FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            content, created_at = row
+            with self.connection:
+                if now - created_at > ttl:
+                    self.connection.execute(
+                        "DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                self.connection.execute(
+                    "UPDATE responses SET last_access = ? WHERE key = ?",
+                    (now, key))
+        return json.loads(content)
+
+    def set_content_for(self, payload, content, scope=None):
+        if not self.get_ttl_for_payload(payload):
+            return
+        key = self.get_key_for_payload(payload, scope)
+        operation = self.get_operation_for_payload(payload)
+        serialized_content = json.dumps(content)
+        size = len(serialized_content)
+        if size > self.max_size_in_bytes:
+            logger.warning("Response for %s too big to cache." % operation)
+            return
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, operation, serialized_content, size, now, now))
+                self.evict_least_recently_used()
+
+    def evict_least_recently_used(self):
+        total_size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_size_in_bytes:
+            return
+        logger.info("Cache over size limit. Evicting old responses...")
+        rows = self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if total_size <= self.max_size_in_bytes:
+                break
+            self.connection.execute("DELETE FROM responses WHERE key = ?",
+                                    (key,))
+            total_size -= size
+
+    def get_size_in_bytes(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def clear(self, operation=None):
+        logger.info("Clearing response cache...")
+        with self.lock:
+            with self.connection:
+                if operation:
+                    self.connection.execute(
+                        "DELETE FROM responses WHERE operation = ?",
+                        (operation,))
+                else:
+                    self.connection.execute("DELETE FROM responses")
+        logger.info("Cache cleared.")
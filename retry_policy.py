@@ -0,0 +1,116 @@
+# IMPORTS
+##############################################################################
+
+import logging
+import random
+import threading
+import time
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="retry_policy.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# EXCEPTIONS
+##############################################################################
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# CLASSES
+##############################################################################
+
+class RetryPolicy():
+    def __init__(self, max_attempts=3, base_delay_in_secs=0.5,
+                 max_delay_in_secs=30, jitter=True,
+                 retry_on_unsuccessful=True):
+        try:
+            assert isinstance(max_attempts, int)
+            assert max_attempts > 0
+            assert 0 <= base_delay_in_secs <= max_delay_in_secs
+        except AssertionError:
+            logger.exception("Max attempts must be a positive int and \
+                             0 <= base delay <= max delay.")
+            raise ValueError("Wrong retry policy.")
+        self.max_attempts = max_attempts
+        self.base_delay_in_secs = base_delay_in_secs
+        self.max_delay_in_secs = max_delay_in_secs
+        self.jitter = jitter
+        self.retry_on_unsuccessful = retry_on_unsuccessful
+
+    def get_delay_for(self, attempt):
+        # Full jitter: spreads retries of many workers failing together.
+        delay_in_secs = min(self.max_delay_in_secs,
+                            self.base_delay_in_secs * 2 ** (attempt - 1))
+        if self.jitter:
+            delay_in_secs = random.uniform(0, delay_in_secs)
+        return delay_in_secs
+
+    def has_attempts_left(self, attempt):
+        return attempt < self.max_attempts
+
+
+class CircuitBreaker():
+    closed = "closed"
+    open = "open"
+    half_open = "half open"
+
+    def __init__(self, failure_threshold=5, reset_timeout_in_secs=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_in_secs = reset_timeout_in_secs
+        self.state = self.closed
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def check(self):
+        with self.lock:
+            if self.state == self.closed:
+                return
+            if self.state == self.open \
+                    and self.get_secs_since_opened() >= \
+                    self.reset_timeout_in_secs:
+                logger.info("Circuit half open. Trying one request...")
+                self.state = self.half_open
+                return
+            raise CircuitOpenError("Colppy API looks down. Not calling it.")
+
+    def get_secs_since_opened(self):
+        return time.monotonic() - self.opened_at
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.closed:
+                logger.info("Circuit closed. Colppy API is back.")
+            self.state = self.closed
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == self.half_open \
+                    or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.open:
+                    logger.error("Circuit open after %d failures."
+                                 % self.consecutive_failures)
+                self.state = self.open
+                self.opened_at = time.monotonic()
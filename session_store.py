@@ -0,0 +1,105 @@
+# IMPORTS
+##############################################################################
+
+import contextlib
+import datetime
+import json
+import logging
+import os
+import threading
+try:
+    import fcntl
+except ImportError:  # Not available on Windows. Only threads get locked.
+    fcntl = None
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="session_store.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# CLASSES
+##############################################################################
+
+class SessionKeyStore():
+    def __init__(self, path="cache/colppy_sessions.json"):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.thread_lock = threading.RLock()
+        self.lock_file = None
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    @contextlib.contextmanager
+    def locked(self):
+        with self.thread_lock:
+            if self.lock_file:  # Already locked by this same thread.
+                yield self
+                return
+            with open(self.lock_path, "a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self.lock_file = lock_file
+                try:
+                    yield self
+                finally:
+                    self.lock_file = None
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_session_for(self, account):
+        sessions = self.read_sessions()
+        try:
+            session = sessions[account]
+            login_time = datetime.datetime \
+                .fromisoformat(session["login_time"])
+            return session["session_key"], login_time
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def save_session_for(self, account, session_key, login_time):
+        with self.locked():
+            sessions = self.read_sessions()
+            sessions[account] = {"session_key": session_key,
+                                 "login_time": login_time.isoformat()}
+            self.write_sessions(sessions)
+        logger.info("Session key saved for %s." % account)
+
+    def read_sessions(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.exception("Session store file is corrupt. Ignoring it.")
+            return {}
+
+    def write_sessions(self, sessions):
+        # Session keys are credentials: keep the file private and write it
+        # atomically so other processes never read half a file.
+        temp_path = self.path + ".tmp"
+        file_descriptor = os.open(temp_path,
+                                  os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                                  0o600)
+        with os.fdopen(file_descriptor, "w") as f:
+            json.dump(sessions, f)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,104 @@
+import unittest
+import tempfile
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from benchmark import BenchmarkSuite, InMemoryColppySession, \
+    InMemoryGoogleSpread
+from fake_colppy_server import FakeColppyDataset
+from colppy_api import Caller
+
+
+# TESTS
+#########################################################################
+
+
+class BenchmarkSuiteTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.results_path = os.path.join(self.temp_dir.name, "results.jsonl")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_runs_every_benchmark_for_every_size(self):
+        suite = BenchmarkSuite(sizes=(20, 30), repeat=2,
+                               results_path=self.results_path)
+        run_results = suite.run()
+        measured = [(result["benchmark"], result["size"])
+                    for result in run_results["results"]]
+        self.assertEqual(measured,
+                         [(name, size) for size in (20, 30)
+                          for name in BenchmarkSuite.benchmark_names])
+        for result in run_results["results"]:
+            self.assertGreater(result["best_secs"], 0)
+            self.assertLessEqual(result["best_secs"], result["median_secs"])
+            self.assertGreaterEqual(result["peak_memory_in_mb"], 0)
+
+    def test_raises_on_unknown_benchmark(self):
+        with self.assertRaises(ValueError):
+            BenchmarkSuite(benchmarks=["unknown"])
+
+    def test_compares_with_previous_saved_run(self):
+        suite = BenchmarkSuite(sizes=(10,), benchmarks=["payload_build"],
+                               repeat=1, trace_memory=False,
+                               results_path=self.results_path)
+        first_results, first_comparison = suite.run_compare_and_save()
+        second_results, second_comparison = suite.run_compare_and_save()
+        self.assertEqual(first_comparison, [])
+        self.assertEqual(len(second_comparison), 1)
+        self.assertEqual(second_comparison[0]["previous_secs"],
+                         first_results["results"][0]["best_secs"])
+        self.assertEqual(suite.get_previous_run_results(), second_results)
+
+    def test_end_to_end_fills_every_item(self):
+        dataset = FakeColppyDataset(total_items=15)
+        suite = BenchmarkSuite(batch_size=4)
+        run = suite.get_end_to_end_run_for(dataset)
+        updater = run()
+        final_df = updater.spread.sheets[updater.final_worksheet_name]
+        self.assertEqual(len(final_df.index), 15)
+        self.assertNotIn("Error", final_df["Disponible"].tolist())
+        self.assertEqual(updater.spread.updated_values_count, 15 * 2 + 4)
+        self.assertNotIn(updater.temp_worksheet_name, updater.spread.sheets)
+
+    def test_end_to_end_reads_given_app_configuration(self):
+        dataset = FakeColppyDataset(total_items=5, company_ids=("11111",))
+        suite = BenchmarkSuite(app_configuraton="test/data/"
+                               "app_configuration_test.json",
+                               benchmarks=("end_to_end",))
+        updater = suite.get_end_to_end_run_for(dataset)()
+        payload_builder = updater.caller.payload_builder
+        self.assertEqual(payload_builder.default_company_id, "11111")
+        self.assertEqual(payload_builder.user, "test_user@gmail.com")
+        final_df = updater.spread.sheets[updater.final_worksheet_name]
+        self.assertEqual(len(final_df.index), 5)
+
+
+class InMemoryBackendsTest(unittest.TestCase):
+    def test_caller_talks_to_in_memory_session(self):
+        dataset = FakeColppyDataset(total_items=12)
+        suite = BenchmarkSuite()
+        with Caller() as caller:
+            suite.connect_caller_to_dataset(caller, dataset)
+            items = caller.get_inventory_for(page_size=5, stream=True)
+            self.assertEqual(len(list(items)), 12)
+            self.assertIsInstance(caller.requester.http_session,
+                                  InMemoryColppySession)
+
+    def test_spread_keeps_sheets_in_memory(self):
+        spread = InMemoryGoogleSpread()
+        self.assertIsNone(spread.find_sheet("temp"))
+        spread.open_sheet("temp", create=True)
+        spread.update_cells("A1", "B1", ["a", "b"])
+        self.assertEqual(spread.find_sheet("temp"), "temp")
+        self.assertEqual(spread.updated_values_count, 2)
+        spread.delete_sheet("temp")
+        self.assertIsNone(spread.find_sheet("temp"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,25 @@
 import unittest
-from requests import HTTPError
+from requests import HTTPError, ConnectionError
 from unittest.mock import patch, Mock
 import json
 import datetime
 import os
 import sys
+import tempfile
 import inspect
+from concurrent.futures import ThreadPoolExecutor
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 
-from colppy_api import Caller, PayloadBuilder, RequestMaker, ResponseParser
+from colppy_api import Caller, PayloadBuilder, RequestMaker, ResponseParser, \
+    StreamingResponseParser, JSONStreamReader, CompiledPayload, \
+    DatesSharder, UnsuccessfulResponseError
+from response_cache import ResponseCache
+from session_store import SessionKeyStore
+from retry_policy import RetryPolicy, CircuitBreaker, CircuitOpenError
+from colppy_records import InventoryItem, RecordColumns
+from metrics import MetricsRegistry
 
 
 # MOCKED CLASSES AND FUNCTIONS
@@ -26,9 +35,40 @@ def mock_response(json_data, raise_status=None):
 
     mocked_response.json = Mock(return_value=json_data)
 
+    body = json.dumps(json_data).encode("utf-8")
+    mocked_response.iter_content = Mock(
+        side_effect=lambda chunk_size=1: split_in_chunks(body, chunk_size))
+
     return mocked_response
 
 
+def mock_status_response(status_code):
+    mocked_response = mock_response({})
+    mocked_response.status_code = status_code
+    mocked_response.raise_for_status.side_effect = HTTPError(status_code)
+    return mocked_response
+
+
+def split_in_chunks(body, chunk_size):
+    return (body[start:start + chunk_size]
+            for start in range(0, len(body), chunk_size))
+
+
+def mock_paginated_get(records, records_key="data", with_total=True,
+                       max_page_size=None):
+    def get_page(url, json=None, **kwargs):
+        start = json["parameters"]["start"]
+        limit = json["parameters"]["limit"]
+        if max_page_size:
+            limit = min(limit, max_page_size)
+        content = {"success": True,
+                   records_key: records[start:start + limit]}
+        if with_total:
+            content["total"] = str(len(records))
+        return mock_response({"response": content})
+    return get_page
+
+
 # TESTS
 #########################################################################
 
@@ -65,6 +105,94 @@ class ResponseParserTest(unittest.TestCase):
         self.assertTrue("success" in response.get_response_content().keys())
 
 
+class StreamingResponseParserTest(unittest.TestCase):
+    records = [{"idItem": number, "descripcion": "Añil %d" % number,
+                "precio": 10.5 * number} for number in range(50)]
+
+    def stream_records_with_chunk_size(self, response_json, chunk_size):
+        mock_response_input = mock_response(response_json)
+        parser = StreamingResponseParser(mock_response_input, "data")
+        parser.chunk_size = chunk_size
+        return list(parser.iter_records()), parser
+
+    def test_yields_records_for_any_chunk_size(self):
+        response_json = {"service": {"operacion": "listar"},
+                         "response": {"success": True,
+                                      "data": self.records,
+                                      "total": 50}}
+        for chunk_size in (1, 7, 64, 100000):
+            records, parser = self.stream_records_with_chunk_size(
+                                                        response_json,
+                                                        chunk_size)
+            self.assertEqual(records, self.records)
+            self.assertEqual(parser.get_response_content()["total"], 50)
+
+    def test_raises_before_records_if_not_success(self):
+        response_json = {"response": {"success": False,
+                                      "data": self.records}}
+        parser = StreamingResponseParser(mock_response(response_json),
+                                         "data")
+        records = parser.iter_records()
+        with self.assertRaises(UnsuccessfulResponseError):
+            next(records)
+
+    def test_raises_after_records_if_success_comes_last(self):
+        response_json = {"response": {"data": self.records,
+                                      "success": False}}
+        parser = StreamingResponseParser(mock_response(response_json),
+                                         "data")
+        records = parser.iter_records()
+        self.assertEqual(next(records), self.records[0])
+        with self.assertRaises(ValueError):
+            list(records)
+
+    def test_raises_if_response_empty(self):
+        response_json = {"result": "some result", "response": None}
+        parser = StreamingResponseParser(mock_response(response_json),
+                                         "data")
+        with self.assertRaises(ValueError):
+            list(parser.iter_records())
+
+    def test_raises_on_truncated_body(self):
+        mock_response_input = mock_response({})
+        mock_response_input.iter_content = Mock(
+            return_value=iter([b'{"response": {"success": true, "data": [{']))
+        parser = StreamingResponseParser(mock_response_input, "data")
+        with self.assertRaises(ValueError):
+            list(parser.iter_records())
+
+
+class JSONStreamReaderTest(unittest.TestCase):
+    def read_array(self, chunks):
+        return list(JSONStreamReader(chunks).iter_array_values())
+
+    def test_reads_number_split_after_point(self):
+        self.assertEqual(self.read_array([b'[1.', b'5]']), [1.5])
+        self.assertEqual(self.read_array([b'[10', b'.', b'25, 3]']),
+                         [10.25, 3])
+
+    def test_reads_number_split_after_exponent(self):
+        self.assertEqual(self.read_array([b'[2e', b'3]']), [2000.0])
+        self.assertEqual(self.read_array([b'[2', b'E-', b'1 ]']), [0.2])
+
+    def test_reads_literals_split_across_chunks(self):
+        self.assertEqual(self.read_array([b'[tr', b'ue, nu', b'll]']),
+                         [True, None])
+        self.assertEqual(self.read_array([b'[n', b'ull,', b'f', b'alse]']),
+                         [None, False])
+
+    def test_reads_scalar_ending_the_response(self):
+        self.assertEqual(JSONStreamReader([b'12', b'.5']).read_value(),
+                         12.5)
+
+    def test_reads_object_split_after_key(self):
+        reader = JSONStreamReader([b'{"total"', b': 4', b'2}'])
+        values = {}
+        for key in reader.iter_object_keys():
+            values[key] = reader.read_value()
+        self.assertEqual(values, {"total": 42})
+
+
 class RequestMakerTest(unittest.TestCase):
     def test_raises_on_invalid_state(self):
         invalid_state = "Testing"
@@ -94,6 +222,213 @@ class RequestMakerTest(unittest.TestCase):
                                             request_type=request_type)
         self.assertEqual(answer, "POST")
 
+    def test_uses_http_session_if_given(self):
+        payload = {"check": "check"}
+        http_session = Mock()
+        http_session.get.return_value = "SESSION GET"
+        request_maker = RequestMaker(http_session=http_session)
+        answer = request_maker.get_response(payload)
+        self.assertEqual(answer, "SESSION GET")
+        http_session.get.assert_called_once_with(request_maker.call_url,
+                                                 json=payload, stream=False,
+                                                 timeout=(10, 120))
+
+    def test_base_url_overrides_state_url(self):
+        base_url = "http://127.0.0.1:8080/lib/frontera2/service.php"
+        request_maker = RequestMaker(base_url=base_url)
+        self.assertEqual(request_maker.call_url, base_url)
+
+    def test_overload_response_backs_off_throttle(self):
+        http_session = Mock()
+        http_session.get.return_value = Mock(status_code=429)
+        throttle = Mock()
+        request_maker = RequestMaker(http_session=http_session,
+                                     throttle=throttle)
+        request_maker.get_response({"check": "check"})
+        throttle.acquire.assert_called_once()
+        self.assertTrue(throttle.release.call_args[0][1])
+
+    def test_connection_error_backs_off_throttle(self):
+        http_session = Mock()
+        http_session.get.side_effect = HTTPError("Connection dropped")
+        throttle = Mock()
+        request_maker = RequestMaker(http_session=http_session,
+                                     throttle=throttle)
+        with self.assertRaises(HTTPError):
+            request_maker.get_response({"check": "check"})
+        self.assertTrue(throttle.release.call_args[0][1])
+
+    def test_unsuccessful_content_backs_off_throttle(self):
+        http_session = Mock()
+        http_session.get.return_value = mock_response(
+                                            {"response": {"success": False}})
+        throttle = Mock()
+        no_retries = {"default": RetryPolicy(max_attempts=1)}
+        request_maker = RequestMaker(http_session=http_session,
+                                     throttle=throttle,
+                                     retry_policies=no_retries)
+        with self.assertRaises(ValueError):
+            request_maker.get_content({"check": "check"})
+        self.assertFalse(throttle.release.call_args[0][1])
+        throttle.report_overload.assert_called_once()
+
+    def test_overload_status_backs_off_throttle_once(self):
+        http_session = Mock()
+        overload_response = mock_response({})
+        overload_response.status_code = 503
+        overload_response.raise_for_status.side_effect = HTTPError("503")
+        http_session.get.return_value = overload_response
+        throttle = Mock()
+        no_retries = {"default": RetryPolicy(max_attempts=1)}
+        request_maker = RequestMaker(http_session=http_session,
+                                     throttle=throttle,
+                                     retry_policies=no_retries)
+        with self.assertRaises(ValueError):
+            request_maker.get_content({"check": "check"})
+        self.assertTrue(throttle.release.call_args[0][1])
+        throttle.report_overload.assert_not_called()
+
+
+    def get_fast_retrying_request_maker(self, http_session,
+                                        circuit_breaker=None):
+        fast_retries = {"default": RetryPolicy(max_attempts=3,
+                                               base_delay_in_secs=0)}
+        return RequestMaker(http_session=http_session,
+                            retry_policies=fast_retries,
+                            circuit_breaker=circuit_breaker)
+
+    def test_retries_connection_error(self):
+        http_session = Mock()
+        http_session.get.side_effect = [
+            ConnectionError("Connection dropped"),
+            mock_response({"response": {"success": True, "data": []}})
+            ]
+        request_maker = self.get_fast_retrying_request_maker(http_session)
+        content = request_maker.get_content({"check": "check"})
+        self.assertEqual(content, {"success": True, "data": []})
+        self.assertEqual(http_session.get.call_count, 2)
+
+    def test_retries_unsuccessful_response(self):
+        http_session = Mock()
+        http_session.get.side_effect = [
+            mock_response({"response": {"success": False}}),
+            mock_response({"response": {"success": True, "data": []}})
+            ]
+        request_maker = self.get_fast_retrying_request_maker(http_session)
+        content = request_maker.get_content({"check": "check"})
+        self.assertEqual(content, {"success": True, "data": []})
+
+    def test_gives_up_after_max_attempts(self):
+        http_session = Mock()
+        http_session.get.side_effect = ConnectionError("Colppy down")
+        request_maker = self.get_fast_retrying_request_maker(http_session)
+        with self.assertRaises(ConnectionError):
+            request_maker.get_content({"check": "check"})
+        self.assertEqual(http_session.get.call_count, 3)
+
+    def test_does_not_retry_client_errors(self):
+        http_session = Mock()
+        http_session.get.side_effect = HTTPError("Bad request")
+        request_maker = self.get_fast_retrying_request_maker(http_session)
+        with self.assertRaises(HTTPError):
+            request_maker.get_content({"check": "check"})
+        self.assertEqual(http_session.get.call_count, 1)
+
+    def test_uses_retry_policy_for_operation(self):
+        http_session = Mock()
+        http_session.get.side_effect = ConnectionError("Colppy down")
+        retry_policies = {"listar_ccostos": RetryPolicy(max_attempts=2,
+                                                        base_delay_in_secs=0)}
+        request_maker = RequestMaker(http_session=http_session,
+                                     retry_policies=retry_policies)
+        payload = {"service": {"operacion": "listar_ccostos"}}
+        with self.assertRaises(ConnectionError):
+            request_maker.get_content(payload)
+        self.assertEqual(http_session.get.call_count, 2)
+
+    def test_counts_calls_retries_and_errors(self):
+        http_session = Mock()
+        ok_response = mock_response({"response": {"success": True}})
+        ok_response.status_code = 200
+        ok_response.headers = {"Content-Length": "2048"}
+        http_session.get.side_effect = [ConnectionError("Connection dropped"),
+                                        ok_response]
+        metrics = MetricsRegistry()
+        fast_retries = {"default": RetryPolicy(max_attempts=2,
+                                               base_delay_in_secs=0)}
+        request_maker = RequestMaker(http_session=http_session,
+                                     retry_policies=fast_retries,
+                                     metrics=metrics)
+        payload = {"service": {"provision": "Inventario",
+                               "operacion": "listar_itemsinventario"}}
+        request_maker.get_content(payload)
+        operation = "listar_itemsinventario"
+        labels = {"provision": "Inventario", "operation": operation}
+        self.assertEqual(request_maker.requests_counter
+                         .get_value(status=200, **labels), 1)
+        self.assertEqual(request_maker.requests_counter
+                         .get_value(status="error", **labels), 1)
+        self.assertEqual(request_maker.latency_histogram
+                         .get_count(**labels), 2)
+        self.assertEqual(request_maker.response_size_histogram
+                         .get_count(operation=operation), 1)
+        self.assertEqual(request_maker.retries_counter
+                         .get_value(operation=operation,
+                                    error="ConnectionError"), 1)
+        self.assertEqual(request_maker.errors_counter
+                         .get_value(operation=operation,
+                                    error="ConnectionError"), 1)
+        self.assertIn('colppy_requests_total{provision="Inventario",'
+                      'operation="listar_itemsinventario",status="200"} 1.0',
+                      metrics.render())
+
+    def test_open_circuit_fails_fast(self):
+        http_session = Mock()
+        http_session.get.side_effect = ConnectionError("Colppy down")
+        circuit_breaker = CircuitBreaker(failure_threshold=2)
+        request_maker = self.get_fast_retrying_request_maker(http_session,
+                                                             circuit_breaker)
+        with self.assertRaises(CircuitOpenError):
+            request_maker.get_content({"check": "check"})
+        with self.assertRaises(CircuitOpenError):
+            request_maker.get_content({"check": "check"})
+        self.assertEqual(http_session.get.call_count, 2)
+
+    def test_answered_probe_closes_half_open_circuit(self):
+        http_session = Mock()
+        http_session.get.side_effect = [
+            mock_status_response(503),
+            mock_status_response(503),
+            mock_response({"response": {"success": False}}),
+            mock_response({"response": {"success": True, "data": []}})
+            ]
+        circuit_breaker = CircuitBreaker(failure_threshold=2,
+                                         reset_timeout_in_secs=0)
+        request_maker = self.get_fast_retrying_request_maker(http_session,
+                                                             circuit_breaker)
+        with self.assertRaises(UnsuccessfulResponseError):
+            request_maker.get_content({"check": "check"})
+        self.assertEqual(circuit_breaker.state, circuit_breaker.closed)
+        content = request_maker.get_content({"check": "check"})
+        self.assertEqual(content, {"success": True, "data": []})
+
+    def test_retries_streamed_records_until_first_record(self):
+        records = [{"idItem": 1}, {"idItem": 2}]
+        http_session = Mock()
+        http_session.get.side_effect = [
+            mock_status_response(503),
+            mock_response({"response": {"success": False,
+                                        "data": records}}),
+            mock_response({"response": {"success": True, "data": records,
+                                        "total": 2}})
+            ]
+        request_maker = self.get_fast_retrying_request_maker(http_session)
+        streamed_records, content = request_maker \
+            .get_streaming_records({"check": "check"}, "data")
+        self.assertEqual(list(streamed_records), records)
+        self.assertEqual(content, {"success": True, "data": [], "total": 2})
+        self.assertEqual(http_session.get.call_count, 3)
+
 
 class PayloadBuilderTest(unittest.TestCase):
     key = "XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
@@ -306,9 +641,76 @@ class PayloadBuilderTest(unittest.TestCase):
                                                            self.key)
         self.assertEqual(pl_1, pl_2)
 
+    def test_built_payloads_are_independent(self):
+        pb = PayloadBuilder()
+        pl_1 = pb.get_list_deposits_stock_for_item_payload("100000",
+                                                           self.company_id,
+                                                           self.key)
+        pl_2 = pb.get_list_deposits_stock_for_item_payload("200000",
+                                                           "11111",
+                                                           "YYYYYYYYYY")
+        self.assertEqual(pl_1["parameters"]["idItem"], "100000")
+        self.assertEqual(pl_1["parameters"]["idEmpresa"], self.company_id)
+        self.assertEqual(pl_1["parameters"]["sesion"]["claveSesion"],
+                         self.key)
+        self.assertEqual(pl_2["parameters"]["idItem"], "200000")
+
+    def test_building_does_not_change_templates(self):
+        pb = PayloadBuilder()
+        template = pb.compiled_payloads["list_invoices"].template
+        template_before = json.dumps(template, sort_keys=True)
+        pb.get_list_invoices_payload(self.dates, self.company_id, self.key)
+        self.assertEqual(json.dumps(template, sort_keys=True),
+                         template_before)
+
+    def test_concurrent_builds_keep_their_company(self):
+        pb = PayloadBuilder()
+        company_ids = [str(company_id) for company_id in range(1000, 1200)]
+
+        def build_for(company_id):
+            payload = pb.get_list_inventory_payload(company_id, self.key)
+            return company_id, payload["parameters"]["idEmpresa"]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for company_id, payload_company_id in executor.map(build_for,
+                                                               company_ids):
+                self.assertEqual(company_id, payload_company_id)
+
+    def test_compiled_payload_raises_on_missing_slot(self):
+        template = {"parameters": {"filter": []}}
+        with self.assertRaises(KeyError):
+            CompiledPayload("wrong", template,
+                            {"start_date": ("parameters", "filter", 0,
+                                            "value")})
+
+
+class DatesSharderTest(unittest.TestCase):
+    def test_shards_by_month(self):
+        shards = DatesSharder(("2019-12-31", "2019-10-15")) \
+            .get_shards("month")
+        self.assertEqual(shards, [("2019-10-15", "2019-10-31"),
+                                  ("2019-11-01", "2019-11-30"),
+                                  ("2019-12-01", "2019-12-31")])
+
+    def test_shards_by_week(self):
+        shards = DatesSharder(("2020-05-06", "2020-05-12")) \
+            .get_shards("week")
+        self.assertEqual(shards, [("2020-05-06", "2020-05-10"),
+                                  ("2020-05-11", "2020-05-12")])
+
+    def test_shards_by_days(self):
+        shards = DatesSharder(("2020-02-27", "2020-03-02")).get_shards(2)
+        self.assertEqual(shards, [("2020-02-27", "2020-02-28"),
+                                  ("2020-02-29", "2020-03-01"),
+                                  ("2020-03-02", "2020-03-02")])
+
+    def test_wrong_shard_raises_error(self):
+        with self.assertRaises(ValueError):
+            DatesSharder(("2020-01-01", "2020-02-01")).get_shards("day")
+
 
 class CallerTest(unittest.TestCase):
-    @patch("colppy_api.requests.post")
+    @patch("colppy_api.requests.Session.post")
     def test_get_session_key_re_logs_after_duration(self, mock_post):
         with open("test/data/login_response.json") as f:
             json_data = json.load(f)
@@ -327,7 +729,7 @@ class CallerTest(unittest.TestCase):
 
         self.assertEqual(mock_post.call_count, 2)
 
-    @patch("colppy_api.requests.post")
+    @patch("colppy_api.requests.Session.post")
     def test_get_session_key_not_re_logs_before_duration(self, mock_post):
         with open("test/data/login_response.json") as f:
             json_data = json.load(f)
@@ -346,8 +748,71 @@ class CallerTest(unittest.TestCase):
 
         self.assertEqual(mock_post.call_count, 1)
 
-    @patch("colppy_api.requests.post")
-    @patch("colppy_api.requests.get")
+    @patch("colppy_api.requests.Session.post")
+    def test_stored_session_key_reused_by_new_caller(self, mock_post):
+        with open("test/data/login_response.json") as f:
+            json_data = json.load(f)
+        mock_post.return_value = mock_response(json_data)
+
+        with tempfile.TemporaryDirectory() as folder:
+            store = SessionKeyStore(os.path.join(folder, "sessions.json"))
+            first_key = Caller(session_store=store).get_session_key()
+            second_key = Caller(session_store=store).get_session_key()
+
+        self.assertEqual(first_key, second_key)
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch("colppy_api.requests.Session.post")
+    def test_stored_session_key_near_expiry_not_reused(self, mock_post):
+        with open("test/data/login_response.json") as f:
+            json_data = json.load(f)
+        mock_post.return_value = mock_response(json_data)
+
+        with tempfile.TemporaryDirectory() as folder:
+            store = SessionKeyStore(os.path.join(folder, "sessions.json"))
+            caller = Caller(session_store=store)
+            old_login_time = (datetime.datetime.now()
+                              - datetime.timedelta(minutes=22))
+            store.save_session_for(caller.get_session_account(), "old",
+                                   old_login_time)
+            session_key = caller.get_session_key()
+
+        self.assertNotEqual(session_key, "old")
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch("colppy_api.requests.Session.post")
+    def test_refresh_logs_in_before_session_expires(self, mock_post):
+        with open("test/data/login_response.json") as f:
+            json_data = json.load(f)
+        mock_post.return_value = mock_response(json_data)
+
+        caller = Caller()
+        caller.get_session_key()
+        caller.refresh_session_key()
+        self.assertEqual(mock_post.call_count, 1)
+
+        caller.login_time -= datetime.timedelta(minutes=21)
+        self.assertEqual(caller.get_secs_until_refresh(), 0)
+        caller.refresh_session_key()
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch("colppy_api.requests.Session.post")
+    def test_background_refresher_starts_after_first_login(self, mock_post):
+        with open("test/data/login_response.json") as f:
+            json_data = json.load(f)
+        mock_post.return_value = mock_response(json_data)
+
+        caller = Caller(refresh_session_in_background=True)
+        self.assertIsNone(caller.session_refresher)
+        caller.get_session_key()
+        self.assertTrue(caller.session_refresher.is_alive())
+        refresher = caller.session_refresher
+        caller.close()
+        self.assertFalse(refresher.is_alive())
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
     def test_list_companies(self, mock_get, mock_post):
         with open("test/data/login_response.json") as f:
             login_data = json.load(f)
@@ -363,8 +828,8 @@ class CallerTest(unittest.TestCase):
         self.assertEqual(caller.get_companies(),
                          companies_data["response"]["data"])
 
-    @patch("colppy_api.requests.post")
-    @patch("colppy_api.requests.get")
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
     def test_list_invoices(self, mock_get, mock_post):
         with open("test/data/login_response.json") as f:
             login_data = json.load(f)
@@ -381,8 +846,8 @@ class CallerTest(unittest.TestCase):
         self.assertEqual(caller.get_invoices_for(dates),
                          invoices_data["response"]["data"])
 
-    @patch("colppy_api.requests.post")
-    @patch("colppy_api.requests.get")
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
     def test_list_inventory(self, mock_get, mock_post):
         with open("test/data/login_response.json") as f:
             login_data = json.load(f)
@@ -398,8 +863,8 @@ class CallerTest(unittest.TestCase):
         self.assertEqual(caller.get_inventory_for(),
                          inventory_data["response"]["data"])
 
-    @patch("colppy_api.requests.post")
-    @patch("colppy_api.requests.get")
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
     def test_list_deposits(self, mock_get, mock_post):
         with open("test/data/login_response.json") as f:
             login_data = json.load(f)
@@ -415,6 +880,310 @@ class CallerTest(unittest.TestCase):
         self.assertEqual(caller.get_deposits_stock_for("100000"),
                          deposits_data["response"]["data"])
 
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_calls_share_one_http_session(self, mock_get, mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_deposits_response.json") as f:
+            deposits_data = json.load(f)
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.return_value = mock_response(deposits_data)
+
+        caller = Caller()
+        http_session = caller.http_session
+        caller.get_deposits_stock_for("100000")
+        caller.get_deposits_stock_for("100001")
+
+        self.assertIs(caller.requester.http_session, http_session)
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_list_deposits_for_many(self, mock_get, mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_deposits_response.json") as f:
+            deposits_data = json.load(f)
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.return_value = mock_response(deposits_data)
+        item_ids = ["100000", 100001, "10000A", "100002"]
+
+        caller = Caller()
+        results = dict(caller.get_deposits_stock_for_many(item_ids,
+                                                          max_in_flight=2))
+
+        self.assertEqual(set(results.keys()), set(item_ids))
+        self.assertIsInstance(results["10000A"], ValueError)
+        for item_id in ("100000", 100001, "100002"):
+            self.assertEqual(results[item_id],
+                             deposits_data["response"]["data"])
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(mock_get.call_count, 3)
+        sent_item_ids = {call[1]["json"]["parameters"]["idItem"]
+                         for call in mock_get.call_args_list}
+        self.assertEqual(sent_item_ids, {"100000", "100001", "100002"})
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_list_inventory_walks_all_pages(self, mock_get, mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        records = [{"idItem": item_id} for item_id in range(25)]
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.side_effect = mock_paginated_get(records, with_total=False)
+
+        caller = Caller()
+        self.assertEqual(caller.get_inventory_for(page_size=10), records)
+        self.assertEqual(mock_get.call_count, 3)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_list_inventory_reads_short_pages_up_to_total(self, mock_get,
+                                                          mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        records = [{"idItem": item_id} for item_id in range(25)]
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.side_effect = mock_paginated_get(records, max_page_size=4)
+
+        caller = Caller()
+        self.assertEqual(caller.get_inventory_for(page_size=10), records)
+        self.assertEqual(list(caller.get_inventory_for(page_size=10,
+                                                       stream=True)),
+                         records)
+        self.assertEqual(caller.get_inventory_for(page_size=4,
+                                                  prefetch_pages=3),
+                         records)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_prefetched_short_pages_are_completed(self, mock_get,
+                                                  mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        records = [{"idAsiento": str(number)} for number in range(95)]
+        get_page = mock_paginated_get(records, "movimientos")
+
+        def get_short_second_page(url, json=None, **kwargs):
+            if json["parameters"]["start"] == 10:
+                json["parameters"]["limit"] = 3
+            return get_page(url, json=json, **kwargs)
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.side_effect = get_short_second_page
+
+        dates = ("2019-01-01", "2019-12-31")
+        caller = Caller()
+        diary = caller.get_diary_for(dates, page_size=10, prefetch_pages=3)
+        self.assertEqual(diary, records)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_list_inventory_as_typed_records(self, mock_get, mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_data = json.load(f)
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.return_value = mock_response(inventory_data)
+
+        caller = Caller()
+        items = caller.get_inventory_for(record_format="typed")
+        self.assertIsInstance(items[0], InventoryItem)
+        columns = caller.get_inventory_for(record_format="columns")
+        self.assertIsInstance(columns, RecordColumns)
+        self.assertEqual(list(columns), items)
+        with self.assertRaises(ValueError):
+            caller.get_inventory_for(record_format="rows")
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_list_diary_prefetches_pages(self, mock_get, mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        records = [{"idAsiento": str(number)} for number in range(95)]
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.side_effect = mock_paginated_get(records, "movimientos")
+
+        dates = ("2019-01-01", "2019-12-31")
+        caller = Caller()
+        diary = caller.get_diary_for(dates, page_size=10, prefetch_pages=3)
+        self.assertEqual(diary, records)
+        self.assertEqual(mock_get.call_count, 10)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_stream_invoices_is_lazy(self, mock_get, mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        records = [{"idFactura": str(number)} for number in range(30)]
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.side_effect = mock_paginated_get(records)
+
+        dates = ("2019-01-01", "2019-12-31")
+        caller = Caller()
+        invoices = caller.get_invoices_for(dates, stream=True, page_size=10)
+        self.assertEqual(next(invoices), records[0])
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(list(invoices), records[1:])
+        self.assertEqual(mock_get.call_count, 3)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_invoices_for_companies_isolate_errors(self, mock_get,
+                                                   mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+
+        def get_company_invoices(url, json=None, **kwargs):
+            company_id = json["parameters"]["idEmpresa"]
+            if company_id == "20000":
+                return mock_response({"response": {"success": False}})
+            content = {"success": True,
+                       "data": [{"idFactura": "1", "company": company_id}]}
+            return mock_response({"response": content})
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.side_effect = get_company_invoices
+
+        dates = ("2019-01-01", "2019-03-31")
+        no_retries = {"default": RetryPolicy(max_attempts=1)}
+        caller = Caller(retry_policies=no_retries)
+        caller.available_companies = {"Example LLC": "19459",
+                                      "Other LLC": "20000",
+                                      "Third LLC": "30000"}
+        invoices_per_company = dict(caller.get_invoices_for_companies(dates))
+        self.assertEqual(set(invoices_per_company), {"19459", "20000",
+                                                     "30000"})
+        self.assertEqual(invoices_per_company["30000"][0]["company"],
+                         "30000")
+        self.assertIsInstance(invoices_per_company["20000"], ValueError)
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_for_companies_rejects_fixed_arguments(self, mock_get,
+                                                   mock_post):
+        caller = Caller()
+        dates = ("2019-01-01", "2019-03-31")
+        with self.assertRaises(ValueError):
+            caller.get_invoices_for_companies(dates, stream=True)
+        with self.assertRaises(ValueError):
+            caller.get_inventory_for_companies(["19459"],
+                                               company_id="20000")
+        mock_get.assert_not_called()
+        mock_post.assert_not_called()
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_sharded_invoices_are_merged_in_order(self, mock_get, mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        invoices_per_month = {
+            "2019-01-01": [{"idFactura": "1"}, {"idFactura": "2"}],
+            "2019-02-01": [{"idFactura": "2"}, {"idFactura": "3"}],
+            "2019-03-01": [{"idFactura": "4"}]
+            }
+
+        def get_month(url, json=None, **kwargs):
+            start_date = json["parameters"]["filter"][0]["value"]
+            content = {"success": True,
+                       "data": invoices_per_month[start_date]}
+            return mock_response({"response": content})
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.side_effect = get_month
+
+        dates = ("2019-01-01", "2019-03-31")
+        caller = Caller()
+        invoices = caller.get_invoices_for(dates, shard_by="month")
+        self.assertEqual([invoice["idFactura"] for invoice in invoices],
+                         ["1", "2", "3", "4"])
+        self.assertEqual(mock_get.call_count, 3)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_cached_inventory_is_not_requested_again(self, mock_get,
+                                                     mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_data = json.load(f)
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.return_value = mock_response(inventory_data)
+
+        with tempfile.TemporaryDirectory() as folder:
+            cache = ResponseCache(os.path.join(folder, "cache.sqlite3"))
+            Caller(cache=cache).get_inventory_for()
+            inventory = Caller(cache=cache).get_inventory_for()
+            Caller(cache=cache, bypass_cache=True).get_inventory_for()
+            cache.close()
+
+        self.assertEqual(inventory, inventory_data["response"]["data"])
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_streamed_inventory_uses_cache(self, mock_get, mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_data = json.load(f)
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.return_value = mock_response(inventory_data)
+
+        with tempfile.TemporaryDirectory() as folder:
+            cache = ResponseCache(os.path.join(folder, "cache.sqlite3"))
+            list(Caller(cache=cache).get_inventory_for(stream=True))
+            inventory = list(Caller(cache=cache)
+                             .get_inventory_for(stream=True))
+            cache.close()
+
+        self.assertEqual(inventory, inventory_data["response"]["data"])
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch("colppy_api.requests.Session.post")
+    @patch("colppy_api.requests.Session.get")
+    def test_base_urls_do_not_share_cached_inventory(self, mock_get,
+                                                      mock_post):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_data = json.load(f)
+
+        mock_post.return_value = mock_response(login_data)
+        mock_get.return_value = mock_response(inventory_data)
+
+        with tempfile.TemporaryDirectory() as folder:
+            cache = ResponseCache(os.path.join(folder, "cache.sqlite3"))
+            Caller(cache=cache, base_url="http://127.0.0.1:8001/") \
+                .get_inventory_for()
+            Caller(cache=cache, base_url="http://127.0.0.1:8002/") \
+                .get_inventory_for()
+            Caller(cache=cache, base_url="http://127.0.0.1:8001/") \
+                .get_inventory_for()
+            cache.close()
+
+        called_urls = [call.args[0] for call in mock_get.call_args_list]
+        self.assertEqual(called_urls, ["http://127.0.0.1:8001/",
+                                       "http://127.0.0.1:8002/"])
+
+    @patch("colppy_api.requests.Session.close")
+    def test_context_manager_closes_http_session(self, mock_close):
+        with Caller() as caller:
+            self.assertIsInstance(caller, Caller)
+        mock_close.assert_called_once()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import array
+import datetime
+import json
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from colppy_records import Invoice, InventoryItem, DepositStock, \
+    RecordColumns
+
+
+# TESTS
+#########################################################################
+
+
+class ColppyRecordTest(unittest.TestCase):
+    def setUp(self):
+        with open("test/data/list_invoices_response.json") as f:
+            self.invoice_data = json.load(f)["response"]["data"][0]
+
+    def test_invoice_fields_are_converted(self):
+        invoice = Invoice.from_dict(self.invoice_data)
+        self.assertEqual(invoice.idFactura, 7407906)
+        self.assertEqual(invoice.totalFactura, 1880.0)
+        self.assertEqual(invoice.fechaFactura, datetime.date(2019, 11, 1))
+        self.assertEqual(invoice.record_update_ts,
+                         datetime.datetime(2019, 11, 5, 15, 34, 19))
+        self.assertIsNone(invoice.idOrden)
+
+    def test_unknown_keys_are_kept_as_extra(self):
+        invoice = Invoice.from_dict(self.invoice_data)
+        self.assertEqual(invoice.extra["isMobile"], "0")
+        self.assertEqual(set(invoice.to_dict()), set(self.invoice_data))
+
+    def test_wrong_values_are_kept_as_extra(self):
+        deposit = DepositStock.from_dict({"nombre": "Local",
+                                          "disponibilidad": "n/a"})
+        self.assertIsNone(deposit.disponibilidad)
+        self.assertEqual(deposit.extra, {"disponibilidad": "n/a"})
+
+    def test_records_have_no_dict(self):
+        deposit = DepositStock.from_dict({"nombre": "Local",
+                                          "disponibilidad": "1.00000"})
+        self.assertFalse(hasattr(deposit, "__dict__"))
+        self.assertEqual(deposit.disponibilidad, 1.0)
+
+
+class RecordColumnsTest(unittest.TestCase):
+    def setUp(self):
+        with open("test/data/list_inventory_response.json") as f:
+            self.items_data = json.load(f)["response"]["data"]
+
+    def test_columns_are_typed_arrays(self):
+        columns = RecordColumns(InventoryItem, self.items_data)
+        self.assertEqual(len(columns), len(self.items_data))
+        self.assertIsInstance(columns.column("idItem"), array.array)
+        self.assertEqual(list(columns.column("disponibilidad")),
+                         [float(item["disponibilidad"])
+                          for item in self.items_data])
+
+    def test_records_round_trip(self):
+        columns = RecordColumns(InventoryItem, self.items_data)
+        records = [InventoryItem.from_dict(item)
+                   for item in self.items_data]
+        self.assertEqual(list(columns), records)
+        self.assertEqual(columns[-1], records[-1])
+
+    def test_missing_values_read_back_as_none(self):
+        columns = RecordColumns(InventoryItem, self.items_data)
+        self.assertEqual(columns.values("fechaBaja"),
+                         [None] * len(self.items_data))
+
+    def test_index_out_of_range_raises_error(self):
+        columns = RecordColumns(DepositStock)
+        with self.assertRaises(IndexError):
+            columns[0]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import threading
+import time
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from concurrent_fetcher import ConcurrentFetcher
+
+
+# MOCKED CLASSES AND FUNCTIONS
+#########################################################################
+
+
+class InFlightCounter():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_seen = 0
+
+    def slow_double(self, item):
+        with self.lock:
+            self.in_flight += 1
+            self.max_seen = max(self.max_seen, self.in_flight)
+        time.sleep(0.01 * (item % 3))
+        with self.lock:
+            self.in_flight -= 1
+        return item * 2
+
+
+def fail_on_odd(item):
+    if item % 2:
+        raise ValueError("Odd item")
+    return item
+
+
+# TESTS
+#########################################################################
+
+
+class ConcurrentFetcherTest(unittest.TestCase):
+    def test_raises_on_wrong_max_in_flight(self):
+        for max_in_flight in (0, -1, "4", 2.5):
+            with self.assertRaises(ValueError):
+                ConcurrentFetcher(max_in_flight)
+
+    def test_fetch_in_order_keeps_items_order(self):
+        items = list(range(20))
+        fetcher = ConcurrentFetcher(4)
+        results = list(fetcher.fetch_in_order(InFlightCounter().slow_double,
+                                              items))
+        self.assertEqual(results, [(item, item * 2) for item in items])
+
+    def test_fetch_in_order_respects_max_in_flight(self):
+        counter = InFlightCounter()
+        fetcher = ConcurrentFetcher(3)
+        list(fetcher.fetch_in_order(counter.slow_double, range(30)))
+        self.assertLessEqual(counter.max_seen, 3)
+        self.assertGreater(counter.max_seen, 1)
+
+    def test_fetch_in_order_returns_errors_as_results(self):
+        fetcher = ConcurrentFetcher(2)
+        results = dict(fetcher.fetch_in_order(fail_on_odd, range(4)))
+        self.assertEqual(results[0], 0)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], 2)
+        self.assertIsInstance(results[3], ValueError)
+
+    def test_fetch_as_completed_gets_every_item(self):
+        counter = InFlightCounter()
+        fetcher = ConcurrentFetcher(3)
+        results = dict(fetcher.fetch_as_completed(counter.slow_double,
+                                                  range(30)))
+        self.assertEqual(results, {item: item * 2 for item in range(30)})
+        self.assertLessEqual(counter.max_seen, 3)
+
+    def test_fetch_as_completed_returns_errors_as_results(self):
+        fetcher = ConcurrentFetcher(2)
+        results = dict(fetcher.fetch_as_completed(fail_on_odd, range(4)))
+        self.assertEqual(results[2], 2)
+        self.assertIsInstance(results[3], ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from deposit_snapshot import DepositSnapshotStore
+
+
+# TESTS
+#########################################################################
+
+
+class DepositSnapshotStoreTest(unittest.TestCase):
+    company_id = "19459"
+    deposits = [{"nombre": "Local", "disponibilidad": "1.00000"},
+                {"nombre": "Ecommerce ", "disponibilidad": "0.00000"}]
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "snapshot.sqlite3")
+        self.store = DepositSnapshotStore(self.path)
+        self.store.save_deposits_for(self.company_id, [
+            ("1", ("2020-01-13 12:24:33", "7.0"), self.deposits),
+            ("2", ("2020-01-13 12:24:33", "0.0"), self.deposits)])
+
+    def tearDown(self):
+        self.store.close()
+        self.folder.cleanup()
+
+    def test_returns_deposits_of_unchanged_items(self):
+        item_versions = {"1": ("2020-01-13 12:24:33", "7.0"),
+                         "2": ("2020-01-13 12:24:33", "0.0"),
+                         "3": ("2020-01-13 12:24:33", "1.0")}
+        unchanged_deposits = self.store \
+            .get_unchanged_deposits_for(self.company_id, item_versions)
+        self.assertEqual(unchanged_deposits, {"1": self.deposits,
+                                              "2": self.deposits})
+
+    def test_skips_items_with_new_timestamp_or_total_stock(self):
+        item_versions = {"1": ("2020-02-01 10:00:00", "7.0"),
+                         "2": ("2020-01-13 12:24:33", "3.0")}
+        unchanged_deposits = self.store \
+            .get_unchanged_deposits_for(self.company_id, item_versions)
+        self.assertEqual(unchanged_deposits, {})
+
+    def test_keeps_snapshots_per_company(self):
+        item_versions = {"1": ("2020-01-13 12:24:33", "7.0")}
+        unchanged_deposits = self.store \
+            .get_unchanged_deposits_for("11111", item_versions)
+        self.assertEqual(unchanged_deposits, {})
+
+    @patch("deposit_snapshot.time.time")
+    def test_old_snapshots_are_not_trusted(self, mock_time):
+        mock_time.return_value = 10 ** 12
+        item_versions = {"1": ("2020-01-13 12:24:33", "7.0")}
+        unchanged_deposits = self.store \
+            .get_unchanged_deposits_for(self.company_id, item_versions)
+        self.assertEqual(unchanged_deposits, {})
+
+    def test_saved_deposits_replace_previous_ones(self):
+        new_deposits = [{"nombre": "Local", "disponibilidad": "2.00000"}]
+        self.store.save_deposits_for(self.company_id, [
+            ("1", ("2020-02-01 10:00:00", "8.0"), new_deposits)])
+        item_versions = {"1": ("2020-02-01 10:00:00", "8.0")}
+        unchanged_deposits = self.store \
+            .get_unchanged_deposits_for(self.company_id, item_versions)
+        self.assertEqual(unchanged_deposits, {"1": new_deposits})
+        self.assertEqual(self.store.count_deposits_for(self.company_id), 2)
+
+    def test_clear_by_company(self):
+        self.store.save_deposits_for("11111", [
+            ("1", ("2020-01-13 12:24:33", "7.0"), self.deposits)])
+        self.store.clear(self.company_id)
+        self.assertEqual(self.store.count_deposits_for(self.company_id), 0)
+        self.assertEqual(self.store.count_deposits_for("11111"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
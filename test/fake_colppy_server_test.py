@@ -0,0 +1,137 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from fake_colppy_server import FakeColppyDataset, FakeColppyServer
+from colppy_api import Caller
+from rate_limiter import RequestThrottle
+from retry_policy import RetryPolicy
+from inventory_updater import DepositInventoryUpdater
+from benchmark import InMemoryGoogleSpread
+
+
+# MOCKED CLASSES AND FUNCTIONS
+#########################################################################
+
+
+def caller_for(server, **settings):
+    return Caller(base_url=server.url,
+                  throttle=RequestThrottle(rate_per_sec=None,
+                                           initial_concurrency=8),
+                  **settings)
+
+
+# TESTS
+#########################################################################
+
+
+class FakeColppyServerTest(unittest.TestCase):
+    def setUp(self):
+        self.dataset = FakeColppyDataset(total_items=25, invoices_per_day=3)
+        self.server = FakeColppyServer(self.dataset)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_caller_lists_inventory_pages(self):
+        with caller_for(self.server) as caller:
+            items = caller.get_inventory_for(page_size=10)
+        self.assertEqual(len(items), 25)
+        self.assertEqual(len({item["idItem"] for item in items}), 25)
+        counts = self.server.get_request_counts()
+        self.assertEqual(counts["iniciar_sesion"], 1)
+        self.assertEqual(counts["listar_itemsinventario"], 3)
+
+    def test_caller_gets_deposits_for_many_items(self):
+        with caller_for(self.server) as caller:
+            items = caller.get_inventory_for()
+            item_ids = [item["idItem"] for item in items]
+            deposits = dict(caller.get_deposits_stock_for_many(item_ids))
+        self.assertEqual(set(deposits), set(item_ids))
+        for item_deposits in deposits.values():
+            self.assertEqual([deposit["nombre"] for deposit in item_deposits],
+                             list(self.dataset.deposit_names))
+
+    def test_invoices_follow_dates_range(self):
+        with caller_for(self.server) as caller:
+            invoices = caller.get_invoices_for(("2020-01-01", "2020-01-10"),
+                                               stream=True)
+            invoices = list(invoices)
+        self.assertEqual(len(invoices), 30)
+        self.assertEqual(invoices[-1]["fechaFactura"], "2020-01-10")
+
+    @patch("inventory_updater.DepositInventoryUpdater.end_program")
+    @patch("inventory_updater.GoogleSpread")
+    def test_updater_pastes_deposits_from_server(self, mock_gspread,
+                                                 mock_end):
+        spread = InMemoryGoogleSpread()
+        mock_gspread.return_value = spread
+        updater = DepositInventoryUpdater(max_in_flight=4,
+                                          base_url=self.server.url)
+        updater.paste_deposit_inventory_to_gsheet("Local", "fake_spread",
+                                                  batch_size=10)
+        deposit_index = self.dataset.deposit_names.index("Local")
+        expected_stock = ["%.5f" % self.dataset.get_stock_for(item_id)
+                          [deposit_index] for item_id in updater.df.index]
+        self.assertEqual(len(updater.df.index), 25)
+        self.assertEqual(updater.df["Disponible"].tolist(), expected_stock)
+        self.assertIn(updater.final_worksheet_name, spread.sheets)
+        self.assertEqual(self.server.get_request_counts()
+                         ["listar_dispDeposito"], 25 + 1)
+
+    def test_data_is_deterministic(self):
+        other_dataset = FakeColppyDataset(total_items=25)
+        self.assertEqual(self.dataset.get_items("19459", 0, 5),
+                         other_dataset.get_items("19459", 0, 5))
+
+    def test_unknown_session_is_rejected(self):
+        payload = {"service": {"operacion": "listar_empresa"},
+                   "parameters": {"sesion": {"claveSesion": "wrong"}}}
+        self.assertFalse(self.server.service.answer(payload)["success"])
+
+
+class FakeColppyServerFaultsTest(unittest.TestCase):
+    def test_injected_errors_are_retried(self):
+        dataset = FakeColppyDataset(total_items=5)
+        fast_retries = {"default": RetryPolicy(max_attempts=10,
+                                               base_delay_in_secs=0)}
+        with FakeColppyServer(dataset, error_rate=0.3, seed=1) as server:
+            with caller_for(server, retry_policies=fast_retries) as caller:
+                items = caller.get_inventory_for()
+                deposits = dict(caller.get_deposits_stock_for_many(
+                    [item["idItem"] for item in items]))
+        self.assertEqual(len(items), 5)
+        for item_deposits in deposits.values():
+            self.assertIsInstance(item_deposits, list)
+
+    def test_short_pages_are_read_up_to_total(self):
+        dataset = FakeColppyDataset(total_items=25)
+        with FakeColppyServer(dataset, max_page_size=4) as server:
+            with caller_for(server) as caller:
+                items = caller.get_inventory_for(page_size=10)
+            self.assertEqual(server.get_request_counts()
+                             ["listar_itemsinventario"], 7)
+        self.assertEqual([item["idItem"] for item in items],
+                         [dataset.first_item_id + index
+                          for index in range(25)])
+
+    def test_rate_limit_answers_too_many_requests(self):
+        dataset = FakeColppyDataset(total_items=5)
+        no_retries = {"default": RetryPolicy(max_attempts=1)}
+        with FakeColppyServer(dataset, rate_limit_per_sec=1) as server:
+            with caller_for(server, retry_policies=no_retries) as caller:
+                caller.get_session_key()
+                with self.assertRaises(ValueError):
+                    caller.get_inventory_for()
+            self.assertEqual(server.get_request_counts(),
+                             {"iniciar_sesion": 1,
+                              "listar_itemsinventario": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+from unittest.mock import Mock
+import datetime
+import os
+import sys
+import tempfile
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from incremental_sync import SyncStore, IncrementalSync
+
+
+# MOCKED CLASSES AND FUNCTIONS
+#########################################################################
+
+
+def mock_caller(invoices=None, diary=None):
+    caller = Mock()
+    caller.payload_builder.default_company_id = "19459"
+    caller.get_invoices_for.return_value = iter(invoices or [])
+    caller.get_diary_for.return_value = iter(diary or [])
+    return caller
+
+
+# TESTS
+#########################################################################
+
+
+class IncrementalSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "sync.sqlite3")
+        self.store = SyncStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.folder.cleanup()
+
+    def test_first_sync_fetches_whole_range(self):
+        invoices = [{"idFactura": "1", "totalFactura": "10.00"},
+                    {"idFactura": "2", "totalFactura": "20.00"}]
+        caller = mock_caller(invoices=invoices)
+        sync = IncrementalSync(caller, self.store)
+        total = sync.sync_invoices_for("2019-01-01", "2019-11-10")
+        self.assertEqual(total, 2)
+        caller.get_invoices_for.assert_called_once_with(
+            ("2019-01-01", "2019-11-10"), "19459", stream=True)
+        self.assertEqual(sync.get_invoices_for(), invoices)
+
+    def test_next_sync_fetches_from_checkpoint_with_overlap(self):
+        caller = mock_caller()
+        sync = IncrementalSync(caller, self.store, overlap_in_days=3)
+        sync.sync_invoices_for("2019-01-01", "2019-11-10")
+        caller.get_invoices_for.return_value = iter([])
+        sync.sync_invoices_for("2019-01-01", "2019-11-11")
+        caller.get_invoices_for.assert_called_with(
+            ("2019-11-07", "2019-11-11"), "19459", stream=True)
+
+    def test_edited_records_replace_stored_ones(self):
+        caller = mock_caller(invoices=[{"idFactura": "1",
+                                        "totalFactura": "10.00"}])
+        sync = IncrementalSync(caller, self.store)
+        sync.sync_invoices_for("2019-01-01", "2019-11-10")
+        caller.get_invoices_for.return_value = iter(
+            [{"idFactura": "1", "totalFactura": "15.00"},
+             {"idFactura": "3", "totalFactura": "30.00"}])
+        sync.sync_invoices_for("2019-01-01", "2019-11-11")
+        self.assertEqual(sync.get_invoices_for(),
+                         [{"idFactura": "1", "totalFactura": "15.00"},
+                          {"idFactura": "3", "totalFactura": "30.00"}])
+
+    def test_dates_before_first_sync_fetch_all_again(self):
+        caller = mock_caller()
+        sync = IncrementalSync(caller, self.store)
+        sync.sync_invoices_for("2019-06-01", "2019-11-10")
+        caller.get_invoices_for.return_value = iter([])
+        sync.sync_invoices_for("2019-01-01", "2019-11-10")
+        caller.get_invoices_for.assert_called_with(
+            ("2019-01-01", "2019-11-10"), "19459", stream=True)
+
+    def test_dates_after_last_sync_fetch_the_gap(self):
+        caller = mock_caller()
+        sync = IncrementalSync(caller, self.store, overlap_in_days=3)
+        sync.sync_invoices_for("2019-01-01", "2019-01-31")
+        caller.get_invoices_for.return_value = iter([])
+        sync.sync_invoices_for("2019-03-01", "2019-03-31")
+        caller.get_invoices_for.assert_called_with(
+            ("2019-01-28", "2019-03-31"), "19459", stream=True)
+        checkpoint = self.store.get_checkpoint_for(
+            "19459", IncrementalSync.invoices_operation)
+        self.assertEqual(checkpoint, (datetime.date(2019, 1, 1),
+                                      datetime.date(2019, 3, 31)))
+
+    def test_dates_apart_before_first_sync_start_new_checkpoint(self):
+        caller = mock_caller()
+        sync = IncrementalSync(caller, self.store, overlap_in_days=3)
+        sync.sync_invoices_for("2019-03-01", "2019-03-31")
+        caller.get_invoices_for.return_value = iter([])
+        sync.sync_invoices_for("2019-01-01", "2019-01-31")
+        caller.get_invoices_for.assert_called_with(
+            ("2019-01-01", "2019-01-31"), "19459", stream=True)
+        checkpoint = self.store.get_checkpoint_for(
+            "19459", IncrementalSync.invoices_operation)
+        self.assertEqual(checkpoint, (datetime.date(2019, 1, 1),
+                                      datetime.date(2019, 1, 31)))
+
+    def test_failed_sync_keeps_checkpoint(self):
+        def fail_midway(*args, **kwargs):
+            yield {"idFactura": "1"}
+            raise ValueError("Connection dropped")
+
+        caller = mock_caller()
+        caller.get_invoices_for.side_effect = fail_midway
+        sync = IncrementalSync(caller, self.store)
+        with self.assertRaises(ValueError):
+            sync.sync_invoices_for("2019-01-01", "2019-11-10")
+        self.assertIsNone(self.store.get_checkpoint_for(
+            "19459", IncrementalSync.invoices_operation))
+
+    def test_diary_records_without_id_use_content(self):
+        movements = [{"fecha": "2019-11-01", "importe": "1.00"},
+                     {"fecha": "2019-11-01", "importe": "1.00"},
+                     {"fecha": "2019-11-02", "importe": "2.00"}]
+        caller = mock_caller(diary=movements)
+        sync = IncrementalSync(caller, self.store)
+        sync.sync_diary_for("2019-11-01", "2019-11-10")
+        self.assertEqual(len(sync.get_diary_for()), 2)
+
+    def test_checkpoints_are_per_company(self):
+        caller = mock_caller()
+        sync = IncrementalSync(caller, self.store)
+        sync.sync_invoices_for("2019-01-01", "2019-11-10")
+        caller.get_invoices_for.return_value = iter([])
+        sync.sync_invoices_for("2019-01-01", "2019-11-10", "11111")
+        caller.get_invoices_for.assert_called_with(
+            ("2019-01-01", "2019-11-10"), "11111", stream=True)
+        self.assertEqual(self.store.get_checkpoint_for(
+                            "11111", IncrementalSync.invoices_operation),
+                         (datetime.date(2019, 1, 1),
+                          datetime.date(2019, 11, 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,8 @@
 import unittest
-from requests import HTTPError
+from requests import HTTPError, ConnectionError
 from unittest.mock import patch, Mock
 import json
+import tempfile
 import pandas as pd
 import os
 import sys
@@ -9,7 +10,13 @@ import inspect
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
-from inventory_updater import DepositInventoryUpdater
+from inventory_updater import DepositInventoryUpdater, \
+    MultiDepositInventoryUpdater
+from retry_policy import CircuitOpenError
+from deposit_snapshot import DepositSnapshotStore
+from update_journal import UpdateJournal
+from response_cache import ResponseCache
+from tracing import Tracer
 
 
 # MOCKED CLASSES AND FUNCTIONS
@@ -77,8 +84,8 @@ def mock_requests_response(json_data, raise_status=None):
 
 @patch("test.inventory_updater_test.DepositInventoryUpdater.end_program")
 @patch("inventory_updater.Caller.get_inventory_for")
-@patch("colppy_api.requests.post")
-@patch("colppy_api.requests.get")
+@patch("colppy_api.requests.Session.post")
+@patch("colppy_api.requests.Session.get")
 @patch("inventory_updater.GoogleSpread")
 class DepositInventoryUpdaterTest(unittest.TestCase):
     ps = [
@@ -189,3 +196,463 @@ class DepositInventoryUpdaterTest(unittest.TestCase):
 
         self.assertEqual(diu_prev.df.values.tolist(),
                          diu_new.df.values.tolist())
+
+    def test_inventory_df_has_typed_columns(self, mock_gspread, mock_get,
+                                            mock_post, mock_inv, mock_end):
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_response = json.load(f)
+            inventory_data = inventory_response["response"]["data"]
+        mock_inv.return_value = iter(inventory_data)
+
+        diu = DepositInventoryUpdater()
+        diu.setup_caller(None)
+        diu.set_inventory_df()
+        diu.caller.close()
+
+        self.assertEqual(list(diu.df.columns),
+                         list(diu.col_name_dict.keys())[1:])
+        self.assertEqual(diu.df.index.dtype, "int64")
+        self.assertEqual(diu.df["precioVenta"].dtype, "float64")
+        self.assertEqual(diu.df["tipoItem"].dtype, "category")
+        self.assertTrue(diu.df["nombre"].isnull().all())
+        self.assertEqual(diu.df.loc[10963030, "costoCalculado"], 539.4)
+
+    def test_failed_item_marked_as_error(self, mock_gspread, mock_get,
+                                         mock_post, mock_inv, mock_end):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_deposits_response.json") as f:
+            deposits_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_response = json.load(f)
+            inventory_data = inventory_response["response"]["data"]
+        failing_item_id = "10963035"
+
+        def get_deposits_or_fail(url, json=None, **kwargs):
+            if json["parameters"]["idItem"] == failing_item_id:
+                raise HTTPError("Connection dropped")
+            return mock_requests_response(deposits_data)
+
+        mock_post.return_value = mock_requests_response(login_data)
+        mock_get.side_effect = get_deposits_or_fail
+        mock_inv.return_value = inventory_data
+        mock_gspread.return_value = GoogleSpreadMock()
+
+        diu = DepositInventoryUpdater(max_in_flight=4)
+        diu.paste_deposit_inventory_to_gsheet(self.deposit_name,
+                                              self.spread_name)
+
+        for item_id, row in diu.df.iterrows():
+            if str(item_id) == failing_item_id:
+                self.assertEqual(row["Disponible"], "Error")
+            else:
+                self.assertEqual(row["Disponible"], "1.00000")
+
+    def test_merges_fetched_values_once_per_batch(self, mock_gspread,
+                                                  mock_get, mock_post,
+                                                  mock_inv, mock_end):
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_response = json.load(f)
+            inventory_data = inventory_response["response"]["data"]
+        mock_inv.return_value = iter(inventory_data)
+
+        diu = DepositInventoryUpdater()
+        diu.setup_caller(None)
+        diu.set_inventory_df()
+        diu.caller.close()
+        diu.deposit_name = self.deposit_name
+        diu.spread = GoogleSpreadMock()
+        diu.is_new_worksheet = True
+        diu.start_cell = (3, 1)
+        diu.total_rows = len(diu.df.index)
+        diu.last_row = diu.start_cell[0] + diu.total_rows
+        diu.pre_update_setup(batch_size=4)
+        item_ids = list(diu.df.index)
+        diu.set_pending_items_per_batch(item_ids)
+        other_deposit = {"nombre": "Otro", "disponibilidad": "9.00000"}
+        for position, item_id in reversed(list(enumerate(item_ids))):
+            deposits = [other_deposit]
+            if position != 1:
+                deposits.append({"nombre": self.deposit_name,
+                                 "disponibilidad": "%d.00000" % position})
+            diu.try_to_update_cells_for(item_id, deposits)
+            diu.mark_item_as_done(item_id)
+            diu.upload_completed_batches()
+
+        self.assertEqual(diu.next_batch_to_upload, 3)
+        self.assertEqual(diu.pending_values,
+                         {"nombre": {}, "disponibilidad": {}})
+        self.assertEqual(diu.df["disponibilidad"].tolist(),
+                         ["0.00000", "Error"]
+                         + ["%d.00000" % position
+                            for position in range(2, len(item_ids))])
+        self.assertEqual(diu.df.loc[item_ids[0], "nombre"],
+                         self.deposit_name)
+
+    def test_skips_deposit_calls_for_items_without_stock(self, mock_gspread,
+                                                         mock_get, mock_post,
+                                                         mock_inv, mock_end):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_deposits_response.json") as f:
+            deposits_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_response = json.load(f)
+            inventory_data = inventory_response["response"]["data"]
+        service_item_id = inventory_data[0]["idItem"]
+        inventory_data[0]["tipoItem"] = "S"
+        items_with_stock = [item["idItem"] for item in inventory_data[1:]
+                            if float(item["disponibilidad"]) != 0]
+
+        mock_post.return_value = mock_requests_response(login_data)
+        mock_get.return_value = mock_requests_response(deposits_data)
+        mock_inv.return_value = inventory_data
+        mock_gspread.return_value = GoogleSpreadMock()
+
+        diu = DepositInventoryUpdater(skip_items_without_stock=True)
+        diu.paste_deposit_inventory_to_gsheet(self.deposit_name,
+                                              self.spread_name)
+
+        self.assertEqual(mock_get.call_count, len(items_with_stock) + 1)
+        for item_id, row in diu.df.iterrows():
+            self.assertEqual(row["Nombre"], self.deposit_name)
+            if item_id in items_with_stock:
+                self.assertEqual(row["Disponible"], "1.00000")
+            else:
+                self.assertEqual(row["Disponible"], "0.00000")
+        self.assertEqual(diu.df.loc[service_item_id, "Disponible"],
+                         "0.00000")
+
+    def test_refetches_only_changed_items_from_snapshot(self, mock_gspread,
+                                                        mock_get, mock_post,
+                                                        mock_inv, mock_end):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_deposits_response.json") as f:
+            deposits_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_response = json.load(f)
+            inventory_data = inventory_response["response"]["data"]
+
+        mock_post.return_value = mock_requests_response(login_data)
+        mock_get.return_value = mock_requests_response(deposits_data)
+        mock_gspread.side_effect = lambda *args, **kwargs: GoogleSpreadMock()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            snapshot = DepositSnapshotStore(os.path.join(temp_dir,
+                                                         "snapshot.sqlite3"))
+            mock_inv.return_value = inventory_data
+            first_diu = DepositInventoryUpdater(deposit_snapshot=snapshot)
+            first_diu.paste_deposit_inventory_to_gsheet(self.deposit_name,
+                                                        self.spread_name)
+            first_run_calls = mock_get.call_count
+
+            inventory_data[1]["record_update_ts"] = "2020-02-01 10:00:00"
+            inventory_data[2]["disponibilidad"] = 4
+            mock_inv.return_value = inventory_data
+            second_diu = DepositInventoryUpdater(deposit_snapshot=snapshot)
+            second_diu.paste_deposit_inventory_to_gsheet(self.deposit_name,
+                                                         self.spread_name)
+            second_run_calls = mock_get.call_count - first_run_calls
+            snapshot.close()
+
+        self.assertEqual(first_run_calls, len(inventory_data) + 1)
+        self.assertEqual(second_run_calls, 3)
+        self.assertEqual(first_diu.df.values.tolist(),
+                         second_diu.df.values.tolist())
+
+    @patch("colppy_api.time.sleep")
+    def test_resumes_from_journal_without_reading_sheet(self, mock_sleep,
+                                                        mock_gspread,
+                                                        mock_get, mock_post,
+                                                        mock_inv, mock_end):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_deposits_response.json") as f:
+            deposits_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_response = json.load(f)
+            inventory_data = inventory_response["response"]["data"]
+        failing_item_id = str(inventory_data[2]["idItem"])
+        colppy_state = {"goes_down": True, "is_down": False}
+        fetched_item_ids = []
+
+        def get_deposits_until_colppy_is_down(url, json=None, **kwargs):
+            item_id = json["parameters"]["idItem"]
+            if colppy_state["goes_down"] and item_id == failing_item_id:
+                colppy_state["is_down"] = True
+            if colppy_state["is_down"]:
+                raise ConnectionError("Colppy down")
+            fetched_item_ids.append(item_id)
+            return mock_requests_response(deposits_data)
+
+        mock_post.return_value = mock_requests_response(login_data)
+        mock_get.side_effect = get_deposits_until_colppy_is_down
+        mock_inv.return_value = inventory_data
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            mock_gspread.return_value = GoogleSpreadMock()
+            crashed_diu = DepositInventoryUpdater(
+                max_in_flight=1, journal=UpdateJournal(temp_dir))
+            with self.assertRaises(CircuitOpenError):
+                crashed_diu.paste_deposit_inventory_to_gsheet(
+                    self.deposit_name, self.spread_name)
+            journaled_item_ids = fetched_item_ids[1:]
+
+            colppy_state.update(goes_down=False, is_down=False)
+            fetched_item_ids.clear()
+            mock_gspread.return_value = GoogleSpreadMock(
+                find_sheet=self.find_ps, sheet_to_df=self.ps)
+            resumed_diu = DepositInventoryUpdater(
+                max_in_flight=1, journal=UpdateJournal(temp_dir))
+            resumed_diu.paste_deposit_inventory_to_gsheet(self.deposit_name,
+                                                          self.spread_name)
+            journal_files = os.listdir(temp_dir)
+
+        self.assertGreater(len(journaled_item_ids), 0)
+        self.assertEqual(resumed_diu.spread.sheet_to_df_count, 0)
+        self.assertEqual(sorted(fetched_item_ids[1:]),
+                         sorted(str(item["idItem"]) for item in inventory_data
+                                if str(item["idItem"])
+                                not in journaled_item_ids))
+        self.assertEqual(resumed_diu.df["Disponible"].tolist(),
+                         ["1.00000"] * len(inventory_data))
+        self.assertEqual(journal_files, [])
+
+    @patch("inventory_updater.Tracer.get_shared")
+    def test_writes_trace_of_the_run(self, mock_get_tracer, mock_gspread,
+                                     mock_get, mock_post, mock_inv, mock_end):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_deposits_response.json") as f:
+            deposits_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_response = json.load(f)
+            inventory_data = inventory_response["response"]["data"]
+
+        mock_post.return_value = mock_requests_response(login_data)
+        mock_get.return_value = mock_requests_response(deposits_data)
+        mock_inv.return_value = inventory_data
+        mock_gspread.return_value = GoogleSpreadMock()
+        tracer = Tracer()
+        mock_get_tracer.return_value = tracer
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_path = os.path.join(temp_dir, "run.json")
+            diu = DepositInventoryUpdater(max_in_flight=4,
+                                          trace_path=trace_path)
+            diu.paste_deposit_inventory_to_gsheet(self.deposit_name,
+                                                  self.spread_name)
+            with open(trace_path) as f:
+                events = json.load(f)["traceEvents"]
+
+        spans = {span.span_id: span for span in tracer.get_spans()}
+        deposit_spans = [span for span in spans.values()
+                         if span.name == "colppy.get_deposits"]
+        self.assertEqual(len(deposit_spans), len(inventory_data) + 1)
+        for span in deposit_spans[1:]:
+            self.assertEqual(spans[span.parent_id].name,
+                             "updater.update_deposit_cells")
+        names = {event["name"] for event in events if event["ph"] == "X"}
+        for name in ("updater.run", "updater.build_df", "colppy.login",
+                     "colppy.request", "payload.build",
+                     "updater.upload_batch", "updater.update_cells"):
+            self.assertIn(name, names)
+
+    @patch("colppy_api.time.sleep")
+    def test_stops_when_colppy_is_down(self, mock_sleep, mock_gspread,
+                                       mock_get, mock_post, mock_inv,
+                                       mock_end):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_deposits_response.json") as f:
+            deposits_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_response = json.load(f)
+            inventory_data = inventory_response["response"]["data"]
+        first_item_id = str(inventory_data[0]["idItem"])
+
+        def get_deposits_for_first_item_only(url, json=None, **kwargs):
+            if json["parameters"]["idItem"] == first_item_id:
+                return mock_requests_response(deposits_data)
+            raise ConnectionError("Colppy down")
+
+        mock_post.return_value = mock_requests_response(login_data)
+        mock_get.side_effect = get_deposits_for_first_item_only
+        mock_inv.return_value = inventory_data
+        mock_gspread.return_value = GoogleSpreadMock()
+
+        diu = DepositInventoryUpdater(max_in_flight=1)
+        with self.assertRaises(CircuitOpenError):
+            diu.paste_deposit_inventory_to_gsheet(self.deposit_name,
+                                                  self.spread_name)
+        last_item_id = diu.df.index[-1]
+        for col in diu.cols_to_update:
+            self.assertNotEqual(diu.df.loc[last_item_id, col], "Error")
+
+
+@patch("test.inventory_updater_test.DepositInventoryUpdater.end_program")
+@patch("colppy_api.time.sleep")
+@patch("colppy_api.requests.Session.post")
+@patch("colppy_api.requests.Session.get")
+@patch("inventory_updater.GoogleSpread")
+class DepositInventoryUpdaterInventoryCallTest(unittest.TestCase):
+    deposit_name = "Local"
+    spread_name = "mock_name"
+    inventory_operation = "listar_itemsinventario"
+
+    def setup_mocks(self, mock_gspread, mock_get, mock_post,
+                    failing_inventory_calls=0):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_deposits_response.json") as f:
+            deposits_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_response = json.load(f)
+        self.inventory_data = inventory_response["response"]["data"]
+        self.inventory_calls = 0
+
+        def get_inventory_or_deposits(url, **kwargs):
+            payload = kwargs["json"]
+            if payload["service"]["operacion"] != self.inventory_operation:
+                return mock_requests_response(deposits_data)
+            self.inventory_calls += 1
+            if self.inventory_calls <= failing_inventory_calls:
+                overload_response = Mock(status_code=503)
+                overload_response.raise_for_status.side_effect = \
+                    HTTPError("503")
+                return overload_response
+            inventory_body = json.dumps(inventory_response).encode("utf-8")
+            response = mock_requests_response(inventory_response)
+            response.iter_content = Mock(return_value=iter([inventory_body]))
+            return response
+
+        mock_post.return_value = mock_requests_response(login_data)
+        mock_get.side_effect = get_inventory_or_deposits
+        mock_gspread.side_effect = lambda *args, **kwargs: GoogleSpreadMock()
+
+    def test_retries_overloaded_inventory_call(self, mock_gspread, mock_get,
+                                               mock_post, mock_sleep,
+                                               mock_end):
+        self.setup_mocks(mock_gspread, mock_get, mock_post,
+                         failing_inventory_calls=1)
+
+        diu = DepositInventoryUpdater()
+        diu.paste_deposit_inventory_to_gsheet(self.deposit_name,
+                                              self.spread_name)
+
+        self.assertEqual(self.inventory_calls, 2)
+        self.assertEqual(len(diu.df.index), len(self.inventory_data))
+        self.assertEqual(diu.df["Disponible"].tolist(),
+                         ["1.00000"] * len(self.inventory_data))
+
+    def test_cached_inventory_is_not_requested_again(self, mock_gspread,
+                                                     mock_get, mock_post,
+                                                     mock_sleep, mock_end):
+        self.setup_mocks(mock_gspread, mock_get, mock_post)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = ResponseCache(os.path.join(temp_dir, "cache.sqlite3"))
+            for run in range(2):
+                diu = DepositInventoryUpdater(cache=cache)
+                diu.paste_deposit_inventory_to_gsheet(self.deposit_name,
+                                                      self.spread_name)
+            cache.close()
+
+        self.assertEqual(self.inventory_calls, 1)
+        self.assertEqual(len(diu.df.index), len(self.inventory_data))
+
+
+@patch("test.inventory_updater_test.MultiDepositInventoryUpdater.end_program")
+@patch("inventory_updater.Caller.get_inventory_for")
+@patch("colppy_api.requests.Session.post")
+@patch("colppy_api.requests.Session.get")
+@patch("inventory_updater.GoogleSpread")
+class MultiDepositInventoryUpdaterTest(unittest.TestCase):
+    spread_name = "mock_name"
+
+    def setup_mocks(self, mock_gspread, mock_get, mock_post, mock_inv):
+        with open("test/data/login_response.json") as f:
+            login_data = json.load(f)
+        with open("test/data/list_deposits_response.json") as f:
+            deposits_data = json.load(f)
+        with open("test/data/list_inventory_response.json") as f:
+            inventory_response = json.load(f)
+            self.inventory_data = inventory_response["response"]["data"]
+
+        mock_post.return_value = mock_requests_response(login_data)
+        mock_get.return_value = mock_requests_response(deposits_data)
+        mock_inv.return_value = self.inventory_data
+        mock_gspread.return_value = GoogleSpreadMock()
+
+    def test_fills_all_deposits_in_one_pass(self, mock_gspread, mock_get,
+                                            mock_post, mock_inv, mock_end):
+        self.setup_mocks(mock_gspread, mock_get, mock_post, mock_inv)
+
+        mdiu = MultiDepositInventoryUpdater(max_in_flight=4)
+        mdiu.paste_deposits_inventory_to_gsheet("all", self.spread_name)
+
+        self.assertEqual(mock_get.call_count, len(self.inventory_data) + 1)
+        self.assertEqual(mdiu.deposit_names,
+                         ["Ikitoi General ", "Deposito Barloqui", "Local",
+                          "Ecommerce "])
+        self.assertEqual(mdiu.final_worksheet_name,
+                         "Depositos_" + mdiu.worksheet_date)
+        self.assertNotIn("Nombre", mdiu.df.columns)
+        self.assertEqual(mdiu.df["Disponible Local"].tolist(),
+                         ["1.00000"] * len(self.inventory_data))
+        self.assertEqual(mdiu.df["Disponible Deposito Barloqui"].tolist(),
+                         ["0.00000"] * len(self.inventory_data))
+        self.assertEqual(mdiu.spread.df_to_sheet_count, 2)
+        self.assertEqual(mdiu.spread.delete_sheet_count, 1)
+
+    def test_writes_one_sheet_per_deposit(self, mock_gspread, mock_get,
+                                          mock_post, mock_inv, mock_end):
+        self.setup_mocks(mock_gspread, mock_get, mock_post, mock_inv)
+
+        mdiu = MultiDepositInventoryUpdater()
+        mdiu.paste_deposits_inventory_to_gsheet(["Local",
+                                                 "Deposito Barloqui"],
+                                                self.spread_name,
+                                                one_sheet_per_deposit=True)
+        local_df = mdiu.get_df_for_deposit("Local")
+
+        self.assertEqual(mock_get.call_count, len(self.inventory_data) + 1)
+        self.assertEqual(mdiu.spread.df_to_sheet_count, 3)
+        self.assertEqual(mdiu.final_worksheet_name,
+                         "Deposito Barloqui_" + mdiu.worksheet_date)
+        self.assertEqual(list(local_df.columns),
+                         list(DepositInventoryUpdater.col_name_dict
+                              .values())[1:])
+        self.assertEqual(local_df["Nombre"].tolist(),
+                         ["Local"] * len(self.inventory_data))
+        self.assertEqual(local_df["Disponible"].tolist(),
+                         ["1.00000"] * len(self.inventory_data))
+
+    def test_fills_zeros_for_items_without_stock(self, mock_gspread,
+                                                 mock_get, mock_post,
+                                                 mock_inv, mock_end):
+        self.setup_mocks(mock_gspread, mock_get, mock_post, mock_inv)
+        items_with_stock = [item["idItem"] for item in self.inventory_data
+                            if float(item["disponibilidad"]) != 0]
+
+        mdiu = MultiDepositInventoryUpdater(skip_items_without_stock=True)
+        mdiu.paste_deposits_inventory_to_gsheet(["Local", "Ecommerce "],
+                                                self.spread_name)
+
+        self.assertEqual(mock_get.call_count, len(items_with_stock) + 1)
+        for item_id, row in mdiu.df.iterrows():
+            if item_id in items_with_stock:
+                self.assertEqual(row["Disponible Local"], "1.00000")
+            else:
+                self.assertEqual(row["Disponible Local"], "0.00000")
+            self.assertEqual(row["Disponible Ecommerce "], "0.00000")
+
+    def test_rejects_unknown_deposit(self, mock_gspread, mock_get,
+                                     mock_post, mock_inv, mock_end):
+        self.setup_mocks(mock_gspread, mock_get, mock_post, mock_inv)
+
+        mdiu = MultiDepositInventoryUpdater()
+        with self.assertRaises(ValueError):
+            mdiu.paste_deposits_inventory_to_gsheet(["Local", "Nowhere"],
+                                                    self.spread_name)
@@ -0,0 +1,122 @@
+import unittest
+from unittest.mock import patch, Mock
+import urllib.request
+import tempfile
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from metrics import MetricsRegistry
+from manipule_gsheets import GoogleSpread
+
+
+# TESTS
+#########################################################################
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def test_renders_counter_in_prometheus_format(self):
+        metrics = MetricsRegistry()
+        counter = metrics.counter("calls_total", "Calls.", ("method",))
+        counter.inc(method="get")
+        counter.inc(2, method="get")
+        counter.inc(method='say "hi"')
+        self.assertEqual(metrics.render(),
+                         "# HELP calls_total Calls.\n"
+                         "# TYPE calls_total counter\n"
+                         'calls_total{method="get"} 3.0\n'
+                         'calls_total{method="say \\"hi\\""} 1.0\n')
+
+    def test_renders_cumulative_histogram_buckets(self):
+        metrics = MetricsRegistry()
+        histogram = metrics.histogram("latency_seconds", "Latency.",
+                                      buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        lines = metrics.render().splitlines()
+        self.assertEqual(lines[2:], ['latency_seconds_bucket{le="0.1"} 2',
+                                     'latency_seconds_bucket{le="1.0"} 3',
+                                     'latency_seconds_bucket{le="+Inf"} 4',
+                                     "latency_seconds_sum 3.65",
+                                     "latency_seconds_count 4"])
+
+    def test_returns_same_metric_for_same_name(self):
+        metrics = MetricsRegistry()
+        counter = metrics.counter("calls_total", "Calls.", ("method",))
+        self.assertIs(metrics.counter("calls_total", "Calls.", ("method",)),
+                      counter)
+        with self.assertRaises(ValueError):
+            metrics.counter("calls_total", "Calls.", ("other",))
+        with self.assertRaises(ValueError):
+            metrics.histogram("calls_total", "Calls.", ("method",), (1,))
+
+    def test_raises_on_missing_label(self):
+        counter = MetricsRegistry().counter("calls_total", "Calls.",
+                                            ("method",))
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_writes_metrics_file(self):
+        metrics = MetricsRegistry()
+        metrics.counter("calls_total", "Calls.").inc()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "metrics", "colppy.prom")
+            metrics.start_file_writer(path, interval_in_secs=60)
+            metrics.stop_file_writer()
+            with open(path) as f:
+                self.assertIn("calls_total 1.0", f.read())
+            self.assertFalse(os.path.exists(path + ".tmp"))
+
+    def test_serves_metrics_over_http(self):
+        metrics = MetricsRegistry()
+        metrics.counter("calls_total", "Calls.").inc()
+        server = metrics.start_http_server(port=0)
+        try:
+            host, port = server.server_address[:2]
+            url = "http://%s:%d/metrics" % (host, port)
+            with urllib.request.urlopen(url) as response:
+                body = response.read().decode("utf-8")
+        finally:
+            metrics.stop_http_server()
+        self.assertIn("calls_total 1.0", body)
+
+    def test_busy_port_falls_back_to_file(self):
+        busy = MetricsRegistry()
+        server = busy.start_http_server(port=0)
+        metrics = MetricsRegistry()
+        metrics.counter("calls_total", "Calls.").inc()
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                path = os.path.join(temp_dir, "colppy.prom")
+                self.assertIsNone(metrics.start_exporter(
+                    server.server_address[1], path))
+                metrics.stop_file_writer()
+                with open(path) as f:
+                    self.assertIn("calls_total 1.0", f.read())
+        finally:
+            busy.stop_http_server()
+
+
+@patch("manipule_gsheets.Spread")
+class GoogleSpreadMetricsTest(unittest.TestCase):
+    def test_counts_sheets_calls_and_values(self, mock_spread):
+        metrics = MetricsRegistry()
+        spread = GoogleSpread("mock", creds=Mock(), metrics=metrics)
+        spread.update_cells("A1", "A3", ["a", "b", "c"])
+        mock_spread.return_value.find_sheet.side_effect = ValueError
+        with self.assertRaises(ValueError):
+            spread.find_sheet("missing")
+        self.assertEqual(spread.calls_counter
+                         .get_value(method="update_cells", result="ok"), 1)
+        self.assertEqual(spread.calls_counter
+                         .get_value(method="find_sheet", result="error"), 1)
+        self.assertEqual(spread.values_counter
+                         .get_value(method="update_cells"), 3)
+        self.assertEqual(spread.latency_histogram.get_count(method="open"),
+                         1)
+
+
+if __name__ == '__main__':
+    unittest.main()
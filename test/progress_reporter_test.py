@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import Mock
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from progress_reporter import ProgressReporter
+
+
+# MOCKED CLASSES AND FUNCTIONS
+#########################################################################
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+# TESTS
+#########################################################################
+
+
+class ProgressReporterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.logger = Mock()
+        self.progress = ProgressReporter(100, self.logger, every_secs=10,
+                                         clock=self.clock)
+
+    def test_reports_only_every_few_seconds(self):
+        for item in range(10):
+            self.clock.now += 1
+            self.progress.update()
+        self.assertEqual(self.logger.info.call_count, 1)
+        self.clock.now += 5
+        self.progress.update()
+        self.assertEqual(self.logger.info.call_count, 1)
+
+    def test_reports_rate_and_eta(self):
+        self.clock.now = 10
+        self.progress.update(20)
+        message, *args = self.logger.info.call_args[0]
+        self.assertEqual(message % tuple(args),
+                         "20 of 100 items done (20.0%). 2.0 items/sec. "
+                         "ETA 0:00:40.")
+
+    def test_always_reports_last_item(self):
+        self.progress.update(100)
+        self.assertEqual(self.logger.info.call_count, 1)
+        self.assertEqual(self.progress.get_eta_for(self.clock.now), 0)
+
+    def test_eta_unknown_before_any_time_passes(self):
+        self.progress.report()
+        message, *args = self.logger.info.call_args[0]
+        self.assertIn("ETA unknown.", message % tuple(args))
+
+
+if __name__ == '__main__':
+    unittest.main()
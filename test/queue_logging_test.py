@@ -0,0 +1,80 @@
+import unittest
+import logging
+import logging.handlers
+import io
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from queue_logging import QueueLogging
+
+
+# MOCKED CLASSES AND FUNCTIONS
+#########################################################################
+
+
+def get_logger_writing_to(name, stream):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    handler = logging.StreamHandler(stream)
+    handler.setLevel(logging.INFO)
+    handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+    logger.addHandler(handler)
+    return logger, handler
+
+
+# TESTS
+#########################################################################
+
+
+class QueueLoggingTest(unittest.TestCase):
+    def setUp(self):
+        self.first_stream = io.StringIO()
+        self.second_stream = io.StringIO()
+        self.first_logger, self.first_handler = get_logger_writing_to(
+            "queue_logging_test.first", self.first_stream)
+        self.second_logger, self.second_handler = get_logger_writing_to(
+            "queue_logging_test.second", self.second_stream)
+        self.logger_names = [self.first_logger.name, self.second_logger.name]
+
+    def tearDown(self):
+        for logger in (self.first_logger, self.second_logger):
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+
+    def test_routes_records_to_their_logger_handlers(self):
+        with QueueLogging(self.logger_names):
+            self.first_logger.info("Item %d done.", 1)
+            self.second_logger.warning("Slow answer.")
+        self.assertEqual(self.first_stream.getvalue(), "INFO: Item 1 done.\n")
+        self.assertEqual(self.second_stream.getvalue(),
+                         "WARNING: Slow answer.\n")
+
+    def test_logger_only_enqueues_while_started(self):
+        queue_logging = QueueLogging(self.logger_names)
+        queue_logging.start()
+        try:
+            handlers = self.first_logger.handlers
+            self.assertEqual(len(handlers), 1)
+            self.assertIsInstance(handlers[0], logging.handlers.QueueHandler)
+            self.first_logger.debug("Payload ok.")
+        finally:
+            queue_logging.stop()
+        self.assertEqual(self.first_stream.getvalue(), "")
+        self.assertIn(self.first_handler, self.first_logger.handlers)
+        for handler in self.first_logger.handlers:
+            self.assertNotIsInstance(handler, logging.handlers.QueueHandler)
+        self.assertEqual(self.first_logger.level, logging.DEBUG)
+
+    def test_finds_loggers_with_handlers(self):
+        queue_logging = QueueLogging()
+        logger_names = queue_logging.get_logger_names_with_handlers()
+        self.assertIn(self.first_logger.name, logger_names)
+        self.assertNotIn("queue_logging_test", logger_names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+import threading
+import time
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from rate_limiter import TokenBucket, AdaptiveConcurrencyLimiter, \
+    RequestThrottle
+
+
+# TESTS
+#########################################################################
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_raises_on_wrong_rate(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+
+    def test_burst_is_not_delayed(self):
+        bucket = TokenBucket(1, capacity=5)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_rate_is_enforced_after_burst(self):
+        bucket = TokenBucket(50, capacity=1)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_try_acquire_does_not_wait(self):
+        bucket = TokenBucket(1, capacity=2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+
+class AdaptiveConcurrencyLimiterTest(unittest.TestCase):
+    def test_raises_on_wrong_limits(self):
+        with self.assertRaises(ValueError):
+            AdaptiveConcurrencyLimiter(initial_limit=10, max_limit=5)
+
+    def test_overload_cuts_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+        limiter.acquire()
+        limiter.release(0.1, overloaded=True)
+        self.assertEqual(limiter.current_limit, 4)
+
+    def test_limit_never_below_min(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1)
+        for _ in range(5):
+            limiter.last_decrease = 0
+            limiter.report_overload()
+        self.assertEqual(limiter.current_limit, 1)
+
+    def test_simultaneous_failures_cut_limit_once(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+        limiter.best_latency = 10
+        limiter.report_overload()
+        limiter.report_overload()
+        self.assertEqual(limiter.current_limit, 4)
+
+    def test_healthy_latency_ramps_up_to_max(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=4)
+        for _ in range(50):
+            limiter.acquire()
+            limiter.release(0.1)
+        self.assertEqual(limiter.current_limit, 4)
+
+    def test_slow_latency_does_not_ramp_up(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2)
+        limiter.acquire()
+        limiter.release(0.1)
+        limit = limiter.limit
+        limiter.acquire()
+        limiter.release(5)
+        self.assertEqual(limiter.limit, limit)
+
+    def test_acquire_waits_for_a_free_slot(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire_in_thread():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire_in_thread)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release(0.01)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+
+class RequestThrottleTest(unittest.TestCase):
+    def test_shared_throttle_is_one_per_name(self):
+        throttle_1 = RequestThrottle.get_shared("test_shared")
+        throttle_2 = RequestThrottle.get_shared("test_shared")
+        other_throttle = RequestThrottle.get_shared("test_other")
+        self.assertIs(throttle_1, throttle_2)
+        self.assertIsNot(throttle_1, other_throttle)
+
+    def test_without_rate_only_limits_concurrency(self):
+        throttle = RequestThrottle(rate_per_sec=None)
+        self.assertIsNone(throttle.bucket)
+        start_time = throttle.acquire()
+        throttle.release(start_time)
+        self.assertEqual(throttle.concurrency.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
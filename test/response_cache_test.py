@@ -0,0 +1,118 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from response_cache import ResponseCache
+
+
+# MOCKED CLASSES AND FUNCTIONS
+#########################################################################
+
+
+def payload_for(operation, session_key="key", **parameters):
+    parameters["sesion"] = {"claveSesion": session_key,
+                            "usuario": "test_user@gmail.com"}
+    return {"auth": {"usuario": "dev"},
+            "service": {"provision": "Test", "operacion": operation},
+            "parameters": parameters}
+
+
+# TESTS
+#########################################################################
+
+
+class ResponseCacheTest(unittest.TestCase):
+    content = {"success": True, "data": [{"idItem": 1}]}
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "cache.sqlite3")
+        self.cache = ResponseCache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        self.folder.cleanup()
+
+    def test_get_returns_set_content(self):
+        payload = payload_for("listar_itemsinventario", idEmpresa="11111")
+        self.assertIsNone(self.cache.get_content_for(payload))
+        self.cache.set_content_for(payload, self.content)
+        self.assertEqual(self.cache.get_content_for(payload), self.content)
+
+    def test_session_key_does_not_change_cache_key(self):
+        payload_1 = payload_for("listar_empresa", session_key="key_1")
+        payload_2 = payload_for("listar_empresa", session_key="key_2")
+        self.cache.set_content_for(payload_1, self.content)
+        self.assertEqual(self.cache.get_content_for(payload_2), self.content)
+
+    def test_parameters_change_cache_key(self):
+        payload_1 = payload_for("listar_dispDeposito", idItem="1")
+        payload_2 = payload_for("listar_dispDeposito", idItem="2")
+        self.cache.set_content_for(payload_1, self.content)
+        self.assertIsNone(self.cache.get_content_for(payload_2))
+
+    def test_scope_changes_cache_key(self):
+        payload = payload_for("listar_empresa")
+        self.cache.set_content_for(payload, self.content, "staging:user")
+        self.assertIsNone(self.cache.get_content_for(payload,
+                                                     "production:user"))
+        self.assertEqual(self.cache.get_content_for(payload, "staging:user"),
+                         self.content)
+
+    def test_operations_without_ttl_are_not_cached(self):
+        payload = payload_for("iniciar_sesion")
+        self.cache.set_content_for(payload, self.content)
+        self.assertIsNone(self.cache.get_content_for(payload))
+
+    def test_expired_content_is_not_returned(self):
+        payload = payload_for("listar_itemsinventario")
+        with patch("response_cache.time.time", return_value=1000.0):
+            self.cache.set_content_for(payload, self.content)
+        ttl = self.cache.ttls_in_secs["listar_itemsinventario"]
+        with patch("response_cache.time.time",
+                   return_value=1000.0 + ttl + 1):
+            self.assertIsNone(self.cache.get_content_for(payload))
+
+    def test_content_persists_between_instances(self):
+        payload = payload_for("listar_empresa")
+        self.cache.set_content_for(payload, self.content)
+        other_cache = ResponseCache(self.path)
+        self.assertEqual(other_cache.get_content_for(payload), self.content)
+        other_cache.close()
+
+    def test_evicts_least_recently_used_over_max_size(self):
+        self.cache.max_size_in_bytes = 250
+        content = {"data": "x" * 100}
+        payloads = [payload_for("listar_dispDeposito", idItem=str(item_id))
+                    for item_id in range(3)]
+        with patch("response_cache.time.time", return_value=1000.0):
+            self.cache.set_content_for(payloads[0], content)
+        with patch("response_cache.time.time", return_value=1001.0):
+            self.cache.set_content_for(payloads[1], content)
+        with patch("response_cache.time.time", return_value=1002.0):
+            self.cache.get_content_for(payloads[0])
+        with patch("response_cache.time.time", return_value=1003.0):
+            self.cache.set_content_for(payloads[2], content)
+            self.assertIsNone(self.cache.get_content_for(payloads[1]))
+            self.assertEqual(self.cache.get_content_for(payloads[0]),
+                             content)
+        self.assertLessEqual(self.cache.get_size_in_bytes(), 250)
+
+    def test_clear_by_operation(self):
+        inventory_payload = payload_for("listar_itemsinventario")
+        companies_payload = payload_for("listar_empresa")
+        self.cache.set_content_for(inventory_payload, self.content)
+        self.cache.set_content_for(companies_payload, self.content)
+        self.cache.clear("listar_itemsinventario")
+        self.assertIsNone(self.cache.get_content_for(inventory_payload))
+        self.assertEqual(self.cache.get_content_for(companies_payload),
+                         self.content)
+
+
+if __name__ == '__main__':
+    unittest.main()
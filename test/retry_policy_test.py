@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from retry_policy import RetryPolicy, CircuitBreaker, CircuitOpenError
+
+
+# TESTS
+#########################################################################
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_raises_on_wrong_settings(self):
+        with self.assertRaises(ValueError):
+            RetryPolicy(max_attempts=0)
+        with self.assertRaises(ValueError):
+            RetryPolicy(base_delay_in_secs=10, max_delay_in_secs=1)
+
+    def test_delay_grows_exponentially(self):
+        retry_policy = RetryPolicy(base_delay_in_secs=1, jitter=False)
+        delays = [retry_policy.get_delay_for(attempt)
+                  for attempt in range(1, 5)]
+        self.assertEqual(delays, [1, 2, 4, 8])
+
+    def test_delay_is_capped(self):
+        retry_policy = RetryPolicy(base_delay_in_secs=1,
+                                   max_delay_in_secs=5, jitter=False)
+        self.assertEqual(retry_policy.get_delay_for(10), 5)
+
+    def test_jitter_stays_under_delay(self):
+        retry_policy = RetryPolicy(base_delay_in_secs=1)
+        for _ in range(100):
+            self.assertTrue(0 <= retry_policy.get_delay_for(3) <= 4)
+
+    def test_has_attempts_left(self):
+        retry_policy = RetryPolicy(max_attempts=2)
+        self.assertTrue(retry_policy.has_attempts_left(1))
+        self.assertFalse(retry_policy.has_attempts_left(2))
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=2)
+        circuit_breaker.record_failure()
+        circuit_breaker.check()
+        circuit_breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            circuit_breaker.check()
+
+    def test_success_resets_failures(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=2)
+        circuit_breaker.record_failure()
+        circuit_breaker.record_success()
+        circuit_breaker.record_failure()
+        circuit_breaker.check()
+
+    @patch("retry_policy.time.monotonic")
+    def test_half_opens_after_timeout(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        circuit_breaker = CircuitBreaker(failure_threshold=1,
+                                         reset_timeout_in_secs=60)
+        circuit_breaker.record_failure()
+        mock_monotonic.return_value = 161
+        circuit_breaker.check()
+        self.assertEqual(circuit_breaker.state, CircuitBreaker.half_open)
+        with self.assertRaises(CircuitOpenError):
+            circuit_breaker.check()
+        circuit_breaker.record_success()
+        circuit_breaker.check()
+
+    @patch("retry_policy.time.monotonic")
+    def test_failed_trial_opens_again(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        circuit_breaker = CircuitBreaker(failure_threshold=3,
+                                         reset_timeout_in_secs=60)
+        for _ in range(3):
+            circuit_breaker.record_failure()
+        mock_monotonic.return_value = 161
+        circuit_breaker.check()
+        circuit_breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            circuit_breaker.check()
+
+
+if __name__ == '__main__':
+    unittest.main()
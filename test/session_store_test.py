@@ -0,0 +1,58 @@
+import unittest
+import datetime
+import os
+import stat
+import sys
+import tempfile
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from session_store import SessionKeyStore
+
+
+# TESTS
+#########################################################################
+
+
+class SessionKeyStoreTest(unittest.TestCase):
+    account = "testing:test_user@gmail.com"
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "sessions.json")
+        self.store = SessionKeyStore(self.path)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_no_session_returns_none(self):
+        self.assertIsNone(self.store.get_session_for(self.account))
+
+    def test_saved_session_is_shared_between_instances(self):
+        login_time = datetime.datetime(2020, 1, 25, 10, 30)
+        self.store.save_session_for(self.account, "key", login_time)
+        other_store = SessionKeyStore(self.path)
+        self.assertEqual(other_store.get_session_for(self.account),
+                         ("key", login_time))
+
+    def test_store_file_is_private(self):
+        login_time = datetime.datetime(2020, 1, 25, 10, 30)
+        self.store.save_session_for(self.account, "key", login_time)
+        mode = stat.S_IMODE(os.stat(self.path).st_mode)
+        self.assertEqual(mode, 0o600)
+
+    def test_corrupt_file_is_ignored(self):
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        self.assertIsNone(self.store.get_session_for(self.account))
+
+    def test_save_inside_locked_block_does_not_deadlock(self):
+        login_time = datetime.datetime(2020, 1, 25, 10, 30)
+        with self.store.locked():
+            self.store.save_session_for(self.account, "key", login_time)
+        self.assertEqual(self.store.get_session_for(self.account)[0], "key")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import threading
+import tempfile
+import json
+import os
+import sys
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from tracing import Tracer
+
+
+# TESTS
+#########################################################################
+
+
+class TracerTest(unittest.TestCase):
+    def test_disabled_tracer_keeps_no_spans(self):
+        tracer = Tracer()
+        with tracer.span("outer") as span:
+            span.set_attribute("item_id", 1)
+        self.assertEqual(tracer.get_spans(), [])
+
+    def test_nested_spans_have_parents(self):
+        tracer = Tracer(enabled=True)
+        with tracer.span("outer", company_id="19459") as outer:
+            with tracer.span("inner") as inner:
+                pass
+        self.assertEqual(inner.parent_id, outer.span_id)
+        self.assertIsNone(outer.parent_id)
+        self.assertEqual(outer.attributes, {"company_id": "19459"})
+        self.assertEqual([span.name for span in tracer.get_spans()],
+                         ["inner", "outer"])
+        self.assertGreaterEqual(outer.duration_in_secs,
+                                inner.duration_in_secs)
+        self.assertIsNone(tracer.get_current_span())
+
+    def test_marks_span_with_error(self):
+        tracer = Tracer(enabled=True)
+        with self.assertRaises(KeyError):
+            with tracer.span("failing"):
+                raise KeyError("item")
+        self.assertEqual(tracer.get_spans()[0].attributes["error"],
+                         "KeyError")
+
+    def test_bound_function_runs_under_parent_in_other_thread(self):
+        tracer = Tracer(enabled=True)
+        worker_spans = []
+
+        def work():
+            with tracer.span("worker") as span:
+                worker_spans.append(span)
+
+        with tracer.span("outer") as outer:
+            thread = threading.Thread(target=tracer.bind_to_current_span(work))
+            thread.start()
+            thread.join()
+        self.assertEqual(worker_spans[0].parent_id, outer.span_id)
+        self.assertNotEqual(worker_spans[0].thread_id, outer.thread_id)
+
+    def test_drops_spans_over_limit(self):
+        tracer = Tracer(enabled=True, max_spans=2)
+        for number in range(3):
+            with tracer.span("span", number=number):
+                pass
+        self.assertEqual(len(tracer.get_spans()), 2)
+        self.assertEqual(tracer.dropped_spans, 1)
+
+    def test_exports_chrome_trace(self):
+        tracer = Tracer(enabled=True)
+
+        def work():
+            with tracer.span("colppy.get_deposits", item_id=10):
+                pass
+
+        with tracer.span("updater.run", spread=("a", "b")):
+            thread = threading.Thread(target=tracer.bind_to_current_span(work))
+            thread.start()
+            thread.join()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "traces", "run.json")
+            tracer.export_chrome_trace(path)
+            with open(path) as f:
+                trace = json.load(f)
+        events = trace["traceEvents"]
+        complete_events = {event["name"]: event for event in events
+                           if event["ph"] == "X"}
+        self.assertEqual(complete_events["colppy.get_deposits"]["cat"],
+                         "colppy")
+        self.assertEqual(complete_events["colppy.get_deposits"]["args"]
+                         ["parent_id"],
+                         complete_events["updater.run"]["args"]["span_id"])
+        self.assertEqual(complete_events["updater.run"]["args"]["spread"],
+                         "('a', 'b')")
+        self.assertEqual(sorted(event["ph"] for event in events
+                                if event.get("cat") == "flow"), ["f", "s"])
+        self.assertEqual(len([event for event in events
+                              if event["ph"] == "M"]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
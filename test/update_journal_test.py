@@ -0,0 +1,77 @@
+import unittest
+import os
+import sys
+import tempfile
+import inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from update_journal import UpdateJournal
+
+
+# TESTS
+#########################################################################
+
+
+class UpdateJournalTest(unittest.TestCase):
+    name = "test_iki_temp_Local_25-01-2020"
+    deposits = [{"nombre": "Local", "disponibilidad": "1.00000"}]
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.journal = UpdateJournal(self.folder.name)
+        self.journal.open(self.name)
+
+    def tearDown(self):
+        self.journal.close()
+        self.folder.cleanup()
+
+    def reopen_journal(self):
+        self.journal.close()
+        journal = UpdateJournal(self.folder.name)
+        journal.open(self.name)
+        return journal
+
+    def test_replays_synced_items(self):
+        self.journal.append(10963030, self.deposits)
+        self.journal.append(10963031, [])
+        self.journal.sync()
+        journal = self.reopen_journal()
+        self.assertEqual(journal.get_deposits_for(10963030), self.deposits)
+        self.assertEqual(journal.get_deposits_for("10963031"), [])
+        self.assertIsNone(journal.get_deposits_for(10963035))
+        journal.close()
+
+    def test_items_are_only_written_on_sync(self):
+        self.journal.append(10963030, self.deposits)
+        self.assertEqual(os.path.getsize(self.journal.path), 0)
+        self.journal.sync()
+        self.assertGreater(os.path.getsize(self.journal.path), 0)
+
+    def test_drops_line_cut_by_a_crash(self):
+        self.journal.append(10963030, self.deposits)
+        self.journal.sync()
+        with open(self.journal.path, "a") as f:
+            f.write('{"item_id": "10963031", "depos')
+        journal = self.reopen_journal()
+        journal.append(10963035, self.deposits)
+        journal.close()
+        journal = self.reopen_journal()
+        self.assertEqual(sorted(journal.item_deposits),
+                         ["10963030", "10963035"])
+        journal.close()
+
+    def test_remove_deletes_the_file(self):
+        self.journal.append(10963030, self.deposits)
+        self.journal.remove()
+        self.assertFalse(os.path.exists(self.journal.path))
+        self.assertIsNone(self.journal.get_deposits_for(10963030))
+
+    def test_name_is_safe_as_file_name(self):
+        self.journal.open("stock/2020 temp_Local")
+        self.assertEqual(os.path.dirname(self.journal.path),
+                         self.folder.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
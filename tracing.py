@@ -0,0 +1,234 @@
+# IMPORTS
+##############################################################################
+
+import itertools
+import json
+import os
+import threading
+import time
+import logging
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="tracing.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# CLASSES
+##############################################################################
+
+class Span():
+    __slots__ = ("tracer", "name", "span_id", "parent_id", "parent_thread_id",
+                 "thread_id", "attributes", "start_time", "end_time")
+
+    def __init__(self, tracer, name, span_id, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = None
+        self.parent_thread_id = None
+        if parent is not None:
+            self.parent_id = parent.span_id
+            self.parent_thread_id = parent.thread_id
+        self.thread_id = threading.get_ident()
+        self.attributes = attributes
+        self.start_time = None
+        self.end_time = None
+
+    def __enter__(self):
+        self.tracer.push(self)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end_time = time.perf_counter()
+        if exc_type:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.pop(self)
+        self.tracer.finish(self)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration_in_secs(self):
+        return self.end_time - self.start_time
+
+
+class NullSpan():
+    span_id = None
+    thread_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def set_attribute(self, key, value):
+        pass
+
+
+class Tracer():
+    # Disabled tracers hand out a shared span that does nothing, so spans
+    # can stay in hot paths.
+    shared_tracers = {}
+    shared_lock = threading.Lock()
+
+    def __init__(self, enabled=False, max_spans=1000000):
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped_spans = 0
+        self.thread_names = {}
+        self.span_ids = itertools.count(1)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.null_span = NullSpan()
+        self.origin = time.perf_counter()
+
+    @classmethod
+    def get_shared(cls, name="colppy_to_gsheets"):
+        with cls.shared_lock:
+            if name not in cls.shared_tracers:
+                cls.shared_tracers[name] = cls()
+            return cls.shared_tracers[name]
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, parent=None, **attributes):
+        if not self.enabled:
+            return self.null_span
+        if parent is None:
+            parent = self.get_current_span()
+        return Span(self, name, next(self.span_ids), parent, attributes)
+
+    def get_current_span(self):
+        stack = getattr(self.local, "stack", None)
+        if stack:
+            return stack[-1]
+        return None
+
+    def bind_to_current_span(self, function):
+        # Spans opened by the function in another thread become children
+        # of the span current here.
+        parent = self.get_current_span()
+        if parent is None:
+            return function
+
+        def call_under_parent(*args, **kwargs):
+            self.push(parent)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.pop(parent)
+        return call_under_parent
+
+    def push(self, span):
+        try:
+            self.local.stack.append(span)
+        except AttributeError:
+            self.local.stack = [span]
+
+    def pop(self, span):
+        stack = self.local.stack
+        if stack and stack[-1] is span:
+            stack.pop()
+        elif span in stack:
+            stack.remove(span)
+
+    def finish(self, span):
+        with self.lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped_spans += 1
+                return
+            self.spans.append(span)
+            if span.thread_id not in self.thread_names:
+                self.thread_names[span.thread_id] = \
+                    threading.current_thread().name
+
+    def get_spans(self):
+        with self.lock:
+            return list(self.spans)
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+            self.dropped_spans = 0
+
+    def get_chrome_trace_events(self):
+        process_id = os.getpid()
+        with self.lock:
+            spans = list(self.spans)
+            thread_names = dict(self.thread_names)
+        events = [{"name": "thread_name", "ph": "M", "pid": process_id,
+                   "tid": thread_id, "args": {"name": thread_name}}
+                  for thread_id, thread_name in thread_names.items()]
+        for span in spans:
+            events.append(self.get_complete_event_for(span, process_id))
+            if span.parent_thread_id is not None \
+                    and span.parent_thread_id != span.thread_id:
+                events.extend(self.get_flow_events_for(span, process_id))
+        return events
+
+    def get_complete_event_for(self, span, process_id):
+        args = {key: self.to_json_value(value)
+                for key, value in span.attributes.items()}
+        args.update({"span_id": span.span_id, "parent_id": span.parent_id})
+        return {"name": span.name, "cat": span.name.split(".")[0],
+                "ph": "X", "pid": process_id, "tid": span.thread_id,
+                "ts": self.to_microsecs(span.start_time),
+                "dur": (span.end_time - span.start_time) * 1e6,
+                "args": args}
+
+    def get_flow_events_for(self, span, process_id):
+        # Arrows from the parent thread to spans run by a worker thread.
+        timestamp = self.to_microsecs(span.start_time)
+        return [{"name": "spawn", "cat": "flow", "ph": "s",
+                 "id": span.span_id, "pid": process_id,
+                 "tid": span.parent_thread_id, "ts": timestamp},
+                {"name": "spawn", "cat": "flow", "ph": "f", "bp": "e",
+                 "id": span.span_id, "pid": process_id,
+                 "tid": span.thread_id, "ts": timestamp}]
+
+    def to_microsecs(self, perf_counter_time):
+        return (perf_counter_time - self.origin) * 1e6
+
+    def to_json_value(self, value):
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            return value
+        return str(value)
+
+    def export_chrome_trace(self, path):
+        # Loads in chrome://tracing and ui.perfetto.dev.
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        trace = {"traceEvents": self.get_chrome_trace_events(),
+                 "displayTimeUnit": "ms",
+                 "otherData": {"dropped_spans": self.dropped_spans}}
+        with open(path, "w") as f:
+            json.dump(trace, f)
+        logger.info("Trace with %d spans written to %s."
+                    % (len(self.spans), path))
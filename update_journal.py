@@ -0,0 +1,107 @@
+# IMPORTS
+##############################################################################
+
+import json
+import logging
+import os
+import re
+import threading
+
+
+# LOGGER
+##############################################################################
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+file_formatter = logging.Formatter("%(levelname)s: %(name)s: %(asctime)s: \
+    %(message)s")
+stream_formatter = logging.Formatter("%(levelname)s: %(message)s")
+
+file_handler = logging.FileHandler(filename="update_journal.log")
+file_handler.setLevel(logging.INFO)
+file_handler.setFormatter(file_formatter)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+stream_handler.setFormatter(stream_formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(stream_handler)
+
+
+# CLASSES
+##############################################################################
+
+class UpdateJournal():
+    # One append only file per update. Each line holds the deposits fetched
+    # for one item, so a crashed update can be replayed without the sheet.
+    def __init__(self, folder="cache/journals"):
+        self.folder = folder
+        self.path = None
+        self.file = None
+        self.item_deposits = {}
+        self.pending_lines = []
+        self.lock = threading.Lock()
+
+    def open(self, name):
+        self.close()
+        os.makedirs(self.folder, exist_ok=True)
+        self.path = os.path.join(self.folder,
+                                 re.sub(r"[^\w.-]+", "_", name) + ".jsonl")
+        self.item_deposits = self.read_item_deposits()
+        self.file = open(self.path, "a", encoding="utf-8")
+        logger.info("Journal %s opened with %d items.", self.path,
+                    len(self.item_deposits))
+
+    def read_item_deposits(self):
+        item_deposits = {}
+        if not os.path.exists(self.path):
+            return item_deposits
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line.decode("utf-8"))
+                    item_deposits[entry["item_id"]] = entry["deposits"]
+                except (ValueError, KeyError, TypeError):
+                    # Only the last line can be cut by a crash.
+                    logger.warning("Dropping broken journal line in %s.",
+                                   self.path)
+                    break
+                valid_size += len(line)
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+        return item_deposits
+
+    def get_deposits_for(self, item_id):
+        return self.item_deposits.get(str(item_id))
+
+    def append(self, item_id, deposits):
+        line = json.dumps({"item_id": str(item_id), "deposits": deposits})
+        with self.lock:
+            self.pending_lines.append(line + "\n")
+
+    def sync(self):
+        with self.lock:
+            if not self.file or not self.pending_lines:
+                return
+            self.file.write("".join(self.pending_lines))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending_lines = []
+
+    def close(self):
+        self.sync()
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def remove(self):
+        self.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+            logger.info("Journal %s removed.", self.path)
+        self.item_deposits = {}